@@ -0,0 +1,248 @@
+# BatchIO.py
+
+import array
+import asyncio
+import ctypes
+import ctypes.util
+import socket
+import struct
+import sys
+
+BATCH_SIZE = 32  # Datagrams moved by one recvmmsg/sendmmsg call
+MSG_DONTWAIT = 0x40
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)  # Linux UDP generic segmentation offload
+GSO_MAX_BYTES = 65000  # One GSO send must fit in a single UDP datagram before segmentation
+GSO_MAX_SEGMENTS = 64
+SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+SEGMENT_SIZE = struct.Struct("=H")
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)), ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+# Header fields are read and written through flat integer views of the arrays: far cheaper than ctypes attributes
+HEADER_WORDS = ctypes.sizeof(mmsghdr) // 4
+MSG_NAMELEN_WORD = (mmsghdr.msg_hdr.offset + msghdr.msg_namelen.offset) // 4
+MSG_LEN_WORD = mmsghdr.msg_len.offset // 4
+SIZE_T_CODE = "L" if ctypes.sizeof(ctypes.c_ulong) == ctypes.sizeof(ctypes.c_size_t) else "Q"
+IOVEC_WORDS = ctypes.sizeof(iovec) // ctypes.sizeof(ctypes.c_size_t)
+IOV_LEN_WORD = iovec.iov_len.offset // ctypes.sizeof(ctypes.c_size_t)
+
+
+def load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+libc = load_libc()
+MMSG_AVAILABLE = libc is not None
+
+
+def decode_sockaddr(raw, length):
+    """Turn a sockaddr_in or sockaddr_in6 into the (host, port) tuple socket.recvfrom returns."""
+    family = int.from_bytes(raw[0:2], sys.byteorder)
+    port = int.from_bytes(raw[2:4], "big")
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+    if family == socket.AF_INET6 and length >= 24:
+        return socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, 0, 0
+    return None
+
+
+class BatchSocket:
+    """Moves batches of datagrams through one UDP socket per system call.
+
+    recv_batch() drains up to BATCH_SIZE datagrams with recvmmsg. Outgoing
+    packets are packed into slots of a shared buffer by add() and sent
+    together by flush(): with UDP GSO when they share one size (a shorter
+    last one is allowed), otherwise with sendmmsg. A flush is scheduled for
+    the end of the current event loop iteration, so everything a sender
+    builds in one tick leaves in one call. Without recvmmsg/sendmmsg, or
+    once GSO is refused, it falls back to one call per datagram.
+    The socket must be non-blocking and, for sending, connected.
+    """
+
+    def __init__(self, sock, max_datagram_size, use_mmsg=MMSG_AVAILABLE, use_gso=MMSG_AVAILABLE):
+        self.sock = sock
+        self.max_datagram_size = max_datagram_size
+        self.use_mmsg = use_mmsg and MMSG_AVAILABLE
+        self.use_gso = use_gso
+        self.flush_scheduled = False
+        self.syscalls = 0  # Send and receive calls made, for comparing backends
+        self.datagrams_sent = 0
+        self.datagrams_received = 0
+
+        # Receive side: one slot per datagram, plus room for the sender's address
+        self.recv_buffer = bytearray(BATCH_SIZE * max_datagram_size)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.recv_names = (ctypes.c_char * (BATCH_SIZE * SOCKADDR_SIZE))()
+        self.recv_headers = self.headers_for(self.recv_buffer, self.recv_names)
+        self.recv_words = memoryview(self.recv_headers).cast("B").cast("I")
+        self.recv_namelens = memoryview(array.array("I", [SOCKADDR_SIZE] * BATCH_SIZE))
+        self.last_name = None  # Raw address of the last sender, and its decoded form
+        self.last_addr = None
+
+        # Send side: packets are packed straight into their slot
+        self.send_buffer = bytearray(BATCH_SIZE * max_datagram_size)
+        self.send_view = memoryview(self.send_buffer)
+        self.send_headers = self.headers_for(self.send_buffer, None)
+        self.send_iov_lens = memoryview(self.send_headers.iovecs).cast("B").cast(SIZE_T_CODE)
+        self.send_lengths = []
+
+    def headers_for(self, buffer, names):
+        headers = (mmsghdr * BATCH_SIZE)()
+        iovecs = (iovec * BATCH_SIZE)()
+        base = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+        for i in range(BATCH_SIZE):
+            iovecs[i].iov_base = base + i * self.max_datagram_size
+            iovecs[i].iov_len = self.max_datagram_size
+            headers[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            headers[i].msg_hdr.msg_iovlen = 1
+            if names is not None:
+                headers[i].msg_hdr.msg_name = ctypes.addressof(names) + i * SOCKADDR_SIZE
+        headers.iovecs = iovecs  # Keep the iovecs alive as long as the headers
+        return headers
+
+    def recv_batch(self):
+        """Return the (data, addr) datagrams waiting on the socket, without blocking."""
+        if not self.use_mmsg:
+            return self.recv_each()
+        words = self.recv_words
+        words[MSG_NAMELEN_WORD::HEADER_WORDS] = self.recv_namelens
+        count = libc.recvmmsg(self.sock.fileno(), self.recv_headers, BATCH_SIZE, MSG_DONTWAIT, None)
+        self.syscalls += 1
+        if count < 0:
+            errno = ctypes.get_errno()
+            if errno in (11, 4):  # EAGAIN, EINTR
+                return []
+            raise OSError(errno, f"recvmmsg failed: {errno}")
+        datagrams = []
+        names = self.recv_names.raw
+        for i in range(count):
+            start = i * self.max_datagram_size
+            namelen = words[i * HEADER_WORDS + MSG_NAMELEN_WORD]
+            name = names[i * SOCKADDR_SIZE:i * SOCKADDR_SIZE + namelen]
+            if name != self.last_name:  # Batches usually come from one peer: decode its address once
+                self.last_name, self.last_addr = name, decode_sockaddr(name, namelen)
+            datagrams.append((bytes(self.recv_view[start:start + words[i * HEADER_WORDS + MSG_LEN_WORD]]),
+                              self.last_addr))
+        self.datagrams_received += count
+        return datagrams
+
+    def recv_each(self):
+        datagrams = []
+        while len(datagrams) < BATCH_SIZE:
+            try:
+                datagrams.append(self.sock.recvfrom(self.max_datagram_size))
+            except BlockingIOError:
+                break
+            finally:
+                self.syscalls += 1
+        self.datagrams_received += len(datagrams)
+        return datagrams
+
+    @property
+    def full(self):
+        return len(self.send_lengths) == BATCH_SIZE
+
+    @property
+    def pending(self):
+        """Packets added but not yet sent."""
+        return len(self.send_lengths)
+
+    def add(self, packet):
+        """Pack a packet into the next free slot and return its size; flushes when the batch fills up."""
+        start = len(self.send_lengths) * self.max_datagram_size
+        size = packet.pack_into(self.send_view[start:start + self.max_datagram_size])
+        if not size:
+            return 0
+        self.send_lengths.append(size)
+        if self.full:
+            self.flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+        return size
+
+    def flush(self):
+        """Send every queued packet."""
+        self.flush_scheduled = False
+        lengths = self.send_lengths
+        if not lengths:
+            return
+        try:
+            if self.use_gso and self.can_segment(lengths):
+                self.send_segmented(lengths)
+            elif self.use_mmsg:
+                self.send_mmsg(lengths)
+            else:
+                self.send_each(lengths)
+        except BlockingIOError:
+            pass  # Socket buffer full: the datagrams are lost and loss recovery resends them
+        except OSError as e:
+            print(f"Error sending datagram batch: {e}")
+        self.datagrams_sent += len(lengths)
+        lengths.clear()
+
+    def can_segment(self, lengths):
+        return (len(lengths) > 1 and len(lengths) <= GSO_MAX_SEGMENTS and sum(lengths) <= GSO_MAX_BYTES and
+                all(length == lengths[0] for length in lengths[:-1]) and lengths[-1] <= lengths[0])
+
+    def send_segmented(self, lengths):
+        """Hand the kernel one large datagram that it cuts into lengths[0]-byte datagrams."""
+        buffers = [self.send_view[i * self.max_datagram_size:i * self.max_datagram_size + length]
+                   for i, length in enumerate(lengths)]
+        try:
+            self.sock.sendmsg(buffers, [(socket.SOL_UDP, UDP_SEGMENT, SEGMENT_SIZE.pack(lengths[0]))])
+            self.syscalls += 1
+        except OSError as e:
+            if isinstance(e, BlockingIOError):
+                raise
+            self.use_gso = False  # Not supported by this kernel or device: stop trying
+            self.syscalls += 1
+            if self.use_mmsg:
+                self.send_mmsg(lengths)
+            else:
+                self.send_each(lengths)
+
+    def send_mmsg(self, lengths):
+        self.send_iov_lens[IOV_LEN_WORD:len(lengths) * IOVEC_WORDS:IOVEC_WORDS] = memoryview(
+            array.array(SIZE_T_CODE, lengths))
+        sent = 0
+        while sent < len(lengths):
+            count = libc.sendmmsg(self.sock.fileno(), ctypes.byref(self.send_headers[sent]), len(lengths) - sent,
+                                  MSG_DONTWAIT)
+            self.syscalls += 1
+            if count < 0:
+                errno = ctypes.get_errno()
+                if errno == 11:  # EAGAIN
+                    raise BlockingIOError(errno, "sendmmsg would block")
+                raise OSError(errno, f"sendmmsg failed: {errno}")
+            sent += count
+
+    def send_each(self, lengths):
+        for i, length in enumerate(lengths):
+            start = i * self.max_datagram_size
+            self.syscalls += 1
+            self.sock.send(self.send_view[start:start + length])
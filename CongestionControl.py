@@ -0,0 +1,142 @@
+# CongestionControl.py
+
+from abc import ABC, abstractmethod
+
+INITIAL_WINDOW_PACKETS = 10
+MINIMUM_WINDOW_PACKETS = 2
+PACING_GAIN = 1.25  # Pace slightly above cwnd/RTT so the window, not the pacer, is the limit
+PACER_BURST_PACKETS = 4  # Packets the pacer may send back-to-back after being idle
+
+
+class CongestionController(ABC):
+    """Congestion window driven by the connection's ACK and loss events.
+
+    Subclasses decide how the window grows on acknowledgments and shrinks
+    on loss; the connection only asks can_send() and pacing_rate().
+    """
+
+    def __init__(self, max_datagram_size):
+        self.max_datagram_size = max_datagram_size
+        self.congestion_window = INITIAL_WINDOW_PACKETS * max_datagram_size
+        self.ssthresh = float('inf')
+        self.recovery_start_time = None  # Packets sent before this were sent before the last reduction
+
+    @property
+    def minimum_window(self):
+        return MINIMUM_WINDOW_PACKETS * self.max_datagram_size
+
+    def can_send(self, bytes_in_flight):
+        return bytes_in_flight < self.congestion_window
+
+    def pacing_rate(self, smoothed_rtt):
+        """Bytes per second that spread one congestion window across one RTT."""
+        return PACING_GAIN * self.congestion_window / max(smoothed_rtt, 0.001)
+
+    def in_recovery(self, sent_packet):
+        return self.recovery_start_time is not None and sent_packet.time_sent <= self.recovery_start_time
+
+    def on_packets_acked(self, acked, rtt, now):
+        for sent_packet in acked:
+            if self.in_recovery(sent_packet):
+                continue
+            if self.congestion_window < self.ssthresh:
+                self.congestion_window += sent_packet.size  # Slow start
+            else:
+                self.on_congestion_avoidance(sent_packet, rtt, now)
+
+    def on_packets_lost(self, lost, now):
+        if not lost:
+            return
+        # React once per round trip: losses of packets sent before the last reduction are already accounted for
+        if self.in_recovery(lost[-1]):
+            return
+        self.recovery_start_time = now
+        self.on_congestion_event(now)
+
+    @abstractmethod
+    def on_congestion_avoidance(self, sent_packet, rtt, now):
+        """Grow the window for an acknowledged packet once past slow start."""
+
+    @abstractmethod
+    def on_congestion_event(self, now):
+        """Shrink the window once per round trip with losses."""
+
+
+class NewReno(CongestionController):
+    """RFC 9002 NewReno: additive increase of one datagram per window, halve on loss."""
+
+    LOSS_REDUCTION_FACTOR = 0.5
+
+    def on_congestion_avoidance(self, sent_packet, rtt, now):
+        self.congestion_window += self.max_datagram_size * sent_packet.size / self.congestion_window
+
+    def on_congestion_event(self, now):
+        self.congestion_window = max(self.congestion_window * self.LOSS_REDUCTION_FACTOR, self.minimum_window)
+        self.ssthresh = self.congestion_window
+
+
+class Cubic(CongestionController):
+    """RFC 9438 CUBIC: window grows as a cubic function of time since the last loss."""
+
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, max_datagram_size):
+        super().__init__(max_datagram_size)
+        self.w_max = 0  # Window before the last reduction, in bytes
+        self.k = 0  # Seconds the cubic curve takes to climb back to w_max
+        self.epoch_start = None
+        self.w_est = 0  # Reno-friendly window estimate
+
+    def on_congestion_avoidance(self, sent_packet, rtt, now):
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = self.congestion_window
+            if self.congestion_window < self.w_max:
+                self.k = ((self.w_max - self.congestion_window) / self.max_datagram_size / self.C) ** (1 / 3)
+            else:
+                self.k = 0
+                self.w_max = self.congestion_window
+
+        t = now - self.epoch_start + (rtt.min_rtt or rtt.smoothed_rtt)
+        target = self.w_max + self.C * (t - self.k) ** 3 * self.max_datagram_size
+        target = min(target, 1.5 * self.congestion_window)
+
+        self.w_est += (self.max_datagram_size * 3 * (1 - self.BETA) / (1 + self.BETA) *
+                       sent_packet.size / self.congestion_window)
+        target = max(target, self.w_est)
+
+        if target > self.congestion_window:
+            self.congestion_window += (target - self.congestion_window) * sent_packet.size / self.congestion_window
+
+    def on_congestion_event(self, now):
+        if self.congestion_window < self.w_max:
+            self.w_max = self.congestion_window * (1 + self.BETA) / 2  # Fast convergence
+        else:
+            self.w_max = self.congestion_window
+        self.congestion_window = max(self.congestion_window * self.BETA, self.minimum_window)
+        self.ssthresh = self.congestion_window
+        self.epoch_start = None
+
+
+CONGESTION_CONTROLLERS = {
+    "newreno": NewReno,
+    "cubic": Cubic,
+}
+
+
+class Pacer:
+    """Token bucket that releases packets at a given byte rate with a small burst allowance."""
+
+    def __init__(self, max_datagram_size):
+        self.capacity = PACER_BURST_PACKETS * max_datagram_size
+        self.tokens = self.capacity
+        self.last_update = None
+
+    def delay(self, packet_size, rate, now):
+        """Charge packet_size bytes and return how long to wait before the next send."""
+        if self.last_update is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * rate)
+        self.last_update = now
+        self.tokens -= packet_size
+        return max(0, -self.tokens / rate)
@@ -0,0 +1,88 @@
+# FileSource.py
+
+import mmap
+import os
+
+KB = 1024
+READ_AHEAD = 64 * KB  # Bytes read from disk at a time
+
+
+class ChunkedFileSource:
+    """Reads a file on demand, keeping at most one read-ahead chunk in memory."""
+
+    def __init__(self, file_path, read_ahead=READ_AHEAD):
+        self.file_path = file_path
+        self.file = open(file_path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.read_ahead = read_ahead
+        self.buffer = memoryview(b'')
+        self.buffer_offset = 0  # File offset of buffer[0]
+
+    def read(self, offset, length):
+        """Return up to length bytes at offset as a view into the read-ahead chunk."""
+        buffer_end = self.buffer_offset + len(self.buffer)
+        if offset < self.buffer_offset or offset + length > buffer_end:
+            self.file.seek(offset)
+            self.buffer = memoryview(self.file.read(max(length, self.read_ahead)))
+            self.buffer_offset = offset
+        start = offset - self.buffer_offset
+        return self.buffer[start:start + length]
+
+    def close(self):
+        self.buffer = memoryview(b'')
+        self.file.close()
+
+
+shared_mappings = {}  # Real path -> [mmap, memoryview of it, reference count]
+
+
+def acquire_mapping(file_path):
+    """Return a read-only view of the file, mapping it once for all concurrent readers."""
+    key = os.path.realpath(file_path)
+    entry = shared_mappings.get(key)
+    if entry is None:
+        with open(key, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                mapping = None  # mmap cannot map an empty file
+                view = memoryview(b'')
+            else:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapping)
+        entry = shared_mappings[key] = [mapping, view, 0]
+    entry[2] += 1
+    return entry[1]
+
+
+def release_mapping(file_path):
+    key = os.path.realpath(file_path)
+    entry = shared_mappings.get(key)
+    if entry is None:
+        return
+    entry[2] -= 1
+    if entry[2] > 0:
+        return
+    del shared_mappings[key]
+    mapping, view, _ = entry
+    view.release()
+    if mapping is not None:
+        try:
+            mapping.close()
+        except BufferError:
+            pass  # Frames still hold slices; the mapping is unmapped when they are collected
+
+
+class MmapFileSource:
+    """Serves frame payloads as zero-copy slices of a memory map shared by every reader of the file."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.view = acquire_mapping(file_path)
+        self.size = len(self.view)
+
+    def read(self, offset, length):
+        return self.view[offset:offset + length]
+
+    def close(self):
+        if self.view is not None:
+            self.view = None
+            release_mapping(self.file_path)
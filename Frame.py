@@ -1,14 +1,36 @@
 # frame.py
 
 import struct
+from array import array
+from Varint import varint_size, pack_varint_into, unpack_varint_from
 
 HANDSHAKE = 1
 ACK = 2
 DATA = 4
 CLOSE = 8
+# Flow control frames carry a byte limit in the offset field and no data
+MAX_DATA = 16  # Connection-wide credit; stream_id is 0
+MAX_STREAM_DATA = 32  # Credit for one stream
+BLOCKED = 64  # Sender has data but no credit; stream_id 0 means blocked on the connection limit
+FLOW_CONTROL_FRAMES = (MAX_DATA, MAX_STREAM_DATA, BLOCKED)
+PADDING = 128  # Fills a path MTU probe up to the size being tested; the receiver ignores it
+
+FRAME_HEADER = struct.Struct('!BIIH')  # frame_type, stream_id, offset, length
+FRAME_H_SIZE = FRAME_HEADER.size
+# With varint encoding the type byte is followed by stream_id, offset and length as varints
+FRAME_H_MAX_VARINT_SIZE = 1 + 3 * 8
+
+
+def frame_header_size(stream_id, offset, length, varint=False):
+    """Bytes the header of a frame with these fields takes on the wire."""
+    if not varint:
+        return FRAME_H_SIZE
+    return 1 + varint_size(stream_id) + varint_size(offset) + varint_size(length)
+
 
-FRAME_H_SIZE = 9
 class Frame:
+    __slots__ = ("frame_type", "stream_id", "data", "offset", "length")
+
     def __init__(self, stream_id, data, offset, frame_type=DATA):
         self.frame_type = frame_type & 0xFF  # Ensure frame_type is 1 byte (max value 255)
         self.stream_id = stream_id
@@ -16,35 +38,106 @@ class Frame:
         self.offset = offset
         self.length = len(self.data)  # Length of the data only
 
-    def to_bytes(self):
+    def header_size(self, varint=False):
+        return frame_header_size(self.stream_id, self.offset, self.length, varint)
+
+    def to_bytes(self, varint=False):
         try:
+            if varint:
+                buffer = bytearray(self.header_size(varint) + self.length)
+                self.pack_into(buffer, 0, varint)
+                return bytes(buffer)
             # Pack the metadata using struct
-            metadata = struct.pack('!BIIH', self.frame_type, self.stream_id, self.offset, self.length)
+            metadata = FRAME_HEADER.pack(self.frame_type, self.stream_id, self.offset, self.length)
             # Append the actual data
             serialized_data = metadata + self.data
             return serialized_data
-        except struct.error as e:
+        except (struct.error, ValueError) as e:
             print(f"Error serializing frame to bytes: {e}")
             return b''
 
+    def pack_into(self, buffer, offset=0, varint=False):
+        """Write the frame into a writable buffer at offset and return the offset just past it."""
+        if varint:
+            buffer[offset] = self.frame_type
+            start = pack_varint_into(buffer, offset + 1, self.stream_id)
+            start = pack_varint_into(buffer, start, self.offset)
+            start = pack_varint_into(buffer, start, self.length)
+        else:
+            FRAME_HEADER.pack_into(buffer, offset, self.frame_type, self.stream_id, self.offset, self.length)
+            start = offset + FRAME_H_SIZE
+        end = start + self.length
+        buffer[start:end] = self.data
+        return end
+
     @staticmethod
-    def from_bytes(data):
+    def from_bytes(data, varint=False):
         try:
-            # Ensure there's enough data for the metadata
-            if len(data) < struct.calcsize('!BIIH'):
-                raise ValueError("Data too short to unpack frame metadata")
-
-            # Unpack the metadata
-            frame_type, stream_id, offset, length = struct.unpack('!BIIH', data[:struct.calcsize('!BIIH')])
-
-            frame_data = data[struct.calcsize('!BIIH'):struct.calcsize('!BIIH') + length]
-            # Ensure the length of the data matches the length in the metadata
-            if len(frame_data) != length:
-                raise ValueError("Incorrect frame data length")
-            
+            frame, end = Frame.unpack_from(data, 0, varint)
             # Return the frame and the remaining data
-            return Frame(stream_id, frame_data, offset, frame_type), data[struct.calcsize('!BIIH') + length:]
-        
-        except (struct.error, ValueError) as e:
+            return frame, data[end:]
+
+        except ValueError as e:
             print(f"Error deserializing frame from bytes: {e}")
             raise ValueError("Incorrect frame format")
+
+    @staticmethod
+    def unpack_from(buffer, offset=0, varint=False):
+        """Parse the frame starting at offset and return it with the offset just past it.
+
+        The payload is sliced from buffer as is, so a memoryview yields a
+        zero-copy view into the received datagram.
+        """
+        if varint:
+            try:
+                frame_type = buffer[offset]
+                stream_id, start = unpack_varint_from(buffer, offset + 1)
+                frame_offset, start = unpack_varint_from(buffer, start)
+                length, start = unpack_varint_from(buffer, start)
+            except (IndexError, struct.error):
+                raise ValueError("Data too short to unpack frame metadata")
+            end = start + length
+            if len(buffer) < end:
+                raise ValueError("Incorrect frame data length")
+            return Frame(stream_id, buffer[start:end], frame_offset, frame_type), end
+
+        start = offset + FRAME_H_SIZE
+        # Ensure there's enough data for the metadata
+        if len(buffer) < start:
+            raise ValueError("Data too short to unpack frame metadata")
+
+        # Unpack the metadata
+        frame_type, stream_id, frame_offset, length = FRAME_HEADER.unpack_from(buffer, offset)
+
+        end = start + length
+        # Ensure the length of the data matches the length in the metadata
+        if len(buffer) < end:
+            raise ValueError("Incorrect frame data length")
+
+        return Frame(stream_id, buffer[start:end], frame_offset, frame_type), end
+
+
+
+class FrameDescriptors(array):
+    """Frames without their payloads: frame_type, stream_id, offset and length, four integers each in one array.
+
+    Loss recovery keeps these for frames it can rebuild, such as stream
+    data that can be read from the stream's source again, instead of a
+    Frame object and a payload view per frame.
+    """
+    __slots__ = ()
+
+    def __new__(cls):
+        return super().__new__(cls, 'q')
+
+    def add(self, frame):
+        self.extend((frame.frame_type, frame.stream_id, frame.offset, frame.length))
+
+    def frames(self):
+        """Yield (frame_type, stream_id, offset, length) for every frame, in the order they were added."""
+        for i in range(0, len(self), 4):
+            yield self[i], self[i + 1], self[i + 2], self[i + 3]
+
+    @property
+    def last_frame_type(self):
+        return self[-4] if self else None
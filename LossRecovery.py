@@ -0,0 +1,271 @@
+# LossRecovery.py
+
+import struct
+from bisect import bisect_left, bisect_right
+from Varint import encode_varint, unpack_varint_from
+
+# Loss detection constants, following RFC 9002
+K_PACKET_THRESHOLD = 3  # Packets acknowledged after a packet before it is declared lost
+K_TIME_THRESHOLD = 9 / 8  # RTT multiplier after which an unacknowledged packet is lost
+K_GRANULARITY = 0.001  # Timer granularity in seconds
+INITIAL_RTT = 0.333  # RTT assumed before the first sample
+MAX_ACK_DELAY = 0.025  # Longest the receiver waits before acknowledging
+ACK_ELICITING_THRESHOLD = 2  # Acknowledge immediately after this many ack-eliciting packets
+MAX_ACK_RANGES = 32  # Ranges carried by one ACK frame
+MAX_PTO_COUNT = 10  # Consecutive probe timeouts before the peer is considered gone
+
+ACK_RANGE = struct.Struct('!II')  # first, last packet number (inclusive)
+
+
+def encode_ack_ranges(ranges, varint=False):
+    """Pack (first, last) ranges, largest first, into an ACK frame payload.
+
+    The varint form follows RFC 9000: the largest packet number and the
+    first range's length, then for every further range the gap below the
+    previous range and its length, which keeps the numbers small.
+    """
+    ranges = ranges[:MAX_ACK_RANGES]
+    if not varint:
+        return b''.join(ACK_RANGE.pack(first, last) for first, last in ranges)
+    if not ranges:
+        return b''
+    values = [ranges[0][1], ranges[0][1] - ranges[0][0]]
+    for (previous_first, _), (first, last) in zip(ranges, ranges[1:]):
+        values += [previous_first - last - 2, last - first]
+    return b''.join(encode_varint(value) for value in values)
+
+
+def decode_ack_ranges(data, varint=False):
+    if not varint:
+        if len(data) % ACK_RANGE.size:
+            raise ValueError("Incorrect ACK frame length")
+        return [ACK_RANGE.unpack_from(data, offset) for offset in range(0, len(data), ACK_RANGE.size)]
+
+    values = []
+    offset = 0
+    try:
+        while offset < len(data):
+            value, offset = unpack_varint_from(data, offset)
+            values.append(value)
+    except (IndexError, struct.error):
+        raise ValueError("Incorrect ACK frame length")
+    if len(values) % 2:
+        raise ValueError("Incorrect ACK frame length")
+    ranges = []
+    last = None
+    for i in range(0, len(values), 2):
+        last = values[i] if last is None else ranges[-1][0] - values[i] - 2
+        ranges.append((last - values[i + 1], last))
+    return ranges
+
+
+class ReceivedPacketRanges:
+    """Received packet numbers kept as merged inclusive ranges, newest ranges retained.
+
+    Memory is bounded by max_ranges whatever the number of packets. When the
+    oldest range is dropped, everything below the next one counts as
+    received from then on: a packet that old is discarded as a duplicate,
+    and the sender resends its frames in a new packet once it is declared lost.
+    """
+
+    def __init__(self, max_ranges=MAX_ACK_RANGES):
+        self.starts = []  # Ascending range starts
+        self.ends = []  # Inclusive range ends, parallel to starts
+        self.max_ranges = max_ranges
+        self.floor = 0  # Packet numbers below this are treated as received
+
+    def __contains__(self, packet_number):
+        """Whether packet_number was received before (or is too old to tell)."""
+        ends = self.ends
+        if not ends or packet_number > ends[-1]:
+            return packet_number < self.floor
+        if packet_number >= self.starts[-1]:
+            return True  # Inside the newest range, where nearly every packet lands
+        if packet_number < self.floor:
+            return True
+        index = bisect_right(self.starts, packet_number) - 1
+        return index >= 0 and ends[index] >= packet_number
+
+    def add(self, packet_number):
+        starts, ends = self.starts, self.ends
+        if ends and packet_number == ends[-1] + 1:
+            ends[-1] = packet_number  # In-order arrival extends the newest range
+            return
+        if packet_number < self.floor:
+            return
+
+        index = bisect_left(starts, packet_number)
+        if index < len(starts) and starts[index] == packet_number:
+            return
+        if index > 0 and ends[index - 1] >= packet_number:
+            return  # Already inside the previous range
+
+        joins_previous = index > 0 and ends[index - 1] == packet_number - 1
+        joins_next = index < len(starts) and starts[index] == packet_number + 1
+        if joins_previous and joins_next:
+            ends[index - 1] = ends[index]
+            del starts[index], ends[index]
+        elif joins_previous:
+            ends[index - 1] = packet_number
+        elif joins_next:
+            starts[index] = packet_number
+        else:
+            starts.insert(index, packet_number)
+            ends.insert(index, packet_number)
+            if len(starts) > self.max_ranges:
+                del starts[0], ends[0]  # Forget the oldest range
+                self.floor = starts[0]
+
+    def ack_ranges(self):
+        """Ranges as (first, last) pairs, largest packet numbers first."""
+        return list(zip(reversed(self.starts), reversed(self.ends)))
+
+    @property
+    def largest(self):
+        return self.ends[-1] if self.ends else None
+
+
+class SentPacket:
+    """An ack-eliciting packet in flight.
+
+    frames are the frames to resend as they are if the packet is lost;
+    descriptors, a FrameDescriptors or None, lists those the sender can
+    rebuild without keeping their payloads.
+    """
+    __slots__ = ("packet_number", "frames", "size", "time_sent", "descriptors")
+
+    def __init__(self, packet_number, frames, size, time_sent, descriptors=None):
+        self.packet_number = packet_number
+        self.frames = frames
+        self.size = size
+        self.time_sent = time_sent
+        self.descriptors = descriptors
+
+
+class RttEstimator:
+    def __init__(self):
+        self.latest_rtt = 0
+        self.smoothed_rtt = INITIAL_RTT
+        self.rttvar = INITIAL_RTT / 2
+        self.min_rtt = None
+
+    def update(self, sample, ack_delay):
+        self.latest_rtt = sample
+        if self.min_rtt is None:
+            self.min_rtt = sample
+            self.smoothed_rtt = sample
+            self.rttvar = sample / 2
+            return
+
+        self.min_rtt = min(self.min_rtt, sample)
+        ack_delay = min(ack_delay, MAX_ACK_DELAY)
+        if sample >= self.min_rtt + ack_delay:
+            sample -= ack_delay
+        self.rttvar = 3 / 4 * self.rttvar + 1 / 4 * abs(self.smoothed_rtt - sample)
+        self.smoothed_rtt = 7 / 8 * self.smoothed_rtt + 1 / 8 * sample
+
+    def pto(self):
+        return self.smoothed_rtt + max(4 * self.rttvar, K_GRANULARITY) + MAX_ACK_DELAY
+
+
+class LossRecovery:
+    """Sender-side bookkeeping of ack-eliciting packets in flight.
+
+    Packets are declared lost once K_PACKET_THRESHOLD later packets are
+    acknowledged or once they are older than K_TIME_THRESHOLD RTTs; if no
+    acknowledgment arrives at all, a probe timeout declares the oldest
+    packet lost so its frames are retransmitted.
+    """
+
+    def __init__(self):
+        self.sent_packets = {}  # Packet number -> SentPacket, in sending order
+        self.largest_acked = -1
+        self.bytes_in_flight = 0
+        self.rtt = RttEstimator()
+        self.pto_count = 0
+        self.loss_time = None  # When the earliest packet crosses the time threshold
+        self.time_of_last_sent = None
+        self.packets_lost = 0
+
+    def on_packet_sent(self, sent_packet):
+        self.sent_packets[sent_packet.packet_number] = sent_packet
+        self.bytes_in_flight += sent_packet.size
+        self.time_of_last_sent = sent_packet.time_sent
+
+    def on_ack_received(self, ranges, ack_delay, now):
+        """Process ACK ranges and return (acked, lost) lists of SentPacket.
+
+        The packet numbers in flight ascend in sending order, so one pass
+        over them alongside the ranges sorted by their first packet finds
+        every acknowledged packet without testing each one against every range.
+        """
+        if not ranges:
+            return [], []
+        ranges = sorted(ranges)
+        largest = max(last for _, last in ranges)
+        acked_numbers = []
+        index = 0
+        first, last = ranges[0]
+        for packet_number in self.sent_packets:
+            if packet_number > largest:
+                break
+            while packet_number > last:
+                index += 1  # Some later range reaches packet_number, since largest does
+                first, last = ranges[index]
+            if packet_number >= first:
+                acked_numbers.append(packet_number)
+        acked = [self.sent_packets.pop(packet_number) for packet_number in acked_numbers]
+
+        if not acked:
+            return [], []
+        for sent_packet in acked:
+            self.bytes_in_flight -= sent_packet.size
+        if largest > self.largest_acked:
+            self.largest_acked = largest
+            if acked[-1].packet_number == largest:
+                self.rtt.update(now - acked[-1].time_sent, ack_delay)
+        self.pto_count = 0
+        return acked, self.detect_lost_packets(now)
+
+    def detect_lost_packets(self, now):
+        self.loss_time = None
+        loss_delay = max(K_TIME_THRESHOLD * max(self.rtt.latest_rtt, self.rtt.smoothed_rtt), K_GRANULARITY)
+        lost_send_time = now - loss_delay
+        lost = []
+        for packet_number, sent_packet in self.sent_packets.items():
+            if packet_number > self.largest_acked:
+                break
+            if (sent_packet.time_sent <= lost_send_time or
+                    self.largest_acked - packet_number >= K_PACKET_THRESHOLD):
+                lost.append(sent_packet)
+            elif self.loss_time is None:
+                self.loss_time = sent_packet.time_sent + loss_delay
+        self.remove_lost(lost)
+        return lost
+
+    def remove_lost(self, lost):
+        for sent_packet in lost:
+            del self.sent_packets[sent_packet.packet_number]
+            self.bytes_in_flight -= sent_packet.size
+        self.packets_lost += len(lost)
+
+    def loss_detection_deadline(self):
+        """Absolute time of the next loss or probe timeout, or None when nothing is in flight."""
+        if self.loss_time is not None:
+            return self.loss_time
+        if not self.sent_packets:
+            return None
+        return self.time_of_last_sent + self.rtt.pto() * (2 ** self.pto_count)
+
+    def on_timeout(self, now):
+        """Handle an expired deadline and return the packets to retransmit."""
+        if self.loss_time is not None:
+            return self.detect_lost_packets(now)
+        if not self.sent_packets:
+            return []
+        # Probe timeout: nothing was acknowledged in time, resend the oldest packet
+        self.pto_count += 1
+        oldest = next(iter(self.sent_packets.values()))
+        self.remove_lost([oldest])
+        self.time_of_last_sent = now
+        return [oldest]
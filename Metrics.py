@@ -0,0 +1,235 @@
+# Metrics.py
+
+import asyncio
+import json
+import time
+from bisect import bisect_left
+from collections import deque
+
+SAMPLE_INTERVAL = 1.0  # Seconds between time series samples
+MAX_SAMPLES = 3600  # Samples kept per registry, an hour at one per second
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+# Histogram bucket upper bounds, in seconds
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+COMPLETION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    """A counter or gauge whose value is read from the code being measured only when it is sampled or exported.
+
+    read returns a number, or with a label a dict of numbers by label value
+    (one per stream, say). Nothing runs on the hot path: the counters it
+    reads are the attributes the connection keeps anyway.
+    """
+    __slots__ = ("name", "help", "kind", "read", "label")
+
+    def __init__(self, name, help, kind, read, label=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+        self.label = label
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets; observe() is one bisect and two additions."""
+    __slots__ = ("name", "help", "buckets", "counts", "sum", "count", "label")
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0
+        self.count = 0
+        self.label = None
+
+    @property
+    def kind(self):
+        return HISTOGRAM
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations, or None if empty."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class MetricsRegistry:
+    """Named metrics of one connection, sampled into a bounded per-second time series.
+
+    Every sample records the value of each counter and gauge and, for
+    counters, the rate since the previous sample, which turns byte counters
+    into instantaneous throughput.
+    """
+
+    def __init__(self, labels=None, max_samples=MAX_SAMPLES):
+        self.labels = dict(labels or {})
+        self.metrics = {}
+        self.samples = deque(maxlen=max_samples)
+        self.last_sample = None  # (time, values) of the previous sample, for rates
+
+    def counter(self, name, help, read, label=None):
+        return self.add(Metric(name, help, COUNTER, read, label))
+
+    def gauge(self, name, help, read, label=None):
+        return self.add(Metric(name, help, GAUGE, read, label))
+
+    def histogram(self, name, help, buckets):
+        return self.add(Histogram(name, help, buckets))
+
+    def add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def values(self):
+        """Current value of every counter and gauge."""
+        return {name: metric.read() for name, metric in self.metrics.items() if metric.kind != HISTOGRAM}
+
+    def sample(self, now=None):
+        """Append the current values and counter rates to the time series and return the sample."""
+        now = time.time() if now is None else now
+        values = self.values()
+        rates = {}
+        if self.last_sample is not None:
+            then, previous = self.last_sample
+            elapsed = now - then
+            if elapsed > 0:
+                for name, metric in self.metrics.items():
+                    if metric.kind == COUNTER:
+                        rates[name] = rate(values[name], previous.get(name), elapsed)
+        self.last_sample = (now, values)
+        sample = {"time": now, "values": values, "rates": rates}
+        self.samples.append(sample)
+        return sample
+
+    def to_dict(self):
+        return {
+            "labels": self.labels,
+            "values": self.values(),
+            "histograms": {name: metric.to_dict() for name, metric in self.metrics.items()
+                           if metric.kind == HISTOGRAM},
+            "time_series": list(self.samples),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self):
+        return prometheus_text([self])
+
+
+def prometheus_text(registries):
+    """Registries in the Prometheus text exposition format, each metric family described once."""
+    families = {}
+    for registry in registries:
+        for name, metric in registry.metrics.items():
+            families.setdefault(name, []).append((registry.labels, metric))
+
+    lines = []
+    for name, members in families.items():
+        lines.append(f"# HELP {name} {members[0][1].help}")
+        lines.append(f"# TYPE {name} {members[0][1].kind}")
+        for labels, metric in members:
+            if metric.kind == HISTOGRAM:
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, le=format_value(bound))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(metric.sum)}")
+                lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+                continue
+            value = metric.read()
+            if metric.label is None:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            else:
+                for label_value, item in value.items():
+                    lines.append(f"{name}{format_labels(labels, **{metric.label: label_value})} {format_value(item)}")
+    return "\n".join(lines) + "\n"
+
+
+def rate(value, previous, elapsed):
+    """Per-second change of a counter, or of each labeled counter in a dict; previous is None at first."""
+    if isinstance(value, dict):
+        previous = previous or {}
+        return {key: (item - previous.get(key, 0)) / elapsed for key, item in value.items()}
+    return (value - (previous or 0)) / elapsed
+
+
+def format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsServer:
+    """Serves registries over HTTP on a local port: Prometheus text at /metrics, JSON at /metrics.json.
+
+    registries is a callable returning the registries to export, read on
+    every request, so connections that come and go are picked up.
+    """
+
+    def __init__(self, registries, host='127.0.0.1', port=0):
+        self.registries = registries
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        """Start serving and return the (host, port) bound."""
+        self.server = await asyncio.start_server(self.handle_request, self.host, self.port)
+        return self.server.sockets[0].getsockname()
+
+    async def handle_request(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Headers are not needed
+            parts = request_line.decode(errors="replace").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            registries = list(self.registries())
+            if path == "/metrics":
+                status, content_type = "200 OK", "text/plain; version=0.0.4"
+                body = prometheus_text(registries)
+            elif path == "/metrics.json":
+                status, content_type = "200 OK", "application/json"
+                body = json.dumps([registry.to_dict() for registry in registries])
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+            data = body.encode()
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+            await writer.drain()
+        except Exception as e:
+            print(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
@@ -2,9 +2,27 @@
 
 import struct
 from Frame import Frame
+from Varint import varint_size, pack_varint_into, unpack_varint_from
+
+LONG_HEADER = struct.Struct("!BIII")  # flags, src_con_id, dest_con_id, packet_number
+SHORT_HEADER = struct.Struct("!BII")  # flags, dest_con_id, packet_number
+VARINT_SHORT_HEADER = struct.Struct("!BI")  # flags, dest_con_id; a varint packet number follows
+
+# Short-header flag: packet number, frame headers and ACK ranges use varints.
+# Long-header (handshake) packets always use the fixed format, so any peer can read them.
+VARINT_FLAG = 0x40
+
+PACKET_H_MAX_SIZE = LONG_HEADER.size  # A varint short header is at most 1 + 4 + 8 bytes as well
+
+
+def short_header_size(packet_number, varint=False):
+    """Bytes the short header of a packet with this number takes on the wire."""
+    return VARINT_SHORT_HEADER.size + varint_size(packet_number) if varint else SHORT_HEADER.size
+
 
-PACKET_H_MAX_SIZE = 13
 class Packet:
+    __slots__ = ("header_form", "flags", "src_con_id", "dest_con_id", "packet_number", "frames")
+
     def __init__(self, header_form, flags, dest_con_id, packet_number, src_con_id=None, frames=None):
         self.header_form = header_form
         self.flags = flags
@@ -13,19 +31,25 @@ class Packet:
         self.packet_number = packet_number
         self.frames = frames if frames is not None else []
 
+    @property
+    def varint(self):
+        return self.src_con_id is None and bool(self.flags & VARINT_FLAG)
+
     def to_bytes(self):
+        if self.varint:
+            buffer = bytearray(VARINT_SHORT_HEADER.size + 8 +
+                               sum(frame.header_size(True) + frame.length for frame in self.frames))
+            return bytes(buffer[:self.pack_into(buffer)])
         try:
             if self.src_con_id is not None:
-                header = struct.pack(
-                    "!BIII",
+                header = LONG_HEADER.pack(
                     (self.header_form << 7) | (self.flags & 0x7F),
                     self.src_con_id,
                     self.dest_con_id,
                     self.packet_number
                 )
             else:
-                header = struct.pack(
-                    "!BII",
+                header = SHORT_HEADER.pack(
                     (self.header_form << 7) | (self.flags & 0x7F),
                     self.dest_con_id,
                     self.packet_number
@@ -37,29 +61,68 @@ class Packet:
             print(f"Error serializing packet to bytes: {e}")
             return b''
 
+    def pack_into(self, buffer, offset=0):
+        """Serialize header and frames straight into buffer, copying each payload once.
+
+        Returns the number of bytes written, or 0 if the packet does not fit.
+        """
+        try:
+            view = memoryview(buffer)  # Slice assignment on a view never resizes the buffer
+            first_byte = (self.header_form << 7) | (self.flags & 0x7F)
+            varint = self.varint
+            if self.src_con_id is not None:
+                LONG_HEADER.pack_into(view, offset, first_byte, self.src_con_id, self.dest_con_id, self.packet_number)
+                end = offset + LONG_HEADER.size
+            elif varint:
+                VARINT_SHORT_HEADER.pack_into(view, offset, first_byte, self.dest_con_id)
+                end = pack_varint_into(view, offset + VARINT_SHORT_HEADER.size, self.packet_number)
+            else:
+                SHORT_HEADER.pack_into(view, offset, first_byte, self.dest_con_id, self.packet_number)
+                end = offset + SHORT_HEADER.size
+
+            for frame in self.frames:
+                end = frame.pack_into(view, end, varint)
+            return end - offset
+        except (struct.error, ValueError) as e:
+            print(f"Error serializing packet into buffer: {e}")
+            return 0
+
     @staticmethod
-    def from_bytes(data):
+    def from_bytes(data, zero_copy=False):
+        """Parse a datagram in a single pass over a memoryview.
+
+        With zero_copy=True frame payloads are memoryviews into data instead
+        of bytes copies; they stay valid as long as data is not modified.
+        """
         try:
-            header_form = data[0] >> 7
-            flags = data[0] & 0x7F
+            view = memoryview(data)
+            header_form = view[0] >> 7
+            flags = view[0] & 0x7F
 
+            varint = False
             if header_form == 1:
-                src_con_id = struct.unpack("!I", data[1:5])[0]
-                dest_con_id = struct.unpack("!I", data[5:9])[0]
-                packet_number = struct.unpack("!I", data[9:13])[0]
-                frames_data = data[13:]
+                _, src_con_id, dest_con_id, packet_number = LONG_HEADER.unpack_from(view)
+                offset = LONG_HEADER.size
+            elif flags & VARINT_FLAG:
+                varint = True
+                _, dest_con_id = VARINT_SHORT_HEADER.unpack_from(view)
+                packet_number, offset = unpack_varint_from(view, VARINT_SHORT_HEADER.size)
+                src_con_id = None
             else:
-                dest_con_id = struct.unpack("!I", data[1:5])[0]
-                packet_number = struct.unpack("!I", data[5:9])[0]
-                frames_data = data[9:]
+                _, dest_con_id, packet_number = SHORT_HEADER.unpack_from(view)
+                src_con_id = None
+                offset = SHORT_HEADER.size
 
             frames = []
-            while frames_data:
-                frame, frames_data = Frame.from_bytes(frames_data)
+            end = len(view)
+            while offset < end:
+                frame, offset = Frame.unpack_from(view, offset, varint)
+                if not zero_copy:
+                    frame.data = bytes(frame.data)
                 frames.append(frame)
 
-            return Packet(header_form, flags, dest_con_id, packet_number, src_con_id if header_form == 1 else None, frames)
-        except (struct.error, ValueError) as e:
+            return Packet(header_form, flags, dest_con_id, packet_number, src_con_id, frames)
+        except (struct.error, ValueError, IndexError) as e:
             print(f"Error deserializing packet from bytes: {e}")
             raise ValueError("Incorrect packet format")
 
@@ -0,0 +1,104 @@
+# PathMtu.py
+
+import socket
+
+BASE_PACKET_SIZE = 1200  # Every QUIC path must carry 1200-byte UDP payloads (RFC 9000, section 14)
+MAX_PROBES = 3  # Lost probes of one size before it is considered too large
+SEARCH_PRECISION = 16  # Stop searching once the untried range is narrower than this
+BLACK_HOLE_THRESHOLD = 3  # Full-size packets lost in a row before falling back to BASE_PACKET_SIZE
+
+# Linux: send with DF set and without the kernel's own path MTU cache, so probes are never fragmented
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)
+
+
+def set_dont_fragment(sock):
+    """Ask the kernel to send datagrams from sock unfragmented; quietly does nothing where unsupported."""
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    except OSError:
+        pass
+
+
+class PathMtuDiscovery:
+    """Datagram packetization layer path MTU discovery (RFC 8899) for one connection.
+
+    packet_size is the largest UDP payload known to reach the peer. It
+    starts at base_size and is raised by a binary search between it and
+    max_size: the connection sends one padded probe packet of
+    next_probe_size() at a time, and a probe that is acknowledged raises
+    packet_size while MAX_PROBES lost probes of one size lower the top of
+    the search. Probes are not retransmitted and their loss is not
+    congestion. If BLACK_HOLE_THRESHOLD full-size packets are lost without
+    any full-size packet getting through, the path has shrunk: packet_size
+    falls back to base_size and the search starts again below the old size.
+    """
+
+    def __init__(self, max_size, base_size=BASE_PACKET_SIZE, enabled=True):
+        self.base_size = min(base_size, max_size)
+        self.max_size = max_size
+        self.enabled = enabled
+        self.packet_size = self.base_size if enabled else max_size
+        self.search_high = max_size  # Largest size not yet shown to be too large
+        self.probe_size = None  # Size of the probe in flight
+        self.probe_failures = 0  # Lost probes of the current size
+        self.large_packets_lost = 0  # Full-size packets lost since one was last acknowledged
+        self.probes_sent = 0
+        self.black_holes = 0
+
+    @property
+    def searching(self):
+        return self.enabled and self.search_high - self.packet_size >= SEARCH_PRECISION
+
+    def set_max_size(self, size):
+        """Lower the ceiling to what the peer said it can receive."""
+        self.max_size = min(self.max_size, max(size, self.base_size))
+        self.search_high = min(self.search_high, self.max_size)
+        self.packet_size = min(self.packet_size, self.max_size)
+
+    def next_probe_size(self):
+        """Size of the next probe to send, or None while one is in flight or the search is over."""
+        if self.probe_size is not None or not self.searching:
+            return None
+        return (self.packet_size + self.search_high + 1) // 2
+
+    def on_probe_sent(self, size):
+        self.probe_size = size
+        self.probes_sent += 1
+
+    def on_probe_acked(self, size):
+        """Returns True if packet_size grew."""
+        if size == self.probe_size:
+            self.probe_size = None
+            self.probe_failures = 0
+        if size <= self.packet_size or size > self.search_high:
+            return False  # A late answer to a search that has moved on
+        self.packet_size = size
+        return True
+
+    def on_probe_lost(self, size):
+        if size != self.probe_size:
+            return
+        self.probe_size = None
+        self.probe_failures += 1
+        if self.probe_failures >= MAX_PROBES:
+            self.probe_failures = 0
+            self.search_high = size - 1
+
+    def on_packets_acked_and_lost(self, acked_sizes, lost_sizes):
+        """Watch regular packets for a black hole. Returns True if packet_size fell back."""
+        if not self.enabled or self.packet_size <= self.base_size:
+            return False
+        if any(size > self.base_size for size in acked_sizes):
+            self.large_packets_lost = 0  # Full-size packets still get through: losses are congestion
+            return False
+        self.large_packets_lost += sum(size > self.base_size for size in lost_sizes)
+        if self.large_packets_lost < BLACK_HOLE_THRESHOLD:
+            return False
+        self.black_holes += 1
+        self.large_packets_lost = 0
+        self.search_high = self.packet_size - 1
+        self.packet_size = self.base_size
+        self.probe_size = None
+        self.probe_failures = 0
+        return True
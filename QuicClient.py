@@ -1,26 +1,120 @@
 # quic_client.py
 
 import asyncio
+import glob
+import json
+import os
 from QuicConnection import QuicConnection , KB, MB
 from sys import argv
 import socket
 async def run_client(client , num_of_streams):
     """Function to run the QUIC client operations."""
     await client.connect()
-    await client.start_streams_request(stream_count=num_of_streams)
+    await client.start_streams_request(stream_count=num_of_streams, spill_to_disk=True)
 
     try:
-        while not client.closed:
+        while True:
             frame = await client.recv()
-            if frame:
-                print(f"Received frame from server: {frame.data}")
-            await asyncio.sleep(0.1)
+            if frame is None:
+                break  # The connection closed
+            print(f"Received frame from server: {frame.data}")
     except asyncio.CancelledError:
         print("Connection is Closed, Printing Statistics and graphs")
     except Exception as e:
         print(f"Quic client error: {e}")
 
 
+def format_throughput(bytes_per_sec):
+    if bytes_per_sec < KB:
+        return f"{bytes_per_sec:.2f} bytes/sec"
+    if bytes_per_sec < MB:
+        return f"{bytes_per_sec/KB:.2f} KB/sec"
+    return f"{bytes_per_sec/MB:.2f} MB/sec"
+
+
+def transfer_totals(metrics):
+    """(bytes received, frames received, seconds) of a client's transfer, from its metrics."""
+    values = metrics["values"]
+    return (sum(values["quic_stream_bytes_received"].values()), sum(values["quic_stream_frames_received"].values()),
+            values["quic_transfer_seconds"])
+
+
+def write_stats(metrics, stream_count, directory="stats"):
+    """Write stats/client_N_streams_stats.txt and the metrics it is computed from, client_N_streams_metrics.json.
+
+    metrics is a connection's MetricsRegistry.to_dict(), live or loaded
+    back from an earlier metrics file.
+    """
+    values = metrics["values"]
+    with open(f"{directory}/client_{stream_count}_streams_metrics.json", "w") as f:
+        json.dump(metrics, f)
+
+    durations = values["quic_stream_duration_seconds"]
+    with open(f"{directory}/client_{stream_count}_streams_stats.txt", "w") as f:
+        for stream_id, frames_received in values["quic_stream_frames_received"].items():
+            bytes_received = values["quic_stream_bytes_received"][stream_id]
+            f.write(f"Stream {stream_id}:\n")
+            f.write(f"Frames received: {frames_received}\n")
+            f.write(f"Bytes received: {bytes_received}\n")
+            if stream_id in durations:
+                duration = durations[stream_id]
+                f.write(f"Time taken: {duration:.2f} seconds\n\n")
+                f.write(f"Avg. Bytes Throughput: {bytes_received/duration:.2f} bytes/sec\n\n")
+                f.write(f"Avg. Frames Throughput: {frames_received/duration:.2f} frames/sec\n\n")
+
+        total_bytes_received, total_frames_received, total_time = transfer_totals(metrics)
+        f.write(f"Total bytes sent: {values['quic_bytes_sent']}\n")
+        f.write(f"Total bytes received: {total_bytes_received}\n")
+        f.write(f"Total frames received: {total_frames_received}\n")
+        f.write(f"Total time taken: {total_time:.2f} seconds\n")
+        print(f"Total bytes sent: {values['quic_bytes_sent']}")
+        print(f"Total bytes received: {total_bytes_received}")
+        print(f"Total frames received: {total_frames_received}")
+        print(f"Total time taken: {total_time:.2f} seconds")
+        if total_time:
+            f.write(f"Total Avg. Frames Throughput: {round(total_frames_received/total_time)} frames/sec\n\n")
+            f.write(f"Total Avg. Bytes Throughput: {format_throughput(total_bytes_received/total_time)}\n")
+            print(f"Total Avg. Frames Throughput: {round(total_frames_received/total_time)} frames/sec")
+            print(f"Total Avg. Bytes Throughput: {format_throughput(total_bytes_received/total_time)}")
+
+
+def plot_graph(directory="stats"):
+    """Redraw stats/Graph.png, KB/sec and frames/sec by stream count, from every client_N_streams_metrics.json.
+
+    Needs matplotlib; without it the graph is left as it is.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, not redrawing the graph.")
+        return False
+
+    results = {}
+    for path in glob.glob(f"{directory}/client_*_streams_metrics.json"):
+        stream_count = int(os.path.basename(path).split("_")[1])
+        with open(path) as f:
+            total_bytes, total_frames, total_time = transfer_totals(json.load(f))
+        if total_time:
+            results[stream_count] = (total_bytes / total_time / KB, total_frames / total_time)
+    if not results:
+        return False
+
+    counts = sorted(results)
+    positions = range(len(counts))
+    figure, axes = plt.subplots(figsize=(12, 5))
+    axes.bar([p - 0.2 for p in positions], [results[n][0] for n in counts], 0.4, label="KB/sec", color="green")
+    axes.bar([p + 0.2 for p in positions], [results[n][1] for n in counts], 0.4, label="Frames/sec", color="orange")
+    axes.set_xticks(list(positions), [str(n) for n in counts])
+    axes.set_xlabel("Number of streams")
+    axes.set_title("Experiment Results")
+    axes.legend()
+    figure.savefig(f"{directory}/Graph.png")
+    plt.close(figure)
+    return True
+
+
 async def main(host, server_port, num_of_streams):
     """Main function to initialize and run the client."""
     client = QuicConnection(r_addr=(host, server_port))
@@ -64,49 +158,8 @@ if __name__ == "__main__":
     if client is None:
         exit(1)
     # print the statistics
-
-    with open(f"stats/client_{client.streams.__len__()}_streams_stats.txt", "w") as f:
-        for stream in client.streams.values():
-            f.write(f"Stream {stream.stream_id}:\n")
-            f.write(f"Frames received: {stream.frames_received}\n")
-            f.write(f"Bytes received: {stream.bytes_received}\n")
-            f.write(
-                f"Time taken: {(stream.etime - stream.stime):.2f} seconds\n\n")
-            f.write(
-                f"Avg. Bytes Throughput: {stream.bytes_received/(stream.etime - stream.stime):.2f} bytes/sec\n\n")
-            f.write(
-                f"Avg. Frames Throughput: {stream.frames_received/(stream.etime - stream.stime):.2f} frames/sec\n\n")
-
-            stream.print_stats()
-            print()
-
-        total_bytes_received = sum(
-            stream.bytes_received for stream in client.streams.values())
-        total_frames_received = sum(
-            stream.frames_received for stream in client.streams.values())
-
-        f.write(f"Total bytes sent: {client.bytes_sent}\n")
-        f.write(f"Total bytes received: {total_bytes_received}\n")
-        f.write(f"Total frames received: {total_frames_received}\n")
-        f.write(
-            f"Total time taken: {(client.etime - client.stime):.2f} seconds\n")
-        f.write(f"Total Avg. Frames Throughput: {round(total_frames_received/(client.etime - client.stime))} frames/sec\n\n")
-        avg_bytes_throughput = total_bytes_received / (client.etime - client.stime)
-        
-        if avg_bytes_throughput < KB:
-            f.write(f"Total Avg. Bytes Throughput: {avg_bytes_throughput:.2f} bytes/sec\n")
-            print(f"Total Avg. Bytes Throughput: {avg_bytes_throughput:.2f} bytes/sec")
-        elif avg_bytes_throughput < MB:
-            f.write(f"Total Avg. Bytes Throughput: {avg_bytes_throughput/KB:.2f} KB/sec\n")
-            print(f"Total Avg. Bytes Throughput: {avg_bytes_throughput/KB:.2f} KB/sec")
-        else:
-            f.write(f"Total Avg. Bytes Throughput: {avg_bytes_throughput/MB:.2f} MB/sec\n")
-            print(f"Total Avg. Bytes Throughput: {avg_bytes_throughput/MB:.2f} MB/sec")
-            
-        
-        print(f"Total bytes sent: {client.bytes_sent}")
-        print(f"Total bytes received: {total_bytes_received}")
-        print(f"Total frames received: {total_frames_received}")
-        print(f"Total time taken: {(client.etime - client.stime):.2f} seconds")
-        print(
-            f"Total Avg. Frames Throughput: {round(total_frames_received/(client.etime - client.stime))} frames/sec")
+    for stream in client.streams.values():
+        stream.print_stats()
+        print()
+    write_stats(client.metrics.to_dict(), client.streams.__len__())
+    plot_graph()
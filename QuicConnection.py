@@ -5,125 +5,377 @@ import random
 import socket
 import time
 from collections import deque
-from Packet import Packet, PACKET_H_MAX_SIZE
-from Frame import Frame, HANDSHAKE, ACK, DATA, CLOSE, FRAME_H_SIZE
+from Packet import Packet, VARINT_FLAG, short_header_size
+from Frame import (Frame, HANDSHAKE, ACK, DATA, CLOSE, MAX_DATA, MAX_STREAM_DATA, BLOCKED, FLOW_CONTROL_FRAMES,
+                   PADDING, FrameDescriptors, frame_header_size)
+from CongestionControl import CONGESTION_CONTROLLERS, Pacer, PACER_BURST_PACKETS
+from LossRecovery import (LossRecovery, ReceivedPacketRanges, SentPacket, encode_ack_ranges, decode_ack_ranges,
+                          ACK_ELICITING_THRESHOLD, MAX_ACK_DELAY, MAX_PTO_COUNT)
 from Stream import Stream
+from StreamScheduler import STREAM_SCHEDULERS, DEFAULT_PRIORITY, DEFAULT_WEIGHT
+from BatchIO import BatchSocket
+from PathMtu import PathMtuDiscovery, set_dont_fragment
+from Metrics import MetricsRegistry, SAMPLE_INTERVAL, RTT_BUCKETS, COMPLETION_BUCKETS
+from Trace import Tracer, LOG_INFO, LOG_WARNING, LOG_ERROR
+from StreamIO import StreamReader, StreamWriter, WRITE_HIGH_WATER, WRITE_LOW_WATER
 
 KB = 1024
 MB = 1024 * KB
-MAX_PACKET_SIZE = 8 * KB  # 8 KB
+MAX_PACKET_SIZE = 8 * KB  # Largest datagram sent or received; path MTU discovery searches up to it
+
+HANDSHAKE_TIMEOUT = 0.2  # seconds before the first handshake retransmission, doubled each time
+
+DEFAULT_MAX_DATA = 8 * MB  # Connection receive window: bytes the peer may send beyond what we consumed
+DEFAULT_MAX_STREAM_DATA = 1 * MB  # Receive window of each stream
+MIN_FRAME_PAYLOAD = 16  # A packet with less room left than this for stream data is full
+
+RECV_PROTOCOL = "protocol"  # asyncio DatagramProtocol pushes datagrams as they arrive
+RECV_EXECUTOR = "executor"  # legacy blocking recvfrom in the default thread pool
+RECV_BATCH = "batch"  # recvmmsg/sendmmsg and UDP GSO, many datagrams per system call
+
+# Control messages on stream 0 that expect an answer are b"REQ:<id>:<body>", answered with b"RES:<id>:<body>"
+REQUEST_PREFIX = b"REQ:"
+RESPONSE_PREFIX = b"RES:"
+
+
+def encode_transport_parameters(parameters):
+    """Handshake payload carrying our limits as b"key=value;key=value"."""
+    return ";".join(f"{key}={value}" for key, value in parameters.items()).encode()
+
+
+def decode_transport_parameters(data):
+    parameters = {}
+    for item in bytes(data).decode().split(";"):
+        if item:
+            key, _, value = item.partition("=")
+            parameters[key] = int(value)
+    return parameters
+
+
+def encode_control_message(prefix, request_id, data):
+    return prefix + str(request_id).encode() + b":" + data
+
+
+def split_request(data):
+    """(request ID, body) of a request, or (None, data) for a control message that expects no answer."""
+    if data.startswith(REQUEST_PREFIX):
+        request_id, _, body = data[len(REQUEST_PREFIX):].partition(b":")
+        if request_id.isdigit():
+            return int(request_id), body
+    return None, data
+
+
+def is_mtu_probe(sent_packet):
+    return sent_packet.descriptors is not None and sent_packet.descriptors.last_frame_type == PADDING
+
+
+class QuicProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol that hands every received datagram to its QuicConnection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def datagram_received(self, data, addr):
+        self.connection.datagram_received(data, addr)
+
+    def pause_writing(self):
+        self.connection.writable_event.clear()
+
+    def resume_writing(self):
+        self.connection.writable_event.set()
+
+    def error_received(self, exc):
+        if isinstance(exc, ConnectionRefusedError):
+            self.connection.log("Connection refused by the server.", LOG_ERROR)
+        else:
+            self.connection.log(f"Error receiving packet: {exc}", LOG_ERROR)
 
 
 class QuicConnection:
 
-    def __init__(self, addr=None, r_addr=None):
+    def __init__(self, addr=None, r_addr=None, recv_backend=RECV_PROTOCOL, congestion_control="newreno",
+                 pacing_rate=None, endpoint=None, con_id=None, max_data=DEFAULT_MAX_DATA,
+                 max_stream_data=DEFAULT_MAX_STREAM_DATA, scheduler="round_robin", varint_encoding=True,
+                 max_packet_size=MAX_PACKET_SIZE, path_mtu_discovery=True, metrics_interval=SAMPLE_INTERVAL,
+                 trace_path=None):
+        if recv_backend not in (RECV_PROTOCOL, RECV_EXECUTOR, RECV_BATCH):
+            raise ValueError(f"Unknown receive backend: {recv_backend}")
+        if congestion_control is not None and congestion_control not in CONGESTION_CONTROLLERS:
+            raise ValueError(f"Unknown congestion control: {congestion_control}")
+        if scheduler not in STREAM_SCHEDULERS:
+            raise ValueError(f"Unknown stream scheduler: {scheduler}")
         self.addr = addr
         self.r_addr = r_addr
-        self.con_id = random.randint(0, 2**16 - 1)
+        self.con_id = con_id if con_id is not None else random.getrandbits(32)
+        self.is_server = endpoint is not None or r_addr is None
         self.r_con_id = None
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        if addr:
-            self.sock.bind(self.addr)
+        self.endpoint = endpoint  # Shared server socket that routes datagrams to this connection
+        self.sock = None
+        if endpoint is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if addr:
+                self.sock.bind(self.addr)
+            if path_mtu_discovery:
+                set_dont_fragment(self.sock)
         self.streams = {}
+        # Streams opened with open_stream get IDs of the opener's parity: odd on the server, even on the client
+        self.next_stream_id = 1 if self.is_server else 2
+        self.incoming_streams = asyncio.Queue()  # Readers of streams the peer opened, for accept_stream
+        self.fin_waiters = {}  # Stream ID -> Event set once the stream's CLOSE frame is acknowledged
+        self.finished_streams = set()  # Streams whose CLOSE was acknowledged, holding their source for retransmissions
+        # File transfers close the connection once every stream has been received; the stream API leaves it open
+        self.close_when_received = True
+        self.scheduler = STREAM_SCHEDULERS[scheduler]()  # Orders the streams that have data to send
+        self.varint_encoding = varint_encoding  # Offer varint encoding in the handshake
+        self.varint = False  # Both sides offered it: short packets are sent varint-encoded
         self.packet_number = 0
         self.main_frame_queue = deque()
         self.other_frame_queue = deque()
-        self.received_frame_queue = deque()
-        self.acknowledged_packets = set()
+        self.received_frame_queue = asyncio.Queue()  # Control messages for recv(); None once closed
+        self.pending_requests = {}  # Request ID -> Future resolved with the peer's response
+        self.next_request_id = 0
         self.main_stream = Stream(0, connection=self)
         self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_received = 0
+        self.bytes_retransmitted = 0  # Stream bytes put back in a queue after their packet was lost
+        self.stime = None  # Client: when the streams were requested
+        self.etime = None  # When every stream had been received
+        # Packets carrying stream data, their bytes and the packet_size they could have filled
+        self.data_packets_sent = 0
+        self.data_packet_bytes = 0
+        self.data_packet_capacity = 0
         self.closed = False
+        self.closed_event = asyncio.Event()
+        self.recv_backend = recv_backend
+        self.transport = None
+        self.batch_socket = None  # Set by the batch backend once the socket is on the event loop
+        self.datagram_queue = deque()
+        self.datagram_event = asyncio.Event()
+        self.handshake_event = asyncio.Event()
+        self.send_event = asyncio.Event()  # Set whenever there may be frames to send
+        self.writable_event = asyncio.Event()  # Cleared while the transport's send buffer is full
+        self.writable_event.set()
+        self.max_packet_size = max_packet_size  # Receive buffers are this large; advertised to the peer
+        self.path_mtu = PathMtuDiscovery(max_packet_size, enabled=path_mtu_discovery)
+        self.send_buffer = bytearray(max_packet_size)  # Reused for every outgoing datagram
+        self.pacing_rate = pacing_rate  # Fixed rate used only without congestion control
+        self.next_send_time = 0
+        self.recovery = LossRecovery()  # Sent packets awaiting acknowledgment
+        self.loss_timer = None
+        self.probe_pending = False  # A probe timeout fired: send one packet even if the window is full
+        self.received_packets = ReceivedPacketRanges()  # Packet numbers to acknowledge and to detect duplicates
+        self.largest_received_time = None
+        self.ack_eliciting_received = 0  # Ack-eliciting packets received since the last ACK we sent
+        self.ack_needed = False
+        self.ack_timer = None
+        # Flow control. Our windows go to the peer in the handshake; None leaves that side unlimited.
+        self.max_data = max_data
+        self.max_stream_data = max_stream_data
+        self.max_data_advertised = max_data if max_data is not None else float('inf')
+        self.data_received = 0  # Sum of the highest offsets received on each stream
+        self.data_consumed = 0  # In-order bytes handed to the application on all streams
+        self.peer_max_data = float('inf')  # Limits from the peer's handshake and credit frames
+        self.peer_max_stream_data = float('inf')
+        self.data_sent = 0  # New stream bytes sent, counted against peer_max_data
+        self.blocked_at = None  # peer_max_data we last sent a connection-level BLOCKED for
+        self.blocked_frames_sent = 0
+        self.blocked_frames_received = 0
+        # None disables congestion control: the sender is then limited only by pacing_rate and the socket
+        self.congestion_controller = None
+        self.pacer = None
+        if congestion_control is not None:
+            self.congestion_controller = CONGESTION_CONTROLLERS[congestion_control](self.packet_size)
+            self.pacer = Pacer(self.packet_size)
+        self.metrics_interval = metrics_interval  # Seconds between time series samples; None stops sampling
+        self.metrics_timer = None
+        self.metrics = MetricsRegistry({"connection": self.con_id})
+        self.rtt_histogram = self.metrics.histogram("quic_rtt_seconds", "Round-trip time samples", RTT_BUCKETS)
+        self.completion_histogram = self.metrics.histogram(
+            "quic_stream_completion_seconds", "Time from a stream's first received frame to its last byte",
+            COMPLETION_BUCKETS)
+        self.register_metrics()
+        # qlog event trace, off unless a path is given; "{con_id}" in it is replaced by the connection ID
+        self.tracer = None
+        if trace_path is not None:
+            self.tracer = Tracer(trace_path.format(con_id=self.con_id), "server" if self.is_server else "client",
+                                 title=f"connection {self.con_id}")
 
         # Start the frame sender task if an event loop is running
         if asyncio.get_event_loop().is_running():
             asyncio.create_task(self.send_frames())
+            if endpoint is not None:
+                asyncio.create_task(self.process_datagrams())  # The endpoint feeds datagram_received
 
     async def connect(self, _test_mode=False):
-        print("Client initiating handshake with server...")
+        self.log("Client initiating handshake with server...")
         self.sock.connect(self.r_addr)
-        await self.initiate_handshake(_test_mode)
+        if self.recv_backend == RECV_PROTOCOL:
+            await self.start_protocol_transport()
+        elif self.recv_backend == RECV_BATCH:
+            self.start_batch_io()
+        elif not _test_mode:
+            asyncio.create_task(self.recv_packet_continuously())
 
-        while self.r_con_id is None:
-            await asyncio.sleep(0.01)
-        print("Client connected to server with remote connection ID:", self.r_con_id)
+        # The handshake is not covered by loss recovery, so resend it until answered
+        timeout = HANDSHAKE_TIMEOUT
+        await self.initiate_handshake()
+        while not self.handshake_event.is_set():
+            try:
+                await asyncio.wait_for(self.handshake_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.log("Handshake timed out, retransmitting.", LOG_WARNING)
+                await self.initiate_handshake()
+                timeout *= 2
+        self.log(f"Client connected to server with remote connection ID: {self.r_con_id}")
 
     async def listen(self, _test_mode=False):
         loop = asyncio.get_running_loop()
-        print("Listening for initial connection setup...")
+        self.log("Listening for initial connection setup...")
+        if self.recv_backend in (RECV_PROTOCOL, RECV_BATCH):
+            if self.recv_backend == RECV_PROTOCOL:
+                await self.start_protocol_transport()
+            else:
+                self.start_batch_io()
+            await self.handshake_event.wait()
+            self.log("Handshake completed. Ready to receive packets.")
+            return
         while not self.closed:
-            data, addr = await loop.run_in_executor(None, self.sock.recvfrom, 2048)
+            data, addr = await loop.run_in_executor(None, self.sock.recvfrom, self.max_packet_size)
             await self.handle_packet(data, addr)
             if self.r_con_id is not None:
-                print("Handshake completed. Ready to receive packets.")
+                self.log("Handshake completed. Ready to receive packets.")
                 if not _test_mode:
                     asyncio.create_task(self.recv_packet_continuously())
                 break
 
+    async def start_protocol_transport(self):
+        """Attach the socket to the event loop so datagrams are delivered without a thread hop."""
+        loop = asyncio.get_running_loop()
+        self.sock.setblocking(False)
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: QuicProtocol(self), sock=self.sock)
+        asyncio.create_task(self.process_datagrams())
+
+    def start_batch_io(self):
+        """Watch the socket ourselves and move datagrams in batches (see BatchIO.BatchSocket)."""
+        self.sock.setblocking(False)
+        self.batch_socket = BatchSocket(self.sock, self.max_packet_size)
+        asyncio.get_running_loop().add_reader(self.sock, self.read_datagram_batch)
+        asyncio.create_task(self.process_datagrams())
+
+    def read_datagram_batch(self):
+        try:
+            for data, addr in self.batch_socket.recv_batch():
+                self.datagram_received(data, addr)
+        except OSError as e:
+            self.log(f"Error receiving packet batch: {e}", LOG_ERROR)
+
+    def datagram_received(self, data, addr):
+        self.datagram_queue.append((data, addr))
+        self.datagram_event.set()
+
+    async def process_datagrams(self):
+        """Feed queued datagrams to handle_packet in arrival order, sleeping only while idle."""
+        while not self.closed:
+            await self.datagram_event.wait()
+            self.datagram_event.clear()
+            while self.datagram_queue and not self.closed:
+                data, addr = self.datagram_queue.popleft()
+                await self.handle_packet(data, addr)
+
     async def recv_packet(self):
         loop = asyncio.get_running_loop()
         try:
-            data, addr = await loop.run_in_executor(None, self.sock.recvfrom, MAX_PACKET_SIZE)
+            data, addr = await loop.run_in_executor(None, self.sock.recvfrom, self.max_packet_size)
             await self.handle_packet(data, addr)
         except asyncio.CancelledError:
-            print("recv_packet task cancelled")
+            self.log("recv_packet task cancelled", LOG_WARNING)
         except ConnectionRefusedError:
-            print("Connection refused by the server.")
+            self.log("Connection refused by the server.", LOG_ERROR)
             await self.close()
         except Exception as e:
-            print(f"Error receiving packet: {e}")
+            self.log(f"Error receiving packet: {e}", LOG_ERROR)
 
     async def handle_packet(self, data, addr):
+        self.packets_received += 1
+        self.bytes_received += len(data)
         try:
-            packet = Packet.from_bytes(data)
+            packet = Packet.from_bytes(data, zero_copy=True)
+            if self.tracer is not None:
+                self.tracer.packet_received("initial" if packet.src_con_id is not None else "1RTT",
+                                            packet.packet_number, len(data), packet.frames)
 
             if packet.src_con_id is not None:
-                if self.r_con_id is None:
-                    for frame in packet.frames:
-                        if frame.frame_type == HANDSHAKE:
-                            print(f"Connection request received from {addr}")
-                            self.r_con_id = packet.src_con_id
-                            self.r_addr = addr
-                            self.sock.connect(self.r_addr)
-                            ack_packet = Packet(
-                                header_form=1, flags=0,
-                                src_con_id=self.con_id, dest_con_id=self.r_con_id, packet_number=self.packet_number,
-                                frames=[
-                                    Frame(stream_id=0, data=None, offset=0, frame_type=(HANDSHAKE | ACK))]
-                            )
-                            await self.send_packet_data(ack_packet)
-                            return
-                        elif frame.frame_type == (HANDSHAKE | ACK):
-                            print(f"Connection established with {addr}")
+                for frame in packet.frames:
+                    if frame.frame_type == HANDSHAKE:
+                        if self.r_con_id is None:
+                            self.log(f"Connection request received from {addr}")
                             self.r_con_id = packet.src_con_id
                             self.r_addr = addr
+                            self.apply_transport_parameters(frame.data)
+                            if self.sock is not None:
+                                self.sock.connect(self.r_addr)
+                            self.handshake_completed()
+                        elif packet.src_con_id != self.r_con_id:
                             return
+                        # Answer retransmitted handshakes too: our previous answer may have been lost
+                        ack_packet = Packet(
+                            header_form=1, flags=0,
+                            src_con_id=self.con_id, dest_con_id=self.r_con_id, packet_number=self.next_packet_number(),
+                            frames=[Frame(stream_id=0, data=self.transport_parameters(), offset=0,
+                                          frame_type=(HANDSHAKE | ACK))]
+                        )
+                        await self.send_packet_data(ack_packet)
+                        return
+                    elif frame.frame_type == (HANDSHAKE | ACK) and self.r_con_id is None:
+                        self.log(f"Connection established with {addr}")
+                        self.r_con_id = packet.src_con_id
+                        self.r_addr = addr
+                        self.apply_transport_parameters(frame.data)
+                        self.handshake_completed()
+                        return
             else:
                 if packet.dest_con_id == self.con_id:
-                    if packet.packet_number not in self.acknowledged_packets:
-                        self.acknowledged_packets.add(packet.packet_number)
-
-                        for frame in packet.frames:
-                            if frame.stream_id == 0:
-                                if frame.frame_type == CLOSE:
-                                    print("Close packet received. Closing connection.")
-                                    await self.close()
-                                    return
-
-                                if frame.frame_type != ACK:
-                                    self.received_frame_queue.append(frame)
-                            elif frame.stream_id in self.streams:
-                                await self.streams[frame.stream_id].receive_frame(frame)
-                                if all(stream.closed for stream in self.streams.values()):
-                                    self.etime = time.time()
-                                    print("All streams closed. Closing connection.")
-                                    await self.close()
-                                    return
+                    if packet.packet_number in self.received_packets:
+                        self.queue_ack()  # A retransmission means our ACK for it was lost
+                        return
+                    self.on_packet_received(packet)
+
+                    for frame in packet.frames:
+                        if frame.frame_type == PADDING:
+                            continue  # Path MTU probe: only its size mattered
+                        if frame.frame_type in FLOW_CONTROL_FRAMES:
+                            self.on_flow_control_frame(frame)
+                        elif frame.stream_id == 0:
+                            if frame.frame_type == CLOSE:
+                                self.log("Close packet received. Closing connection.")
+                                await self.close()
+                                return
+
+                            if frame.frame_type == ACK:
+                                self.on_ack_frame(frame, packet.varint)
                             else:
-                                print(f"Unknown stream ID: {frame.stream_id}")
+                                frame.data = bytes(frame.data)  # Control messages are consumed as bytes
+                                if frame.data.startswith(RESPONSE_PREFIX):
+                                    self.on_response(frame.data)
+                                else:
+                                    self.received_frame_queue.put_nowait(frame)
+                        else:
+                            stream = self.streams.get(frame.stream_id)
+                            if stream is None:
+                                stream = self.incoming_stream(frame.stream_id)
+                            if not await self.receive_stream_frame(stream, frame):
+                                return
+                            if self.close_when_received and all(stream.closed for stream in self.streams.values()):
+                                self.etime = time.time()
+                                self.log("All streams closed. Closing connection.")
+                                await self.close()
+                                return
         except asyncio.CancelledError:
-            print("handle_packet task cancelled")
+            self.log("handle_packet task cancelled", LOG_WARNING)
         except ValueError as e:
-            print(f"Error handling packet: {e}")
+            self.log(f"Error handling packet: {e}", LOG_ERROR)
 
     async def close(self):
         if self.closed:
@@ -135,139 +387,793 @@ class QuicConnection:
             close_frame = Frame(stream_id=0, data=None,
                                 offset=0, frame_type=CLOSE)
             close_packet = Packet(
-                header_form=0, flags=0,
-                dest_con_id=self.r_con_id, packet_number=self.packet_number, frames=[
+                header_form=0, flags=self.short_header_flags(),
+                dest_con_id=self.r_con_id, packet_number=self.next_packet_number(), frames=[
                     close_frame]
             )
             await self.send_packet_data(close_packet)
-            print("Closing connection.")
+            self.log("Closing connection.")
 
-            self.sock.shutdown(socket.SHUT_RDWR)
-            self.sock.close()
-            print("Socket closed.")
+            if self.endpoint is not None:
+                self.endpoint.remove(self)
+            elif self.transport is not None:
+                self.transport.close()
+            elif self.batch_socket is not None:
+                self.batch_socket.flush()  # The CLOSE packet must leave before the socket does
+                asyncio.get_running_loop().remove_reader(self.sock)
+                self.sock.close()
+            else:
+                self.sock.shutdown(socket.SHUT_RDWR)
+                self.sock.close()
+            self.log("Socket closed.")
 
             current_task = asyncio.current_task()
             current_task.done()
 
         except Exception as e:
-            print(f"Error during close: {e}")
+            self.log(f"Error during close: {e}", LOG_ERROR)
+        finally:
+            for timer in (self.loss_timer, self.ack_timer, self.metrics_timer):
+                if timer is not None:
+                    timer.cancel()
+            self.metrics.sample()  # The last second of the transfer
+            for stream in self.streams.values():
+                stream.release()  # Nothing will be resent any more
+            for event in self.fin_waiters.values():
+                event.set()
+            self.incoming_streams.put_nowait(None)  # accept_stream returns None from now on
+            self.received_frame_queue.put_nowait(None)  # So does recv
+            for future in self.pending_requests.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError("Connection closed before the response arrived"))
+            self.closed_event.set()
+            if self.tracer is not None:
+                self.tracer.connection_state_updated("closed")
+                await self.tracer.close()
+            self.datagram_event.set()  # Let process_datagrams observe the closed flag
+            self.send_event.set()  # Let send_frames observe the closed flag
 
         return
 
+    def register_metrics(self):
+        """Expose the connection's and its streams' counters; they are only read when sampled or exported."""
+        metrics = self.metrics
+        recovery = self.recovery
+        metrics.counter("quic_packets_sent", "Packets sent", lambda: self.packet_number)
+        metrics.counter("quic_bytes_sent", "Datagram bytes sent", lambda: self.bytes_sent)
+        metrics.counter("quic_packets_received", "Datagrams received", lambda: self.packets_received)
+        metrics.counter("quic_bytes_received", "Datagram bytes received", lambda: self.bytes_received)
+        metrics.counter("quic_packets_lost", "Packets declared lost", lambda: recovery.packets_lost)
+        metrics.counter("quic_bytes_retransmitted", "Stream bytes queued again after a loss",
+                        lambda: self.bytes_retransmitted)
+        metrics.counter("quic_stream_bytes_sent_total", "New stream bytes sent", lambda: self.data_sent)
+        metrics.counter("quic_stream_bytes_delivered_total", "Stream bytes delivered in order",
+                        lambda: self.data_consumed)
+        metrics.gauge("quic_transfer_seconds", "Time from requesting the streams to receiving all of them",
+                      lambda: self.etime - self.stime if self.stime and self.etime else 0)
+        metrics.gauge("quic_smoothed_rtt_seconds", "Smoothed round-trip time", lambda: recovery.rtt.smoothed_rtt)
+        metrics.gauge("quic_bytes_in_flight", "Bytes sent and not yet acknowledged or lost",
+                      lambda: recovery.bytes_in_flight)
+        metrics.gauge("quic_packets_in_flight", "Packets sent and not yet acknowledged or lost",
+                      lambda: len(recovery.sent_packets))
+        metrics.gauge("quic_congestion_window_bytes", "Congestion window, 0 without congestion control",
+                      lambda: self.congestion_controller.congestion_window if self.congestion_controller else 0)
+        metrics.gauge("quic_packet_size_bytes", "Largest packet the path is known to carry", lambda: self.packet_size)
+        metrics.gauge("quic_control_queue_frames", "Control and queued frames waiting to be sent",
+                      lambda: len(self.main_frame_queue) + len(self.other_frame_queue))
+        metrics.gauge("quic_ready_streams", "Streams in the scheduler's ready list", lambda: len(self.scheduler))
+        metrics.gauge("quic_received_queue_frames", "Control frames waiting for recv()",
+                      lambda: self.received_frame_queue.qsize())
+        metrics.counter("quic_stream_bytes_sent", "Stream bytes sent, including retransmissions",
+                        lambda: {stream_id: stream.bytes_sent for stream_id, stream in self.streams.items()},
+                        label="stream")
+        metrics.counter("quic_stream_bytes_received", "Stream bytes received, including duplicates",
+                        lambda: {stream_id: stream.bytes_received for stream_id, stream in self.streams.items()},
+                        label="stream")
+        metrics.counter("quic_stream_frames_received", "Stream frames received",
+                        lambda: {stream_id: stream.frames_received for stream_id, stream in self.streams.items()},
+                        label="stream")
+        metrics.gauge("quic_stream_pending_bytes", "Stream bytes waiting to be sent",
+                      lambda: {stream_id: stream.pending_bytes for stream_id, stream in self.streams.items()},
+                      label="stream")
+        metrics.gauge("quic_stream_retransmit_queue_frames", "Lost frames waiting to be resent",
+                      lambda: {stream_id: len(stream.retransmit_frames) for stream_id, stream in self.streams.items()},
+                      label="stream")
+        metrics.gauge("quic_stream_duration_seconds", "Time the stream took, once it has completed",
+                      lambda: {stream_id: stream.etime - stream.stime for stream_id, stream in self.streams.items()
+                               if stream.stime and stream.etime}, label="stream")
+
+    def schedule_metrics_sample(self):
+        if self.metrics_interval is not None and self.metrics_timer is None and not self.closed:
+            self.metrics_timer = asyncio.get_running_loop().call_later(self.metrics_interval, self.on_metrics_timer)
+
+    def on_metrics_timer(self):
+        self.metrics_timer = None
+        self.metrics.sample()
+        self.schedule_metrics_sample()
+
+    def log(self, message, level=LOG_INFO):
+        """Print a message, or record it in the trace instead when tracing is on."""
+        if self.tracer is not None:
+            self.tracer.log(message, level)
+        else:
+            print(message)
+
+    def handshake_completed(self):
+        if self.tracer is not None:
+            self.tracer.connection_state_updated("handshake_complete")
+        self.handshake_event.set()
+
+    def trace_recovery(self, lost):
+        """Record the packets declared lost and the recovery state after an ACK or a timeout."""
+        for sent_packet in lost:
+            self.tracer.packet_lost(sent_packet.packet_number, sent_packet.size)
+        rtt = self.recovery.rtt
+        congestion_window = self.congestion_controller.congestion_window if self.congestion_controller else None
+        self.tracer.metrics_updated(congestion_window, self.recovery.bytes_in_flight, rtt.smoothed_rtt, rtt.latest_rtt)
+
+    def next_packet_number(self):
+        packet_number = self.packet_number
+        self.packet_number += 1
+        return packet_number
+
+    def on_packet_received(self, packet):
+        """Record a new packet number and schedule its acknowledgment."""
+        self.received_packets.add(packet.packet_number)
+        if packet.packet_number == self.received_packets.largest:
+            self.largest_received_time = asyncio.get_running_loop().time()
+        if all(frame.frame_type == ACK for frame in packet.frames):
+            return  # ACK-only packets are not acknowledged
+
+        self.ack_eliciting_received += 1
+        if self.ack_eliciting_received >= ACK_ELICITING_THRESHOLD:
+            self.queue_ack()
+        elif self.ack_timer is None:
+            self.ack_timer = asyncio.get_running_loop().call_later(MAX_ACK_DELAY, self.queue_ack)
+
+    def queue_ack(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        self.ack_needed = True
+        self.wake_sender()
+
+    def build_ack_frame(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()  # This ACK covers everything the timer was waiting for
+            self.ack_timer = None
+        ack_delay = asyncio.get_running_loop().time() - self.largest_received_time
+        self.ack_needed = False
+        self.ack_eliciting_received = 0
+        # The ACK delay in microseconds travels in the offset field
+        return Frame(stream_id=0, data=encode_ack_ranges(self.received_packets.ack_ranges(), self.varint),
+                     offset=min(int(ack_delay * 1e6), 0xFFFFFFFF), frame_type=ACK)
+
+    def on_ack_frame(self, frame, varint=False):
+        try:
+            ranges = decode_ack_ranges(frame.data, varint)
+        except ValueError as e:
+            self.log(f"Error handling ACK frame: {e}", LOG_ERROR)
+            return
+        now = asyncio.get_running_loop().time()
+        acked, lost = self.recovery.on_ack_received(ranges, frame.offset / 1e6, now)
+        if self.tracer is not None:
+            self.trace_recovery(lost)
+        if acked and acked[-1].packet_number == self.recovery.largest_acked:
+            self.rtt_histogram.observe(self.recovery.rtt.latest_rtt)  # The largest packet gave a new sample
+        self.on_fins_acked(acked)
+        lost = self.on_path_mtu_packets(acked, lost)
+        if self.congestion_controller:
+            self.congestion_controller.on_packets_acked(acked, self.recovery.rtt, now)
+            self.congestion_controller.on_packets_lost(lost, now)
+            if acked:
+                self.wake_sender()  # The congestion window may have opened
+        self.requeue_lost(lost)
+        if self.finished_streams:
+            self.release_finished_sources()
+        self.set_loss_detection_timer()
+
+    def on_fins_acked(self, acked):
+        """Note the streams whose CLOSE frame was acknowledged and tell writers waiting in wait_closed."""
+        for sent_packet in acked:
+            if sent_packet.descriptors is None:
+                continue
+            for frame_type, stream_id, _, _ in sent_packet.descriptors.frames():
+                if frame_type != CLOSE:
+                    continue  # CLOSE carries no data, so it is always a descriptor
+                if stream_id in self.fin_waiters:
+                    self.fin_waiters.pop(stream_id).set()
+                stream = self.streams.get(stream_id)
+                if stream is not None and stream.payload_source is not None:
+                    self.finished_streams.add(stream)
+
+    def release_finished_sources(self):
+        """Close the source of every finished stream that no packet in flight or lost frame can need any more.
+
+        Packet numbers in flight ascend, so once the oldest one is past the
+        last packet holding a descriptor of the stream, none of them holds one.
+        """
+        oldest = next(iter(self.recovery.sent_packets), None)
+        for stream in list(self.finished_streams):
+            if not stream.retransmit_frames and (oldest is None or oldest > stream.last_descriptor_packet):
+                stream.release_source()
+                self.finished_streams.discard(stream)
+
+    def requeue_lost(self, lost_packets):
+        """Put the frames of lost packets back in front of new data, at their original offsets."""
+        if self.closed:
+            return  # Stream sources are released on close
+        for sent_packet in lost_packets:
+            for frame in sent_packet.frames:
+                self.requeue_frame(frame)
+            if sent_packet.descriptors is None:
+                continue
+            for frame_type, stream_id, offset, length in sent_packet.descriptors.frames():
+                if frame_type == PADDING:
+                    continue  # Lost probes are never resent
+                data = self.streams[stream_id].sent_data(offset, length) if length else b''
+                self.bytes_retransmitted += length
+                self.requeue_frame(Frame(stream_id, data, offset, frame_type))
+        if lost_packets:
+            self.wake_sender()
+
+    def requeue_frame(self, frame):
+        if frame.frame_type in FLOW_CONTROL_FRAMES:
+            self.requeue_flow_control_frame(frame)
+        elif frame.stream_id == 0:
+            self.main_frame_queue.append(frame)
+        elif frame.stream_id in self.streams:
+            self.streams[frame.stream_id].requeue_frame(frame)
+
+    def describe_sent_frames(self, frames, packet_number):
+        """Split the frames of an ack-eliciting packet into those loss recovery keeps and descriptors for the rest.
+
+        ACKs are left out, a fresh one is built for every packet. Frames
+        without a payload and stream data that can be read back from the
+        stream's source are kept as descriptors only, so packets in flight
+        hold no Frame objects or payload views for them.
+        """
+        kept = []
+        descriptors = FrameDescriptors()
+        for frame in frames:
+            if frame.frame_type == ACK:
+                continue
+            stream = self.streams.get(frame.stream_id)
+            rereadable = stream is not None and stream.payload_source is not None
+            if frame.length == 0 or frame.frame_type == PADDING or rereadable:
+                descriptors.add(frame)
+                if rereadable:
+                    stream.last_descriptor_packet = packet_number
+            else:
+                kept.append(frame)
+        return kept or (), descriptors
+
+    def set_loss_detection_timer(self):
+        if self.loss_timer is not None:
+            self.loss_timer.cancel()
+            self.loss_timer = None
+        deadline = self.recovery.loss_detection_deadline()
+        if deadline is not None and not self.closed:
+            self.loss_timer = asyncio.get_running_loop().call_at(deadline, self.on_loss_detection_timeout)
+
+    def on_loss_detection_timeout(self):
+        self.loss_timer = None
+        if self.recovery.pto_count >= MAX_PTO_COUNT:
+            self.log("Peer stopped acknowledging packets. Closing connection.", LOG_ERROR)
+            asyncio.create_task(self.close())
+            return
+        now = asyncio.get_running_loop().time()
+        pto_count = self.recovery.pto_count
+        lost = self.recovery.on_timeout(now)
+        if self.tracer is not None:
+            self.trace_recovery(lost)
+        lost = self.on_path_mtu_packets([], lost)
+        self.probe_pending = self.recovery.pto_count > pto_count
+        if self.congestion_controller:
+            self.congestion_controller.on_packets_lost(lost, now)
+        self.requeue_lost(lost)
+        self.set_loss_detection_timer()
+
+    @property
+    def fill_ratio(self):
+        """Share of the available packet size used by packets carrying stream data."""
+        return self.data_packet_bytes / self.data_packet_capacity if self.data_packet_capacity else 0
+
+    @property
+    def packet_size(self):
+        """Largest packet to build: what the path is known to carry."""
+        return self.path_mtu.packet_size
+
+    def on_path_mtu_packets(self, acked, lost):
+        """Feed acknowledged and lost packets to path MTU discovery and return the lost ones that were not probes.
+
+        Lost probes only mean the path is narrower than them: they are
+        neither retransmitted nor reported to congestion control.
+        """
+        size_changed = False
+        probe_done = False
+        for sent_packet in acked:
+            if is_mtu_probe(sent_packet):
+                size_changed |= self.path_mtu.on_probe_acked(sent_packet.size)
+                probe_done = True
+        regular_lost = []
+        for sent_packet in lost:
+            if is_mtu_probe(sent_packet):
+                self.path_mtu.on_probe_lost(sent_packet.size)
+                probe_done = True
+            else:
+                regular_lost.append(sent_packet)
+        size_changed |= self.path_mtu.on_packets_acked_and_lost(
+            [sent_packet.size for sent_packet in acked if not is_mtu_probe(sent_packet)],
+            [sent_packet.size for sent_packet in regular_lost])
+        if size_changed:
+            self.on_packet_size_changed()
+        if probe_done:
+            self.wake_sender()  # The next probe may go out
+        return regular_lost
+
+    def on_packet_size_changed(self):
+        size = self.packet_size
+        if self.congestion_controller:
+            self.congestion_controller.max_datagram_size = size
+            self.pacer.capacity = PACER_BURST_PACKETS * size
+
+    def transport_parameters(self):
+        parameters = {"max_data": self.max_data, "max_stream_data": self.max_stream_data,
+                      "max_udp_payload_size": self.max_packet_size,
+                      "varint": 1 if self.varint_encoding else None}
+        return encode_transport_parameters({key: value for key, value in parameters.items() if value is not None})
+
+    def apply_transport_parameters(self, data):
+        """Take the peer's initial flow control limits from its handshake; absent ones stay unlimited."""
+        try:
+            parameters = decode_transport_parameters(data)
+        except ValueError as e:
+            self.log(f"Error parsing transport parameters: {e}", LOG_ERROR)
+            return
+        self.peer_max_data = parameters.get("max_data", float('inf'))
+        self.peer_max_stream_data = parameters.get("max_stream_data", float('inf'))
+        self.varint = self.varint_encoding and parameters.get("varint") == 1
+        if "max_udp_payload_size" in parameters:
+            self.path_mtu.set_max_size(parameters["max_udp_payload_size"])
+            self.on_packet_size_changed()
+        for stream in self.streams.values():
+            stream.send_limit = self.peer_max_stream_data
+
+    @property
+    def send_credit(self):
+        """New stream bytes the peer's connection limit still allows."""
+        return self.peer_max_data - self.data_sent
+
+    async def receive_stream_frame(self, stream, frame):
+        """Deliver a stream frame within our advertised limits and extend them as data is consumed.
+
+        Returns False if the peer broke flow control, which closes the connection.
+        """
+        end = frame.offset + frame.length
+        new_bytes = max(0, end - stream.highest_received)
+        if end > stream.max_stream_data or self.data_received + new_bytes > self.max_data_advertised:
+            self.log(f"Flow control violation on stream {stream.stream_id} at offset {end}. Closing connection.",
+                     LOG_ERROR)
+            await self.close()
+            return False
+        self.data_received += new_bytes
+        was_closed = stream.closed
+        self.data_consumed += await stream.receive_frame(frame)
+        if stream.closed and not was_closed:
+            self.completion_histogram.observe(stream.etime - stream.stime)
+            if self.tracer is not None:
+                self.tracer.stream_state_updated(stream.stream_id, "data_received")
+            self.log(f"Stream {stream.stream_id} reception completed.")
+        self.update_receive_windows(stream)
+        return True
+
+    def stream_data_read(self, stream, length):
+        """Count data a StreamReader handed to the application as consumed, which may extend the peer's credit."""
+        stream.consumed += length
+        self.data_consumed += length
+        if not self.closed:
+            self.update_receive_windows(stream)
+
+    def update_receive_windows(self, stream):
+        """Advertise more credit on the stream and the connection once half their windows are consumed."""
+        limit = stream.window_update()
+        if limit is not None:
+            self.queue_control_frame(Frame(stream.stream_id, None, limit, frame_type=MAX_STREAM_DATA))
+        if self.max_data is not None and self.max_data_advertised - self.data_consumed <= self.max_data // 2:
+            self.max_data_advertised = self.data_consumed + self.max_data
+            self.queue_control_frame(Frame(0, None, self.max_data_advertised, frame_type=MAX_DATA))
+
+    def on_flow_control_frame(self, frame):
+        if frame.frame_type == MAX_DATA:
+            if frame.offset > self.peer_max_data:
+                self.peer_max_data = frame.offset
+                for stream in self.streams.values():
+                    if stream.pending_frames:
+                        self.stream_ready(stream)  # Any of them may have been waiting for connection credit
+        elif frame.frame_type == MAX_STREAM_DATA:
+            stream = self.streams.get(frame.stream_id)
+            if stream is not None and frame.offset > stream.send_limit:
+                stream.send_limit = frame.offset
+                self.stream_ready(stream)
+        else:
+            self.blocked_frames_received += 1  # Informational: our credit updates are already on their way
+
+    def signal_blocked(self, stream):
+        """Tell the peer once per limit that stream, or the whole connection, ran out of credit."""
+        if stream.blocked:
+            if stream.blocked_at == stream.send_limit:
+                return
+            stream.blocked_at = stream.send_limit
+            frame = Frame(stream.stream_id, None, stream.send_limit, frame_type=BLOCKED)
+        else:
+            if self.blocked_at == self.peer_max_data:
+                return
+            self.blocked_at = self.peer_max_data
+            frame = Frame(0, None, self.peer_max_data, frame_type=BLOCKED)
+        self.blocked_frames_sent += 1
+        self.queue_control_frame(frame)
+
+    def requeue_flow_control_frame(self, frame):
+        """Resend a lost credit update unless a newer one has replaced it; BLOCKED is not resent."""
+        if frame.frame_type == MAX_DATA and frame.offset == self.max_data_advertised:
+            self.main_frame_queue.append(frame)
+        elif frame.frame_type == MAX_STREAM_DATA:
+            stream = self.streams.get(frame.stream_id)
+            if stream is not None and not stream.closed and frame.offset == stream.max_stream_data:
+                self.main_frame_queue.append(frame)
+
+    def queue_control_frame(self, frame):
+        self.main_frame_queue.append(frame)
+        self.wake_sender()
+
+    def take_stream_frame(self, stream, max_length=float('inf')):
+        bytes_sent = stream.bytes_sent
+        frame = stream.get_next_frame(self.send_credit, max_length)
+        self.data_sent += stream.bytes_sent - bytes_sent
+        if self.tracer is not None and frame.frame_type == CLOSE:
+            self.tracer.stream_state_updated(stream.stream_id, "data_sent")
+        return frame
+
+    def stream_ready(self, stream):
+        """Hand a stream that may have something to send to the scheduler."""
+        self.scheduler.push(stream)
+        self.wake_sender()
+
+    def wake_sender(self):
+        """Signal send_frames that a stream or queue has frames ready."""
+        self.send_event.set()
+
     async def send_frames(self):
+        self.schedule_metrics_sample()
+        if self.tracer is not None:
+            self.tracer.start()
         while not self.closed:
-            await self.queue_frames_from_streams()
-            await self.send_packet()
-            await asyncio.sleep(0.01)
+            await self.send_event.wait()
+            self.send_event.clear()
+            # Drain back-to-back until there is nothing left or the window is full, yielding between packets
+            while not self.closed:
+                if self.congestion_window_full():
+                    if self.ack_needed:
+                        await self.send_packet(ack_only=True)  # ACKs are never blocked by congestion control
+                    break  # An ACK that frees window space wakes us up again
+                sent = await self.send_packet()
+                if not sent:
+                    break
+                await self.writable_event.wait()
+                delay = self.pacing_delay(sent)
+                if delay or self.batch_socket is None:
+                    await asyncio.sleep(delay)
+                elif not self.batch_socket.pending:
+                    await asyncio.sleep(0)  # A full batch just went out: let ACKs in before building the next
+
+    def congestion_window_full(self):
+        if self.probe_pending:
+            self.probe_pending = False  # Probes bypass congestion control, as in RFC 9002
+            return False
+        return (self.congestion_controller is not None and
+                not self.congestion_controller.can_send(self.recovery.bytes_in_flight))
+
+    def pacing_delay(self, packet_size):
+        """Return how long to wait before the next packet.
+
+        With congestion control the pacer spreads one congestion window over
+        one smoothed RTT; otherwise the average rate is held at pacing_rate.
+        """
+        now = asyncio.get_running_loop().time()
+        if self.congestion_controller:
+            rate = self.congestion_controller.pacing_rate(self.recovery.rtt.smoothed_rtt)
+            return self.pacer.delay(packet_size, rate, now)
+        if not self.pacing_rate:
+            return 0
+        self.next_send_time = max(self.next_send_time, now) + packet_size / self.pacing_rate
+        return max(0, self.next_send_time - now)
+
+    def short_header_flags(self):
+        return VARINT_FLAG if self.varint else 0
 
-    async def send_packet(self):
-        current_size = PACKET_H_MAX_SIZE
+    def take_queued_frame(self, queue, current_size):
+        if queue and current_size + queue[0].length + queue[0].header_size(self.varint) <= self.packet_size:
+            return queue.popleft()
+        return None
+
+    async def send_packet(self, ack_only=False):
+        """Build and send one packet. Returns its size in bytes, or 0 if there was nothing to send."""
+        current_size = short_header_size(self.packet_number, self.varint)
         frames_to_send = []
 
-        # Keep track of frames taken from each stream to avoid starvation
-        stream_frame_count = {stream_id: 0 for stream_id in self.streams.keys()}
+        # A pending ACK rides along with anything else being sent instead of waiting for its own packet
+        if self.ack_needed or (self.ack_eliciting_received and not ack_only and
+                               (self.main_frame_queue or self.other_frame_queue or self.scheduler)):
+            ack_frame = self.build_ack_frame()
+            frames_to_send.append(ack_frame)
+            current_size += ack_frame.length + ack_frame.header_size(self.varint)
+
+        if ack_only:
+            return await self.send_frames_in_packet(frames_to_send)
 
-        while current_size < MAX_PACKET_SIZE:
-            # Try to add frames from each stream in round-robin manner
-            streams_to_consider = list(self.streams.values())
-            frames_added = False
+        # Probe only while stream data is waiting: a peer that just sends ACKs gains nothing from larger packets
+        probe_size = self.path_mtu.next_probe_size()
+        if probe_size is not None and self.handshake_event.is_set() and self.scheduler:
+            return await self.send_mtu_probe(probe_size, frames_to_send)  # Only the ACK rides along
 
-            for stream in streams_to_consider:
-                frame = stream.get_next_frame()
-                if frame:
-                    frame_size = frame.length + FRAME_H_SIZE
-                    if current_size + frame_size <= MAX_PACKET_SIZE:
-                        frames_to_send.append(frame)
-                        current_size += frame_size
-                        stream_frame_count[stream.stream_id] += 1
-                        frames_added = True
+        # Control frames and frames already queued go first
+        for queue in (self.main_frame_queue, self.other_frame_queue):
+            frame = self.take_queued_frame(queue, current_size)
+            while frame:
+                frames_to_send.append(frame)
+                current_size += frame.length + frame.header_size(self.varint)
+                frame = self.take_queued_frame(queue, current_size)
 
-            if not frames_added:
-                break  # Exit if no frames were added in this round
+        # Then stream frames, in the order the scheduler picks, each cut to fill the rest of the packet
+        while self.scheduler:
+            stream = self.scheduler.peek()
+            room = self.packet_size - current_size - frame_header_size(
+                stream.stream_id, stream.next_frame_offset(), self.packet_size, self.varint)
+            if room < MIN_FRAME_PAYLOAD:
+                break
+            if stream.next_frame_length(self.send_credit, room) is None:
+                self.scheduler.pop()  # Pushed again once it has data or credit
+                if stream.pending_frames:
+                    self.signal_blocked(stream)  # Data is waiting but flow control holds it back
+                continue
+            frame = self.take_stream_frame(stream, room)
+            frames_to_send.append(frame)
+            current_size += frame.length + frame.header_size(self.varint)
+            self.scheduler.served(stream, frame.length)
 
+        return await self.send_frames_in_packet(frames_to_send)
+
+    async def send_mtu_probe(self, size, frames=()):
+        """Send frames padded to size bytes; the acknowledgment shows the path carries that size."""
+        frame = Frame(stream_id=0, data=b'', offset=0, frame_type=PADDING)
+        frames = [*frames, frame]
+        packet = Packet(
+            header_form=0, flags=self.short_header_flags(),
+            dest_con_id=self.r_con_id, packet_number=self.next_packet_number(), frames=frames
+        )
+        overhead = short_header_size(packet.packet_number, self.varint) + sum(
+            other.header_size(self.varint) + other.length for other in frames[:-1])
+        length = size - overhead
+        while overhead + length + frame_header_size(0, 0, length, self.varint) > size:
+            length -= 1  # A varint length field grows with the padding
+        frame.data = bytes(length)
+        frame.length = length
+        bytes_sent = self.bytes_sent
+        await self.send_packet_data(packet)
+        size = self.bytes_sent - bytes_sent
+        if not size:
+            return 0
+        self.path_mtu.on_probe_sent(size)
+        self.track_sent_packet(packet.packet_number, frames, size)
+        return size
+
+    async def send_frames_in_packet(self, frames_to_send):
+        """Send frames as one short-header packet and track it for loss recovery if ack-eliciting."""
         if frames_to_send:
             packet = Packet(
-                header_form=0, flags=0,
-                dest_con_id=self.r_con_id, packet_number=self.packet_number, frames=frames_to_send
+                header_form=0, flags=self.short_header_flags(),
+                dest_con_id=self.r_con_id, packet_number=self.next_packet_number(), frames=frames_to_send
             )
+            bytes_sent = self.bytes_sent
             await self.send_packet_data(packet)
-            self.packet_number += 1
+            packet_size = self.bytes_sent - bytes_sent
+            if not packet_size:
+                return 0  # Dropped, so there is nothing in flight to track
+            if any(frame.frame_type == DATA for frame in frames_to_send):
+                self.data_packets_sent += 1
+                self.data_packet_bytes += packet_size
+                self.data_packet_capacity += self.packet_size
+            if any(frame.frame_type != ACK for frame in frames_to_send):
+                self.track_sent_packet(packet.packet_number, frames_to_send, packet_size)
+            return packet_size
+        return 0
+
+    def track_sent_packet(self, packet_number, frames, size):
+        """Hand an ack-eliciting packet to loss recovery."""
+        kept, descriptors = self.describe_sent_frames(frames, packet_number)
+        self.recovery.on_packet_sent(SentPacket(packet_number, kept, size, asyncio.get_running_loop().time(),
+                                                descriptors))
+        self.set_loss_detection_timer()
 
     async def send_packet_data(self, packet):
         try:
-            data = packet.to_bytes()
-            self.bytes_sent += len(data)
-            await asyncio.get_running_loop().sock_sendall(self.sock, data)
-            await asyncio.sleep(0.01)
+            if self.batch_socket is not None:
+                size = self.batch_socket.add(packet)  # Leaves with the rest of this tick's batch
+            else:
+                size = packet.pack_into(self.send_buffer)
+            if not size:
+                self.log(f"Packet {packet.packet_number} could not be serialized. Dropping it.", LOG_ERROR)
+                return
+            self.bytes_sent += size
+            if self.tracer is not None:
+                self.trace_packet_sent(packet, size)
+            if self.batch_socket is not None:
+                return
+            data = memoryview(self.send_buffer)[:size]
+            if self.endpoint is not None:
+                self.endpoint.send(data, self.r_addr)
+            elif self.transport is not None:
+                if self.transport.get_extra_info('peername'):
+                    self.transport.sendto(data)
+                else:
+                    self.transport.sendto(data, self.r_addr)
+            else:
+                await asyncio.get_running_loop().sock_sendall(self.sock, data)
         except asyncio.CancelledError:
-            print("send_packet_data task cancelled")
+            self.log("send_packet_data task cancelled", LOG_WARNING)
         except Exception as e:
-            print(f"Error sending packet data: {e}")
+            self.log(f"Error sending packet data: {e}", LOG_ERROR)
+
+    def trace_packet_sent(self, packet, size):
+        self.tracer.packet_sent("initial" if packet.header_form else "1RTT", packet.packet_number, size, packet.frames)
 
     async def queue_frame(self, frame):
         if frame.stream_id == 0:
             self.main_frame_queue.append(frame)
         else:
             self.other_frame_queue.append(frame)
+        self.wake_sender()
 
-    async def initiate_handshake(self, _test_mode=False):
+    async def initiate_handshake(self):
         initial_packet = Packet(
             header_form=1, flags=0,
-            src_con_id=self.con_id, dest_con_id=0, packet_number=self.packet_number,
-            frames=[Frame(stream_id=0, data=None,
+            src_con_id=self.con_id, dest_con_id=0, packet_number=self.next_packet_number(),
+            frames=[Frame(stream_id=0, data=self.transport_parameters(),
                           offset=0, frame_type=HANDSHAKE)]
         )
         await self.send_packet_data(initial_packet)
-        self.packet_number += 1
-        if not _test_mode:
-            asyncio.create_task(self.recv_packet_continuously())
 
-    def add_stream(self, stream_id, file_path):
-        stream = Stream(stream_id, self, file_path)
+    def new_stream(self, stream_id, file_path=None, spill_to_disk=False):
+        """Create and register a stream under this connection's flow control limits."""
+        stream = Stream(stream_id, self, file_path, spill_to_disk)
+        stream.send_limit = self.peer_max_stream_data
+        if self.max_stream_data is not None:
+            stream.set_receive_window(self.max_stream_data)
         self.streams[stream_id] = stream
-        asyncio.create_task(stream.generate_frames())
+        if self.tracer is not None:
+            self.tracer.stream_state_updated(stream_id, "open")
+        return stream
+
+    def incoming_stream(self, stream_id):
+        """Create a stream the peer opened and queue its reader for accept_stream."""
+        self.close_when_received = False  # The peer uses the stream API; the application may not have accepted yet
+        stream = self.new_stream(stream_id)
+        stream.reader = StreamReader(stream)
+        self.incoming_streams.put_nowait(stream.reader)
+        return stream
+
+    def open_stream(self, stream_id=None, priority=DEFAULT_PRIORITY, weight=DEFAULT_WEIGHT,
+                    high_water=WRITE_HIGH_WATER, low_water=WRITE_LOW_WATER):
+        """Open a stream to send application data on and return its StreamWriter.
+
+        Without a stream_id the next free one of this side's parity is
+        used, so both sides can open streams without colliding. The peer
+        gets a StreamReader for it from accept_stream.
+        """
+        if stream_id is None:
+            stream_id = self.next_stream_id
+            while stream_id in self.streams:
+                stream_id += 2
+            self.next_stream_id = stream_id + 2
+        elif stream_id == 0 or stream_id in self.streams:
+            raise ValueError(f"Stream ID {stream_id} is not available")
+        self.close_when_received = False
+        stream = self.new_stream(stream_id)
+        stream.priority = priority
+        stream.weight = weight
+        stream.writer = StreamWriter(stream, high_water, low_water)
+        return stream.writer
+
+    async def accept_stream(self):
+        """Wait for the next stream the peer opens and return its StreamReader, or None once the connection closed."""
+        self.close_when_received = False
+        if self.closed and self.incoming_streams.empty():
+            return None
+        reader = await self.incoming_streams.get()
+        if reader is None:
+            self.incoming_streams.put_nowait(None)  # For the next caller too
+        return reader
 
-    async def start_streams_request(self, stream_count):
+    def stream_reader(self, stream_id):
+        """Return a StreamReader for a stream we expect data on, such as one requested with start_streams_request.
+
+        Call it before the stream's first frame arrives.
+        """
+        stream = self.streams.get(stream_id) or self.new_stream(stream_id)
+        if stream.reader is None:
+            if stream.receive_buffer is not None:
+                raise ValueError(f"Stream {stream_id} already received data without a reader")
+            stream.reader = StreamReader(stream)
+        self.close_when_received = False
+        return stream.reader
+
+    def add_stream(self, stream_id, file_path, streaming=True, use_mmap=True, priority=DEFAULT_PRIORITY,
+                   weight=DEFAULT_WEIGHT):
+        """Start sending file_path on a new stream.
+
+        priority and weight are read by the connection's scheduler: lower
+        priority values go first with "priority", and "weighted_fair" shares
+        bandwidth in proportion to weight.
+        """
+        stream = self.new_stream(stream_id, file_path)
+        stream.priority = priority
+        stream.weight = weight
+        if streaming:
+            stream.open_file(use_mmap)
+        else:
+            asyncio.create_task(stream.generate_frames())
+
+    async def start_streams_request(self, stream_count, spill_to_disk=False):
         self.stime = time.time()
         for i in range(1, stream_count + 1):
-            self.streams[i] = Stream(i, self, None)
+            self.new_stream(i, spill_to_disk=spill_to_disk)
 
-        request_packet = Packet(
-            header_form=0, flags=0,
-            dest_con_id=self.r_con_id, packet_number=self.packet_number,
-            frames=[
-                Frame(stream_id=0, data=f"REQUEST_STREAMS:{stream_count}".encode(), offset=0)]
-        )
-        await self.send_packet_data(request_packet)
-        self.packet_number += 1
+        # Queued like any other frame so loss recovery retransmits it if needed
+        await self.send(f"REQUEST_STREAMS:{stream_count}".encode())
 
     async def send(self, data):
         frame = Frame(stream_id=0, data=data, offset=0)
         await self.queue_frame(frame)
 
     async def recv(self):
-        while not self.closed:
-            if self.received_frame_queue:
-                frame = self.received_frame_queue.popleft()
-                if frame.frame_type == CLOSE:
-                    print("Received close Packet. Closing connection.")
-                    await self.close()
-                    return None
-                return frame
-            else:
-                await asyncio.sleep(0.01)
-        return None
+        """Wait for the next control message on stream 0 and return its frame, or None once the connection closed."""
+        if self.closed:
+            return None
+        frame = await self.received_frame_queue.get()
+        if frame is None:
+            self.received_frame_queue.put_nowait(None)  # For the next caller too
+        return frame
 
-    async def queue_frames_from_streams(self):
-        for stream_id, stream in self.streams.items():
-            if stream_id == 0:
-                continue
-            if not any(frame.stream_id == stream_id for frame in self.other_frame_queue):
-                frame = stream.get_next_frame()
-                if frame:
-                    self.other_frame_queue.append(frame)
+    async def request(self, data, timeout=None):
+        """Send a control request and return the body of the peer's response to it.
+
+        Raises asyncio.TimeoutError if no response arrives within timeout
+        seconds, and ConnectionResetError if the connection closes first.
+        """
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[request_id] = future
+        try:
+            await self.send(encode_control_message(REQUEST_PREFIX, request_id, data))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            del self.pending_requests[request_id]
+
+    async def respond(self, request_id, data):
+        """Answer the request recv() returned; split_request gives its ID."""
+        await self.send(encode_control_message(RESPONSE_PREFIX, request_id, data))
+
+    def on_response(self, data):
+        request_id, _, body = data[len(RESPONSE_PREFIX):].partition(b":")
+        future = self.pending_requests.get(int(request_id)) if request_id.isdigit() else None
+        if future is not None and not future.done():
+            future.set_result(body)  # A retransmitted response finds the request already answered
+
+    async def wait_closed(self):
+        await self.closed_event.wait()
 
     async def recv_packet_continuously(self):
         while not self.closed:
-            await self.recv_packet()
-            await asyncio.sleep(0.01)
+            await self.recv_packet()  # Blocks in the thread pool until a datagram arrives
@@ -0,0 +1,186 @@
+# QuicEndpoint.py
+
+import asyncio
+import random
+import struct
+from Frame import HANDSHAKE, FRAME_H_SIZE
+from Packet import LONG_HEADER
+from QuicConnection import QuicConnection
+from PathMtu import set_dont_fragment
+
+CON_ID = struct.Struct("!I")
+WORKER_ID_SHIFT = 24  # The top 8 bits of a server connection ID name the worker that owns it
+MAX_WORKERS = 1 << (32 - WORKER_ID_SHIFT)
+FORWARD_HEADER = struct.Struct("!HB")  # Client port, length of the client host that follows
+IDLE_TIMEOUT = 30.0  # Seconds without a datagram from the peer before a connection is closed
+
+
+class EndpointProtocol(asyncio.DatagramProtocol):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, addr):
+        self.endpoint.datagram_received(data, addr)
+
+    def pause_writing(self):
+        for connection in self.endpoint.connections.values():
+            connection.writable_event.clear()
+
+    def resume_writing(self):
+        for connection in self.endpoint.connections.values():
+            connection.writable_event.set()
+
+    def error_received(self, exc):
+        print(f"Endpoint socket error: {exc}")
+
+
+class QuicEndpoint:
+    """Server endpoint that owns one UDP socket and serves many connections over it.
+
+    Short-header datagrams are routed by their destination connection ID.
+    A long-header datagram whose first frame is a HANDSHAKE, from an unknown
+    (source connection ID, address) pair, creates a new QuicConnection, which
+    is handed out by accept(); other unknown datagrams are dropped.
+    Connections unregister themselves when they close, and a connection
+    that has received nothing for idle_timeout seconds is closed.
+
+    Several worker processes can each run an endpoint on the same port with
+    reuse_port. Every worker puts its worker_id in the connection IDs it
+    hands out, and a short-header datagram that the kernel delivered to the
+    wrong worker is passed on over channels, a list with one
+    (receive socket, send socket) AF_UNIX datagram pair per worker.
+    """
+
+    def __init__(self, addr, worker_id=0, reuse_port=False, channels=None, idle_timeout=IDLE_TIMEOUT,
+                 **connection_options):
+        if not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f"Worker ID must be below {MAX_WORKERS}")
+        self.addr = addr
+        self.worker_id = worker_id
+        self.reuse_port = reuse_port
+        self.channels = channels
+        self.idle_timeout = idle_timeout  # None keeps silent connections open
+        self.connection_options = connection_options  # Passed to every accepted QuicConnection
+        self.transport = None
+        self.connections = {}  # Our connection ID -> QuicConnection
+        self.handshakes = {}  # (peer connection ID, peer address) -> QuicConnection
+        self.handshake_keys = {}  # Our connection ID -> its key in handshakes
+        self.last_received = {}  # Our connection ID -> loop time of the last datagram routed to it
+        self.idle_task = None
+        self.accept_queue = asyncio.Queue()
+        self.connections_accepted = 0
+        self.datagrams_forwarded = 0  # Misrouted datagrams passed on to their owning worker
+        self.connections_timed_out = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: EndpointProtocol(self), local_addr=self.addr, reuse_port=self.reuse_port or None)
+        self.addr = self.transport.get_extra_info('sockname')
+        if self.connection_options.get("path_mtu_discovery", True):
+            set_dont_fragment(self.transport.get_extra_info('socket'))
+        if self.channels is not None:
+            channel = self.channels[self.worker_id][0]
+            channel.setblocking(False)
+            loop.add_reader(channel, self.forwarded_datagrams_received)
+        if self.idle_timeout is not None:
+            self.idle_task = loop.create_task(self.close_idle_connections())
+        print(f"Endpoint listening on {self.addr}")
+        return self.addr
+
+    async def accept(self):
+        """Wait for the next new connection."""
+        return await self.accept_queue.get()
+
+    def datagram_received(self, data, addr):
+        if len(data) < 5:
+            return
+        if data[0] >> 7:
+            # Long header: src_con_id follows the first byte and identifies the client's handshake
+            key = (CON_ID.unpack_from(data, 1)[0], addr)
+            connection = self.handshakes.get(key)
+            if connection is None:
+                if len(data) < LONG_HEADER.size + FRAME_H_SIZE or data[LONG_HEADER.size] != HANDSHAKE:
+                    return  # Only a handshake may open a connection
+                connection = self.new_connection(key)
+        else:
+            con_id = CON_ID.unpack_from(data, 1)[0]
+            connection = self.connections.get(con_id)
+            if connection is None:
+                if con_id >> WORKER_ID_SHIFT != self.worker_id:
+                    self.forward(con_id >> WORKER_ID_SHIFT, data, addr)
+                return  # Unknown or already closed connection
+        self.last_received[connection.con_id] = asyncio.get_running_loop().time()
+        connection.datagram_received(data, addr)
+
+    def forward(self, worker_id, data, addr):
+        """Pass a datagram for another worker's connection on to that worker."""
+        if self.channels is None or worker_id >= len(self.channels):
+            return
+        host = addr[0].encode()
+        try:
+            self.channels[worker_id][1].send(FORWARD_HEADER.pack(addr[1], len(host)) + host + data)
+            self.datagrams_forwarded += 1
+        except OSError as e:
+            print(f"Error forwarding datagram to worker {worker_id}: {e}")
+
+    def forwarded_datagrams_received(self):
+        channel = self.channels[self.worker_id][0]
+        while True:
+            try:
+                message = channel.recv(65536)
+            except BlockingIOError:
+                return
+            port, host_length = FORWARD_HEADER.unpack_from(message)
+            host_end = FORWARD_HEADER.size + host_length
+            self.datagram_received(message[host_end:], (message[FORWARD_HEADER.size:host_end].decode(), port))
+
+    def new_con_id(self):
+        """Return an unused connection ID that names this worker in its top bits."""
+        while True:
+            con_id = (self.worker_id << WORKER_ID_SHIFT) | random.getrandbits(WORKER_ID_SHIFT)
+            if con_id not in self.connections:
+                return con_id
+
+    def new_connection(self, key):
+        connection = QuicConnection(r_addr=key[1], endpoint=self, con_id=self.new_con_id(), **self.connection_options)
+        self.connections[connection.con_id] = connection
+        self.handshakes[key] = connection
+        self.handshake_keys[connection.con_id] = key
+        self.connections_accepted += 1
+        self.accept_queue.put_nowait(connection)
+        return connection
+
+    async def close_idle_connections(self):
+        """Close the connections that have received nothing for idle_timeout seconds."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.idle_timeout / 4)
+            deadline = loop.time() - self.idle_timeout
+            for con_id, last_received in list(self.last_received.items()):
+                connection = self.connections.get(con_id)
+                if connection is not None and last_received < deadline:
+                    print(f"Connection {con_id} idle for {self.idle_timeout} s. Closing it.")
+                    self.connections_timed_out += 1
+                    await connection.close()
+
+    def send(self, data, addr):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def remove(self, connection):
+        """Forget a closed connection so its state can be collected."""
+        if self.connections.get(connection.con_id) is connection:
+            del self.connections[connection.con_id]
+            self.last_received.pop(connection.con_id, None)
+            self.handshakes.pop(self.handshake_keys.pop(connection.con_id), None)
+
+    async def close(self):
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+        for connection in list(self.connections.values()):
+            await connection.close()
+        if self.channels is not None:
+            asyncio.get_running_loop().remove_reader(self.channels[self.worker_id][0])
+        if self.transport is not None:
+            self.transport.close()
@@ -1,41 +1,118 @@
 # quic_server.py
 
 import asyncio
-from QuicConnection import QuicConnection
+import multiprocessing
+import socket
+import time
+from QuicEndpoint import QuicEndpoint
+from QuicConnection import split_request
+from Metrics import MetricsServer
 from sys import argv
 
+WORKER_START_TIMEOUT = 10.0  # Seconds start_workers waits for every worker to bind its socket
 
-async def quic_server(port):
-    server = QuicConnection(('127.0.0.1', port), None)
-    
-    await server.listen()
 
+async def serve_connection(connection, files_dir="files_to_send"):
+    """Answer stream requests on one accepted connection until it closes.
+
+    REQUEST_STREAMS:<n> arrives as a plain control message, or as a request
+    (see QuicConnection.request) that is answered with OK:<n> or an error.
+    """
     while True:
-        if server.closed:
+        frame = await connection.recv()
+        if frame is None:
             break
-        frame = await server.recv()
-        if frame:
-            print(f"Received frame from client: {frame.data}")
-            if frame.data.startswith(b'REQUEST_STREAMS:'):
-                try:
-                    stream_count = int(frame.data.split(b':')[1])
-                    print(f"Received request to start {stream_count} streams.")
-                    for i in range(stream_count):
-                        server.add_stream(i + 1, f"files_to_send/file_{i + 1}.txt")
-                except ValueError as e:
-                    print(f"Invalid stream request: {e}")
-        await asyncio.sleep(0.01)
+        print(f"Received frame from client: {frame.data}")
+        request_id, message = split_request(frame.data)
+        response = b'ERROR:unknown request'
+        if message.startswith(b'REQUEST_STREAMS:'):
+            try:
+                stream_count = int(message.split(b':')[1])
+                print(f"Received request to start {stream_count} streams.")
+                for i in range(stream_count):
+                    if i + 1 not in connection.streams:  # Ignore a retransmitted request
+                        connection.add_stream(i + 1, f"{files_dir}/file_{i + 1}.txt")
+                response = f"OK:{stream_count}".encode()
+            except ValueError as e:
+                print(f"Invalid stream request: {e}")
+                response = f"ERROR:{e}".encode()
+        if request_id is not None:
+            await connection.respond(request_id, response)
+
+
+async def quic_server(port, files_dir="files_to_send", metrics_port=None, ready=None, **endpoint_options):
+    """Serve files on port; ready, an Event, is set once the server is listening."""
+    endpoint = QuicEndpoint(('127.0.0.1', port), **endpoint_options)
+    await endpoint.start()
+    if metrics_port is not None:
+        # Prometheus text at /metrics and JSON at /metrics.json for every open connection
+        metrics_server = MetricsServer(lambda: [connection.metrics for connection in endpoint.connections.values()],
+                                       port=metrics_port)
+        host, bound_port = await metrics_server.start()
+        print(f"Serving metrics on http://{host}:{bound_port}/metrics")
+    if ready is not None:
+        ready.set()
+
+    # Every client gets its own connection on the shared socket
+    while True:
+        connection = await endpoint.accept()
+        asyncio.create_task(serve_connection(connection, files_dir))
+
+
+def run_worker(port, worker_id, channels, files_dir, metrics_port=None, ready=None):
+    if metrics_port is not None:
+        metrics_port += worker_id  # One metrics port per worker
+    asyncio.run(quic_server(port, files_dir, metrics_port, ready, worker_id=worker_id, reuse_port=True,
+                            channels=channels))
+
+
+def start_workers(port, worker_count, files_dir="files_to_send", metrics_port=None):
+    """Start worker processes that share the port through SO_REUSEPORT and return them once all are listening.
+
+    The kernel spreads clients across the workers by address; the workers
+    pass each other any datagram that lands on the wrong one. A worker that
+    exits or has not bound its socket within WORKER_START_TIMEOUT stops
+    them all with a RuntimeError.
+    """
+    channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(worker_count)]
+    context = multiprocessing.get_context("fork")  # Workers inherit the channel sockets
+    ready_events = [context.Event() for _ in range(worker_count)]
+    workers = [context.Process(target=run_worker, args=(port, worker_id, channels, files_dir, metrics_port,
+                                                        ready_events[worker_id]),
+                               daemon=True)
+               for worker_id in range(worker_count)]
+    for worker in workers:
+        worker.start()
+    for pair in channels:
+        for channel in pair:
+            channel.close()  # The parent only supervises
+
+    deadline = time.monotonic() + WORKER_START_TIMEOUT
+    for worker_id, (worker, ready) in enumerate(zip(workers, ready_events)):
+        while not ready.wait(0.05):
+            if not worker.is_alive() or time.monotonic() > deadline:
+                for process in workers:
+                    process.terminate()
+                    process.join()
+                raise RuntimeError(f"Worker {worker_id} failed to start listening on port {port}")
+    return workers
+
 
 if __name__ == "__main__":
-    if len(argv) != 2:
-        print("Usage: python quic_server.py <port>")
+    if len(argv) not in (2, 3, 4):
+        print("Usage: python quic_server.py <port> [workers] [metrics_port]")
         exit(1)
         
     try:
         port = int(argv[1])
+        worker_count = int(argv[2]) if len(argv) >= 3 else 1
+        metrics_port = int(argv[3]) if len(argv) == 4 else None
     except Exception as e:
         print(f"Error parsing arguments: {e}")
         exit(1)
         
-    
-    asyncio.run(quic_server(port))
+    if worker_count > 1:
+        for worker in start_workers(port, worker_count, metrics_port=metrics_port):
+            worker.join()
+    else:
+        asyncio.run(quic_server(port, metrics_port=metrics_port))
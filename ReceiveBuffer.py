@@ -0,0 +1,76 @@
+# ReceiveBuffer.py
+
+import heapq
+import os
+
+
+class ReceiveBuffer:
+    """Reassembles stream data by offset and tracks the contiguous delivered prefix.
+
+    In-order data is appended to an in-memory bytearray, written straight
+    to file_path with os.pwrite when spilling to disk, or appended as bytes
+    chunks to chunks for a StreamReader to take. Only out-of-order segments
+    are held separately until the gap before them is filled.
+    """
+
+    def __init__(self, file_path=None, chunks=None):
+        self.data = bytearray()  # Delivered prefix, when not spilling to disk or handing over chunks
+        self.chunks = chunks
+        self.delivered = 0  # Length of the contiguous prefix received so far
+        self.final_size = None  # Known once the CLOSE frame arrives
+        self.segments = {}  # Offset -> out-of-order payload beyond the delivered prefix
+        self.segment_offsets = []  # Heap of the offsets in segments
+        self.buffered_bytes = 0  # Bytes held in segments
+        self.peak_buffered_bytes = 0
+        self.fd = None
+        if file_path:
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            self.fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    @property
+    def complete(self):
+        return self.final_size is not None and self.delivered >= self.final_size
+
+    def write(self, offset, data):
+        """Place data at offset and return how many new bytes became contiguous."""
+        end = offset + len(data)
+        if end <= self.delivered or not data:
+            return 0  # Duplicate of data already delivered
+
+        if offset > self.delivered:
+            existing = self.segments.get(offset)
+            if existing is None:
+                heapq.heappush(self.segment_offsets, offset)
+            elif len(existing) >= len(data):
+                return 0
+            else:
+                self.buffered_bytes -= len(existing)
+            self.segments[offset] = bytes(data)  # Do not pin the whole received datagram
+            self.buffered_bytes += len(data)
+            self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+            return 0
+
+        start = self.delivered
+        self.deliver(data[self.delivered - offset:])
+        # Pull in any buffered segments the new data has made contiguous
+        while self.segment_offsets and self.segment_offsets[0] <= self.delivered:
+            segment_offset = heapq.heappop(self.segment_offsets)
+            segment = self.segments.pop(segment_offset)
+            self.buffered_bytes -= len(segment)
+            if segment_offset + len(segment) > self.delivered:
+                self.deliver(memoryview(segment)[self.delivered - segment_offset:])
+        return self.delivered - start
+
+    def deliver(self, data):
+        if self.fd is not None:
+            os.pwrite(self.fd, data, self.delivered)
+        elif self.chunks is not None:
+            self.chunks.append(bytes(data))
+        else:
+            self.data += data
+        self.delivered += len(data)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
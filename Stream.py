@@ -1,61 +1,296 @@
 # Stream.py
 
 import asyncio
+from collections import deque
 from Frame import *
-import random
+from FileSource import ChunkedFileSource, MmapFileSource
+from ReceiveBuffer import ReceiveBuffer
 import time
 
+WRITE_COALESCE_SIZE = 4096  # Writes below this are merged into the last queued frame while it is below it too
+
 class Stream:
-    def __init__(self, stream_id, connection, file_path=None):
+    def __init__(self, stream_id, connection, file_path=None, spill_to_disk=False):
         self.stream_id = stream_id
         self.file_path = file_path or f"files_received/temp_stream_{stream_id}.txt"
         self.connection = connection
-        self.received_data = b''
-        self.frame_size = random.randint(1000, 2000)
-        self.frames = []
+        self.spill_to_disk = spill_to_disk
+        self.receive_buffer = None  # Created on the first received frame
+        self.frame_size = None  # Largest frame to cut; None lets every frame fill the rest of its packet
+        self.frames = deque()  # Outbound frames waiting to be sent, in offset order
+        self.retransmit_frames = deque()  # Lost frames, sent again before new data
+        self.pending_frames = 0
+        self.pending_bytes = 0
+        self.source = None  # File source frames are cut from lazily, see open_file
+        self.payload_source = None  # The same source, kept until release_source() so lost data can be read again
+        self.last_descriptor_packet = -1  # Newest packet that carried a frame of this stream as a descriptor only
+        self.next_offset = 0  # Offset of the next frame to cut from the source
+        # Flow control: the connection sets these when the stream is created
+        self.send_limit = float('inf')  # Peer's MAX_STREAM_DATA, new data may not go past it
+        self.blocked_at = None  # send_limit we last sent BLOCKED for
+        self.receive_window = None  # Bytes we let the peer send beyond what has been consumed
+        self.max_stream_data = float('inf')  # Limit last advertised to the peer
+        self.highest_received = 0  # End of the furthest data received
+        self.consumed = 0  # In-order bytes handed to the application
+        # Scheduling, see StreamScheduler
+        self.priority = 0
+        self.weight = 1
+        self.scheduled = False  # In the scheduler's ready list
+        self.finish_tag = 0
         self.frames_received = 0
         self.bytes_received = 0
         self.bytes_sent = 0
         self.closed = False
         self.stime = None  # Start time for the stream
         self.etime = None  # End time for the stream
+        # Application access, see StreamIO: a writer queues the data to send, a reader takes what arrives
+        self.writer = None
+        self.reader = None
 
     async def generate_frames(self):
-        """Simulate frame generation for sending (this is a placeholder for actual logic)."""
+        """Queue the whole file for sending; get_next_frame cuts it to fit each packet."""
         with open(self.file_path, 'rb') as f:
-            data = f.read()
-            for i in range(0, len(data), self.frame_size):
-                frame_data = data[i:i + self.frame_size]
+            data = memoryview(f.read())  # Pieces cut off the front are views, not copies
+            step = self.frame_size or len(data) or 1
+            for i in range(0, len(data), step):
+                frame_data = data[i:i + step]
                 frame = Frame(self.stream_id, frame_data, i)
-                self.frames.append(frame)
+                self.queue_frame(frame)
 
             last_frame = Frame(self.stream_id, b'', len(data), frame_type=CLOSE)
-            self.frames.append(last_frame)
-    
-    def get_next_frame(self):
+            self.queue_frame(last_frame)
+        self.connection.stream_ready(self)
+
+    def open_file(self, use_mmap=False):
+        """Stream the file instead of generating all frames up front.
+
+        Frames are cut from the file only when get_next_frame asks for them,
+        so memory use is bounded by the source's read-ahead, not the file size.
+        With use_mmap the payloads are slices of a mapping shared by every
+        stream serving the same file.
+        """
+        self.source = MmapFileSource(self.file_path) if use_mmap else ChunkedFileSource(self.file_path)
+        self.payload_source = self.source
+        self.pending_frames += self.source_frames_left()
+        self.pending_bytes += self.source.size
+        self.connection.stream_ready(self)
+
+    def source_frames_left(self):
+        """Data frames still to be cut from the source, plus CLOSE.
+
+        Without a frame_size the number depends on the packets to come, and
+        any remaining data counts as one frame.
+        """
+        if self.source is None:
+            return 0
+        remaining = self.source.size - self.next_offset
+        if self.frame_size is None:
+            return (remaining > 0) + 1
+        return -(-remaining // self.frame_size) + 1
+
+    def next_source_frame(self, length):
+        remaining = self.source.size - self.next_offset
+        if remaining > 0:
+            length = min(length, remaining)
+            frame = Frame(self.stream_id, self.source.read(self.next_offset, length), self.next_offset)
+            self.next_offset += length
+            return frame
+
+        self.source = None  # payload_source stays open for retransmissions
+        return Frame(self.stream_id, b'', self.next_offset, frame_type=CLOSE)
+
+    def write(self, data):
+        """Queue data to send after everything written so far."""
+        if not data:
+            return
+        data = bytes(data)  # The caller may reuse its buffer
+        tail = self.frames[-1] if self.frames else None
+        if (tail is not None and tail.frame_type == DATA and tail.length < WRITE_COALESCE_SIZE and
+                len(data) < WRITE_COALESCE_SIZE):
+            tail.data = memoryview(bytes(tail.data) + data)  # Not sent yet: tail frames are cut off the front
+            tail.length += len(data)
+            self.pending_bytes += len(data)
+        else:
+            # A view, so cutting pieces off the front for each packet does not copy the rest
+            self.queue_frame(Frame(self.stream_id, memoryview(data), self.next_offset))
+        self.next_offset += len(data)
+        self.connection.stream_ready(self)
+
+    def finish(self):
+        """Queue CLOSE after the data written so far."""
+        self.queue_frame(Frame(self.stream_id, b'', self.next_offset, frame_type=CLOSE))
+        self.connection.stream_ready(self)
+
+    def queue_frame(self, frame):
+        self.frames.append(frame)
+        self.pending_frames += 1
+        self.pending_bytes += frame.length
+
+    def requeue_frame(self, frame):
+        """Schedule a lost frame to be sent again at its original offset."""
+        self.retransmit_frames.append(frame)
+        self.pending_frames += 1
+        self.pending_bytes += frame.length
+        self.connection.stream_ready(self)
+
+    def sent_data(self, offset, length):
+        """Read back length bytes sent from the source at offset, to resend them."""
+        return self.payload_source.read(offset, length)
+
+    def release_source(self):
+        """Close the source once nothing sent from it can need resending."""
+        if self.payload_source is not None:
+            self.payload_source.close()
+            self.payload_source = None
+        self.source = None
+
+    def release(self):
+        """Close the source and an unfinished spill file when the connection closes."""
+        self.release_source()
+        if self.receive_buffer is not None:
+            self.receive_buffer.close()
+        # Wake anyone waiting on the stream, they find the connection closed
+        if self.writer is not None:
+            self.writer.drain_event.set()
+        if self.reader is not None:
+            self.reader.data_event.set()
+
+    def split_head(self, frames, max_length):
+        """Split the first of frames so it carries at most max_length bytes, cutting it to fit a packet."""
+        frame = frames[0]
+        if frame.length <= max_length:
+            return
+        frames[0] = Frame(self.stream_id, frame.data[max_length:], frame.offset + max_length, frame.frame_type)
+        frames.appendleft(Frame(self.stream_id, frame.data[:max_length], frame.offset, frame.frame_type))
+        self.pending_frames += 1
+
+    def next_frame_length(self, connection_credit=float('inf'), max_length=float('inf')):
+        """Payload length of the frame get_next_frame would return.
+
+        Returns None if nothing is pending, or if only new data is pending and
+        neither the stream's send_limit nor connection_credit allows any of it.
+        Retransmissions were within credit when first sent and are never held back.
+        Frames are cut to at most max_length bytes, and new data to the credit left.
+        """
+        if self.retransmit_frames:
+            return min(self.retransmit_frames[0].length, max_length)
+        if self.frames:
+            frame = self.frames[0]
+            if frame.length == 0:
+                return 0  # CLOSE carries no data
+            length = min(frame.length, max_length, connection_credit, self.send_limit - frame.offset)
+            return length if length > 0 else None
+        if self.source:
+            remaining = self.source.size - self.next_offset
+            if remaining == 0:
+                return 0  # Only CLOSE is left, it carries no data
+            length = min(remaining, max_length, connection_credit, self.send_limit - self.next_offset)
+            if self.frame_size is not None:
+                length = min(length, self.frame_size)
+            return length if length > 0 else None
+        return None
+
+    def next_frame_offset(self):
+        """Offset of the frame get_next_frame would return, which sizes its header."""
+        if self.retransmit_frames:
+            return self.retransmit_frames[0].offset
+        if self.frames:
+            return self.frames[0].offset
+        return self.next_offset
+
+    @property
+    def blocked(self):
+        """True if new data is waiting but the peer's stream limit does not allow any of it."""
+        if self.retransmit_frames:
+            return False
         if self.frames:
+            return self.frames[0].length > 0 and self.frames[0].offset >= self.send_limit
+        return self.source is not None and self.source.size > self.next_offset >= self.send_limit
+
+    def get_next_frame(self, connection_credit=float('inf'), max_length=float('inf')):
+        if self.retransmit_frames:
+            self.split_head(self.retransmit_frames, max_length)
+            frame = self.retransmit_frames.popleft()
+            self.pending_frames -= 1
+            self.pending_bytes -= frame.length
+            return frame
+        if self.frames or self.source:
+            length = self.next_frame_length(connection_credit, max_length)
+            if length is None:
+                return None  # Out of credit
             if self.stime is None:
                 self.stime = time.time()  # Record start time when sending the first frame
-            frame = self.frames.pop(0)
+            if self.frames:
+                self.split_head(self.frames, length)
+                frame = self.frames.popleft()
+                self.pending_frames -= 1
+            else:
+                frames_left = self.source_frames_left()
+                frame = self.next_source_frame(length)
+                # A frame cut short by credit leaves more frames to come than planned
+                self.pending_frames += self.source_frames_left() - frames_left
+            self.pending_bytes -= frame.length
             self.bytes_sent += frame.length
+            if self.writer is not None:
+                self.writer.on_data_sent()
             return frame
         return None  # Only return None when no more frames are available
 
+    @property
+    def received_data(self):
+        """In-order data received so far (empty when spilling to disk)."""
+        return self.receive_buffer.data if self.receive_buffer else b''
+
+    def set_receive_window(self, window):
+        """Start advertising window bytes of credit beyond what has been consumed."""
+        self.receive_window = window
+        self.max_stream_data = self.consumed + window
+
+    def window_update(self):
+        """Return a raised limit to advertise once half the window is used up, else None."""
+        if self.receive_window is None or self.closed:
+            return None
+        if self.max_stream_data - self.consumed > self.receive_window // 2:
+            return None
+        self.max_stream_data = self.consumed + self.receive_window
+        return self.max_stream_data
+
     async def receive_frame(self, frame):
+        """Take in a frame and return how many bytes it made available in order.
+
+        With a reader the data is handed to it instead and 0 is returned:
+        it only counts as consumed once read.
+        """
         if self.stime is None:
             self.stime = time.time()  # Record start time when receiving the first frame
-        
-        self.received_data += frame.data
+        if self.receive_buffer is None:
+            self.receive_buffer = ReceiveBuffer(self.file_path if self.spill_to_disk else None,
+                                                self.reader.chunks if self.reader is not None else None)
+
+        delivered = self.receive_buffer.write(frame.offset, frame.data)
+        if self.reader is None:
+            self.consumed += delivered  # In-order data is handed over as soon as it is contiguous
+        self.highest_received = max(self.highest_received, frame.offset + frame.length)
         self.bytes_received += frame.length
         self.frames_received += 1
 
         if frame.frame_type == CLOSE:
-            if not self.closed:
-                self.etime = time.time()  # Set end time only on receiving the CLOSE frame
-                print(f"Stream {self.stream_id} reception completed.")
-                self.closed = True  # Mark stream as closed
+            self.receive_buffer.final_size = frame.offset  # CLOSE is sent at the end of the data
+
+        # Frames may arrive out of order, so the stream completes once every byte up to CLOSE is in
+        if self.receive_buffer.complete and not self.closed:
+            self.etime = time.time()  # Set end time only once the whole stream has arrived
+            self.closed = True  # Mark stream as closed
+            self.receive_buffer.close()
+        if self.reader is not None:
+            if delivered or self.closed:
+                self.reader.feed(delivered)
+            return 0  # Consumed only once the reader takes it
+        return delivered
 
     async def save_to_file(self):
+        if self.spill_to_disk:
+            return  # In-order data was already written to the file as it arrived
         print(f"Saving stream {self.stream_id} data to {self.file_path}.")
         try:
             with open(self.file_path, 'wb') as f:
@@ -0,0 +1,162 @@
+# StreamIO.py
+
+import asyncio
+from collections import deque
+
+KB = 1024
+WRITE_HIGH_WATER = 256 * KB  # drain() waits while more than this is queued on the stream
+WRITE_LOW_WATER = 64 * KB  # ... and returns once the sender has taken it down to this
+
+
+class StreamWriter:
+    """Writes application data to a stream, in the style of asyncio.StreamWriter.
+
+    write() queues data on the stream without waiting; the connection cuts
+    it into frames as congestion and flow control allow. await drain()
+    after writing holds the producer back while more than high_water bytes
+    are still waiting to be sent, so memory stays bounded whatever the
+    producer's speed. close() ends the stream and wait_closed() waits until
+    the peer has acknowledged its end.
+    """
+
+    def __init__(self, stream, high_water=WRITE_HIGH_WATER, low_water=WRITE_LOW_WATER):
+        if low_water > high_water:
+            raise ValueError("low_water must not exceed high_water")
+        self.stream = stream
+        self.connection = stream.connection
+        self.high_water = high_water
+        self.low_water = low_water
+        self.drain_event = asyncio.Event()
+        self.closed_event = None  # Set once the CLOSE frame is acknowledged, see close()
+
+    @property
+    def stream_id(self):
+        return self.stream.stream_id
+
+    def write(self, data):
+        if self.closed_event is not None:
+            raise RuntimeError(f"Stream {self.stream_id} is closed for writing")
+        if self.connection.closed:
+            raise ConnectionResetError("Connection closed")
+        self.stream.write(data)
+
+    def writelines(self, lines):
+        for data in lines:
+            self.write(data)
+
+    async def drain(self):
+        """Wait until the data queued on the stream is down to low_water, if it is above high_water."""
+        if self.stream.pending_bytes > self.high_water:
+            while self.stream.pending_bytes > self.low_water and not self.connection.closed:
+                self.drain_event.clear()
+                await self.drain_event.wait()
+        if self.connection.closed:
+            raise ConnectionResetError("Connection closed")
+
+    def on_data_sent(self):
+        if self.stream.pending_bytes <= self.low_water:
+            self.drain_event.set()
+
+    def close(self):
+        """End the stream after the data written so far."""
+        if self.closed_event is not None:
+            return
+        self.closed_event = asyncio.Event()
+        self.connection.fin_waiters[self.stream_id] = self.closed_event
+        self.stream.finish()
+
+    def is_closing(self):
+        return self.closed_event is not None
+
+    async def wait_closed(self):
+        """Wait until the peer has acknowledged the end of the stream, or the connection closed."""
+        await self.closed_event.wait()
+
+
+class StreamReader:
+    """Reads a stream's data in order as it arrives, in the style of asyncio.StreamReader.
+
+    Delivered data waits here as chunks. It only counts as consumed, and
+    only extends the flow control credit given to the peer, once read(), so
+    a slow consumer slows the sender down instead of growing the buffer.
+    Iterating with async for yields the chunks as they were delivered.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.connection = stream.connection
+        self.chunks = deque()  # Delivered in-order data not yet read; the stream's ReceiveBuffer appends to it
+        self.buffered = 0
+        self.data_event = asyncio.Event()
+
+    @property
+    def stream_id(self):
+        return self.stream.stream_id
+
+    def feed(self, length):
+        """Called by the stream when length more bytes were delivered or it completed."""
+        self.buffered += length
+        self.data_event.set()
+
+    def at_eof(self):
+        return self.stream.closed and not self.chunks
+
+    async def wait_for_data(self):
+        """Wait until data is buffered and return True, or return False at the end of the stream."""
+        while not self.chunks:
+            if self.stream.closed:
+                return False
+            if self.connection.closed:
+                raise ConnectionResetError(f"Connection closed before stream {self.stream_id} was complete")
+            self.data_event.clear()
+            await self.data_event.wait()
+        return True
+
+    async def read(self, n=-1):
+        """Read up to n bytes, or everything up to the end of the stream if n is -1; b'' at the end."""
+        if n < 0:
+            parts = []
+            while await self.wait_for_data():
+                parts.append(self.take(self.buffered))
+            return b''.join(parts)
+        if n == 0 or not await self.wait_for_data():
+            return b''
+        return self.take(n)
+
+    async def readexactly(self, n):
+        parts = []
+        needed = n
+        while needed:
+            if not await self.wait_for_data():
+                partial = b''.join(parts)
+                raise asyncio.IncompleteReadError(partial, n)
+            part = self.take(needed)
+            parts.append(part)
+            needed -= len(part)
+        return b''.join(parts)
+
+    def take(self, n):
+        """Remove up to n buffered bytes and hand them back as consumed."""
+        parts = []
+        taken = 0
+        while self.chunks and taken < n:
+            chunk = self.chunks.popleft()
+            if taken + len(chunk) > n:
+                self.chunks.appendleft(chunk[n - taken:])
+                chunk = chunk[:n - taken]
+            parts.append(chunk)
+            taken += len(chunk)
+        self.buffered -= taken
+        self.connection.stream_data_read(self.stream, taken)
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not await self.wait_for_data():
+            raise StopAsyncIteration
+        chunk = self.chunks.popleft()
+        self.buffered -= len(chunk)
+        self.connection.stream_data_read(self.stream, len(chunk))
+        return chunk
@@ -0,0 +1,140 @@
+# StreamScheduler.py
+
+import heapq
+from abc import ABC, abstractmethod
+from collections import deque
+
+DEFAULT_PRIORITY = 0
+DEFAULT_WEIGHT = 1
+
+
+class StreamScheduler(ABC):
+    """Decides which stream the next frame of a packet is taken from.
+
+    Only streams that may have data to send are kept, in a ready structure
+    updated incrementally: the connection push()es a stream when it gets
+    data or credit, the packet builder peek()s at the next one, pop()s it
+    when it turns out to have nothing sendable, and calls served() after
+    taking a frame from it. Subclasses define the order.
+    """
+
+    def __len__(self):
+        return len(self.ready)
+
+    @abstractmethod
+    def push(self, stream):
+        """Add a stream that may have data to send, unless it is already scheduled."""
+
+    @abstractmethod
+    def peek(self):
+        """The stream to take the next frame from, or None."""
+
+    @abstractmethod
+    def pop(self):
+        """Remove and return the head of the ready list."""
+
+    @abstractmethod
+    def served(self, stream, length):
+        """Account for a frame of length bytes taken from stream, the head of the ready list."""
+
+
+class HeapScheduler(StreamScheduler):
+    """Ready streams in a heap ordered by key(), which subclasses define."""
+
+    def __init__(self):
+        self.ready = []  # Heap of (key, sequence, stream)
+        self.sequence = 0  # Tie-breaker that keeps equal keys in arrival order
+
+    def push(self, stream):
+        if stream.scheduled:
+            return
+        stream.scheduled = True
+        self.sequence += 1
+        heapq.heappush(self.ready, (self.key(stream), self.sequence, stream))
+
+    def peek(self):
+        return self.ready[0][2] if self.ready else None
+
+    def pop(self):
+        stream = heapq.heappop(self.ready)[2]
+        stream.scheduled = False
+        return stream
+
+    def served(self, stream, length):
+        self.pop()
+        self.on_served(stream, length)
+        self.push(stream)
+
+    @abstractmethod
+    def key(self, stream):
+        """Sort key of a stream being pushed; the smallest goes first."""
+
+    def on_served(self, stream, length):
+        pass
+
+
+class RoundRobin(StreamScheduler):
+    """One frame from each ready stream in turn."""
+
+    def __init__(self):
+        self.ready = deque()
+
+    def push(self, stream):
+        if not stream.scheduled:
+            stream.scheduled = True
+            self.ready.append(stream)
+
+    def peek(self):
+        return self.ready[0] if self.ready else None
+
+    def pop(self):
+        stream = self.ready.popleft()
+        stream.scheduled = False
+        return stream
+
+    def served(self, stream, length):
+        self.ready.rotate(-1)
+
+
+class WeightedFair(HeapScheduler):
+    """Weighted fair queueing by bytes: each ready stream gets bandwidth in proportion to its weight.
+
+    A stream's finish tag advances by length / weight for every frame it
+    sends, and the stream with the smallest tag goes next. A stream that
+    becomes ready again starts from the current virtual time, so idling
+    earns it no burst.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.virtual_time = 0
+
+    def key(self, stream):
+        stream.finish_tag = max(stream.finish_tag, self.virtual_time)
+        return stream.finish_tag
+
+    def on_served(self, stream, length):
+        self.virtual_time = stream.finish_tag
+        stream.finish_tag += max(length, 1) / stream.weight
+
+
+class StrictPriority(HeapScheduler):
+    """Lower priority values always go first; streams of equal priority take turns."""
+
+    def key(self, stream):
+        return stream.priority
+
+
+class ShortestRemainingFirst(HeapScheduler):
+    """The stream with the fewest bytes left to send goes first, finishing short transfers early."""
+
+    def key(self, stream):
+        return stream.pending_bytes
+
+
+STREAM_SCHEDULERS = {
+    "round_robin": RoundRobin,
+    "weighted_fair": WeightedFair,
+    "priority": StrictPriority,
+    "shortest_first": ShortestRemainingFirst,
+}
@@ -6,6 +6,7 @@ import os
 from unittest.mock import MagicMock, patch
 from Stream import Stream
 from Frame import Frame, DATA, CLOSE
+from FileSource import ChunkedFileSource, MmapFileSource, shared_mappings
 
 class TestStream(unittest.TestCase):
 
@@ -47,6 +48,132 @@ class TestStream(unittest.TestCase):
         self.assertEqual(self.stream.bytes_sent, frame.length, "Bytes sent not updated correctly after retrieving frame.") # check if bytes sent is updated correctly
         self.assertIsNotNone(self.stream.stime, "Start time should be set after retrieving first frame.") # check if start time is set
 
+    def test_pending_counters(self):
+        """Test that pending frame and byte counters track the outbound queue."""
+        asyncio.run(self.stream.generate_frames())
+        self.assertEqual(self.stream.pending_frames, len(self.stream.frames), "Pending frame count mismatch after generation") # data frames plus CLOSE
+        self.assertEqual(self.stream.pending_bytes, len(self.sample_data), "Pending bytes should equal the file size")
+        self.assertEqual(self.stream.next_frame_length(), self.stream.frames[0].length, "Next frame length mismatch")
+
+        while self.stream.get_next_frame():
+            pass
+
+        self.assertEqual(self.stream.pending_frames, 0, "No frames should be pending after draining the stream")
+        self.assertEqual(self.stream.pending_bytes, 0, "No bytes should be pending after draining the stream")
+        self.assertIsNone(self.stream.next_frame_length(), "Next frame length should be None when nothing is pending")
+
+    def test_open_file_streams_frames_lazily(self):
+        """Test that a streaming stream cuts frames from the file only when asked."""
+        self.stream.frame_size = 10
+        self.stream.open_file()
+        self.assertEqual(len(self.stream.frames), 0, "No frames should be materialized up front.")
+        self.assertEqual(self.stream.pending_bytes, len(self.sample_data), "Pending bytes should equal the file size")
+        self.assertEqual(self.stream.pending_frames, 5, "Four data frames plus CLOSE should be pending")
+
+        frames = []
+        while self.stream.pending_frames:
+            frames.append(self.stream.get_next_frame())
+
+        self.assertEqual(b''.join(bytes(frame.data) for frame in frames), self.sample_data, "Streamed data does not match the file")
+        self.assertEqual([frame.offset for frame in frames[:-1]], [0, 10, 20, 30], "Frame offsets mismatch")
+        self.assertEqual(frames[-1].frame_type, CLOSE, "Last streamed frame should be CLOSE")
+        self.assertEqual(frames[-1].offset, len(self.sample_data), "CLOSE frame should carry the final size")
+        self.assertIsNone(self.stream.get_next_frame(), "Nothing should remain after CLOSE")
+
+    def test_send_limit_holds_back_new_data(self):
+        """Test that frames stop at the peer's stream limit and resume when it is raised."""
+        self.stream.frame_size = 10
+        self.stream.open_file()
+        self.stream.send_limit = 15
+
+        self.assertEqual(self.stream.get_next_frame().length, 10, "First frame should fit the limit")
+        frame = self.stream.get_next_frame()
+        self.assertEqual((frame.offset, frame.length), (10, 5), "Frame should be cut at the limit")
+        self.assertIsNone(self.stream.next_frame_length(), "Nothing may be sent at the limit")
+        self.assertTrue(self.stream.blocked, "Stream should report being blocked")
+
+        self.stream.send_limit = 100
+        self.assertFalse(self.stream.blocked, "Raising the limit should unblock the stream")
+        frames = []
+        while self.stream.pending_frames:
+            frames.append(self.stream.get_next_frame())
+        self.assertEqual([frame.offset for frame in frames], [15, 25, 34], "Remaining frames mismatch")
+        self.assertEqual(frames[-1].frame_type, CLOSE, "Stream should still end with CLOSE")
+
+    def test_connection_credit_limits_frame_length(self):
+        """Test that the connection's credit cuts frames short and retransmissions ignore it."""
+        self.stream.frame_size = 10
+        self.stream.open_file()
+        self.assertEqual(self.stream.next_frame_length(connection_credit=4), 4, "Frame should fit the connection credit")
+        self.assertIsNone(self.stream.next_frame_length(connection_credit=0), "No new data without credit")
+
+        lost = self.stream.get_next_frame(connection_credit=4)
+        self.stream.requeue_frame(lost)
+        self.assertEqual(self.stream.get_next_frame(connection_credit=0), lost, "Retransmissions need no new credit")
+
+    def test_max_length_splits_large_frames(self):
+        """Test that queued and retransmitted frames larger than max_length go out in pieces."""
+        asyncio.run(self.stream.generate_frames())  # One frame holds the whole file
+        frame = self.stream.get_next_frame(max_length=10)
+        self.assertEqual((frame.offset, frame.data), (0, self.sample_data[:10]), "First piece mismatch")
+        self.stream.requeue_frame(frame)
+        self.assertEqual(self.stream.next_frame_length(max_length=4), 4, "Retransmissions should be split too")
+
+        data = b''
+        while self.stream.pending_frames:
+            frame = self.stream.get_next_frame(max_length=4)
+            self.assertLessEqual(frame.length, 4, "No frame may exceed max_length")
+            if frame.offset == len(data):
+                data += frame.data
+        self.assertEqual(data, self.sample_data, "The pieces should cover the data in order")
+        self.assertEqual(frame.frame_type, CLOSE, "CLOSE should still come last")
+
+    def test_receive_window_updates(self):
+        """Test that the receive limit is raised once half the window has been consumed."""
+        self.stream.set_receive_window(20)
+        self.assertEqual(self.stream.max_stream_data, 20, "Initial limit should equal the window")
+
+        asyncio.run(self.stream.receive_frame(Frame(stream_id=1, data=b'x' * 8, offset=0)))
+        self.assertIsNone(self.stream.window_update(), "No update before half the window is used")
+        delivered = asyncio.run(self.stream.receive_frame(Frame(stream_id=1, data=b'x' * 4, offset=8)))
+        self.assertEqual(delivered, 4, "receive_frame should report newly contiguous bytes")
+        self.assertEqual(self.stream.window_update(), 32, "Limit should move to consumed bytes plus the window")
+        self.assertIsNone(self.stream.window_update(), "A fresh limit needs no immediate update")
+
+    def test_chunked_source_read_ahead_is_bounded(self):
+        """Test that the file source keeps at most one read-ahead chunk in memory."""
+        source = ChunkedFileSource(self.file_path, read_ahead=8)
+        chunks = [bytes(source.read(offset, 4)) for offset in range(0, len(self.sample_data), 4)]
+        self.assertLessEqual(len(source.buffer), 8, "Read-ahead buffer grew past its bound")
+        self.assertEqual(b''.join(chunks), self.sample_data, "Chunked reads do not match the file")
+        self.assertEqual(bytes(source.read(0, 5)), self.sample_data[:5], "Seeking back should re-read from disk")
+        source.close()
+
+    def test_open_file_with_mmap(self):
+        """Test that an mmap-backed stream yields views of the mapping with the file's contents."""
+        self.stream.open_file(use_mmap=True)
+        frame = self.stream.get_next_frame()
+        self.assertIsInstance(frame.data, memoryview, "mmap payloads should be views, not copies")
+        self.assertEqual(bytes(frame.data), self.sample_data[:frame.length], "mmap payload mismatch")
+        while self.stream.get_next_frame():
+            pass
+        self.assertEqual(bytes(self.stream.sent_data(2, 3)), self.sample_data[2:5],
+                         "Sent data should stay readable for retransmission once the stream is drained")
+        self.stream.release()
+        self.assertEqual(len(shared_mappings), 0, "Mapping should be released with the stream")
+
+    def test_mmap_sources_share_mapping(self):
+        """Test that sources for the same file share one mapping and release it with the last reader."""
+        first = MmapFileSource(self.file_path)
+        second = MmapFileSource(self.file_path)
+        self.assertEqual(len(shared_mappings), 1, "Both sources should share a single mapping")
+        self.assertEqual(bytes(second.read(7, 4)), self.sample_data[7:11], "Shared mapping read mismatch")
+
+        first.close()
+        self.assertEqual(len(shared_mappings), 1, "Mapping must stay open while a reader remains")
+        second.close()
+        self.assertEqual(len(shared_mappings), 0, "Mapping should be released by the last reader")
+
     def test_receive_frame(self):
         """Test processing a received frame."""
         frame_data = b"Test frame data"
@@ -57,6 +184,48 @@ class TestStream(unittest.TestCase):
         self.assertEqual(self.stream.frames_received, 1, "Frames received count not updated correctly.") # check if frames received count is updated correctly
         self.assertEqual(self.stream.received_data, frame_data, "Received data not accumulated correctly.") # check if received data is accumulated correctly
 
+    def test_receive_out_of_order(self):
+        """Test that frames are placed by offset and the stream completes only when the gaps are filled."""
+        chunks = [(0, b"Hello, "), (7, b"this is "), (15, b"reordered")]
+        close_frame = Frame(stream_id=1, data=b'', offset=24, frame_type=CLOSE)
+
+        for frame in (close_frame, Frame(1, chunks[2][1], chunks[2][0]), Frame(1, chunks[0][1], chunks[0][0])):
+            asyncio.run(self.stream.receive_frame(frame))
+            self.assertFalse(self.stream.closed, "Stream must not close while data is missing")
+
+        asyncio.run(self.stream.receive_frame(Frame(1, chunks[0][1], chunks[0][0])))  # duplicate
+        asyncio.run(self.stream.receive_frame(Frame(1, chunks[1][1], chunks[1][0])))
+
+        self.assertEqual(self.stream.received_data, b"Hello, this is reordered", "Data not reassembled by offset")
+        self.assertTrue(self.stream.closed, "Stream should close once every byte up to CLOSE arrived")
+        self.assertEqual(self.stream.receive_buffer.buffered_bytes, 0, "No out-of-order data should remain buffered")
+
+    def test_receive_spill_to_disk(self):
+        """Test that in-order data is written to the file as it arrives when spilling to disk."""
+        stream = Stream(stream_id=2, connection=self.connection_mock, file_path="test_stream_spill.txt", spill_to_disk=True)
+        self.addCleanup(os.remove, "test_stream_spill.txt")
+
+        asyncio.run(stream.receive_frame(Frame(2, b"world", 6)))
+        asyncio.run(stream.receive_frame(Frame(2, b"hello ", 0)))
+        asyncio.run(stream.receive_frame(Frame(2, b'', 11, frame_type=CLOSE)))
+
+        self.assertTrue(stream.closed, "Stream should be closed after all data and CLOSE arrived")
+        self.assertEqual(stream.received_data, b'', "Spilled data should not be kept in memory")
+        with open("test_stream_spill.txt", 'rb') as f:
+            self.assertEqual(f.read(), b"hello world", "Spilled file content mismatch")
+
+    def test_release_closes_spill_file(self):
+        """Test that releasing a stream that never completed closes its spill file."""
+        stream = Stream(stream_id=2, connection=self.connection_mock, file_path="test_stream_spill.txt", spill_to_disk=True)
+        self.addCleanup(os.remove, "test_stream_spill.txt")
+
+        asyncio.run(stream.receive_frame(Frame(2, b"partial", 0)))
+        self.assertIsNotNone(stream.receive_buffer.fd, "Spill file should stay open while data is missing")
+        stream.release()
+        self.assertIsNone(stream.receive_buffer.fd, "Spill file should be closed with the stream")
+        with open("test_stream_spill.txt", 'rb') as f:
+            self.assertEqual(f.read(), b"partial", "Data received before the release should be on disk")
+
     def test_receive_close_frame(self):
         """Test handling of a CLOSE frame."""
         close_frame = Frame(stream_id=1, data=b'', offset=0, frame_type=CLOSE)
@@ -0,0 +1,217 @@
+# Trace.py
+
+import asyncio
+import json
+import time
+from Frame import HANDSHAKE, ACK, DATA, CLOSE, MAX_DATA, MAX_STREAM_DATA, BLOCKED, PADDING
+
+QLOG_VERSION = "0.3"
+QLOG_FORMAT = "NDJSON"  # One JSON record per line: the header first, then one line per event
+TRACE_CAPACITY = 64 * 1024  # Events held in memory between flushes
+FLUSH_INTERVAL = 0.1  # Seconds between writes of the recorded events to the trace file
+
+# qlog event names
+PACKET_SENT = "transport:packet_sent"
+PACKET_RECEIVED = "transport:packet_received"
+STREAM_STATE_UPDATED = "transport:stream_state_updated"
+CONNECTION_STATE_UPDATED = "connectivity:connection_state_updated"
+PACKET_LOST = "recovery:packet_lost"
+METRICS_UPDATED = "recovery:metrics_updated"
+LOG_INFO = "loglevel:info"
+LOG_WARNING = "loglevel:warning"
+LOG_ERROR = "loglevel:error"
+
+
+def frame_descriptor(frame):
+    """The fields of a frame a trace records; its payload is never kept."""
+    return frame.frame_type, frame.stream_id, frame.offset, frame.length
+
+
+def format_frame(frame_type, stream_id, offset, length):
+    """A frame descriptor as a qlog frame object."""
+    if frame_type in (DATA, CLOSE):
+        if stream_id == 0:
+            if frame_type == CLOSE:
+                return {"frame_type": "connection_close"}
+            return {"frame_type": "stream", "stream_id": 0, "offset": offset, "length": length}
+        return {"frame_type": "stream", "stream_id": stream_id, "offset": offset, "length": length,
+                "fin": frame_type == CLOSE}
+    if frame_type == ACK:
+        return {"frame_type": "ack", "ack_delay": offset / 1000, "length": length}  # offset holds microseconds
+    if frame_type & HANDSHAKE:
+        return {"frame_type": "crypto", "offset": offset, "length": length}
+    if frame_type == MAX_DATA:
+        return {"frame_type": "max_data", "maximum": offset}
+    if frame_type == MAX_STREAM_DATA:
+        return {"frame_type": "max_stream_data", "stream_id": stream_id, "maximum": offset}
+    if frame_type == BLOCKED:
+        if stream_id == 0:
+            return {"frame_type": "data_blocked", "limit": offset}
+        return {"frame_type": "stream_data_blocked", "stream_id": stream_id, "limit": offset}
+    if frame_type == PADDING:
+        return {"frame_type": "padding", "length": length}
+    return {"frame_type": "unknown", "raw_frame_type": frame_type}
+
+
+def format_packet(data):
+    packet_type, packet_number, size, frames = data
+    return {"header": {"packet_type": packet_type, "packet_number": packet_number}, "raw": {"length": size},
+            "frames": [format_frame(*frame) for frame in frames]}
+
+
+def format_packet_lost(data):
+    packet_number, size = data
+    return {"header": {"packet_type": "1RTT", "packet_number": packet_number}, "raw": {"length": size}}
+
+
+def format_metrics(data):
+    congestion_window, bytes_in_flight, smoothed_rtt, latest_rtt = data
+    metrics = {"bytes_in_flight": bytes_in_flight, "smoothed_rtt": smoothed_rtt * 1000,
+               "latest_rtt": latest_rtt * 1000}
+    if congestion_window is not None:
+        metrics["congestion_window"] = congestion_window
+    return metrics
+
+
+def format_stream_state(data):
+    stream_id, state = data
+    return {"stream_id": stream_id, "new": state}
+
+
+def format_connection_state(data):
+    return {"new": data}
+
+
+def format_message(data):
+    return {"message": data}
+
+
+# Events are recorded with their raw fields and only turned into qlog data when they are written
+EVENT_FORMATTERS = {
+    PACKET_SENT: format_packet,
+    PACKET_RECEIVED: format_packet,
+    PACKET_LOST: format_packet_lost,
+    METRICS_UPDATED: format_metrics,
+    STREAM_STATE_UPDATED: format_stream_state,
+    CONNECTION_STATE_UPDATED: format_connection_state,
+    LOG_INFO: format_message,
+    LOG_WARNING: format_message,
+    LOG_ERROR: format_message,
+}
+
+
+class Tracer:
+    """Records a connection's events in a preallocated ring buffer and writes them to a qlog file in the background.
+
+    Recording an event stores one (time, name, raw fields) tuple in the next
+    slot; building the qlog JSON and writing it happen later, in a flush
+    task that runs every flush_interval, or sooner once the buffer is half
+    full. If events arrive faster than they are written, the oldest unwritten
+    ones are overwritten and counted in dropped.
+    """
+
+    def __init__(self, path, vantage_point="client", capacity=TRACE_CAPACITY, flush_interval=FLUSH_INTERVAL,
+                 title=None):
+        self.path = path
+        self.events = [None] * capacity
+        self.capacity = capacity
+        self.recorded = 0  # Events recorded so far; the next one goes to slot recorded % capacity
+        self.written = 0  # Events before this one have been written or dropped
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self.flush_event = asyncio.Event()
+        self.flush_task = None
+        self.closed = False
+        self.start_time = time.perf_counter()
+        self.file = open(path, "w")
+        header = {
+            "qlog_version": QLOG_VERSION,
+            "qlog_format": QLOG_FORMAT,
+            "title": title or path,
+            "trace": {
+                "vantage_point": {"type": vantage_point},
+                "common_fields": {"time_format": "relative", "reference_time": time.time() * 1000},
+            },
+        }
+        self.file.write(json.dumps(header) + "\n")
+
+    def record(self, name, data):
+        position = self.recorded
+        if position - self.written >= self.capacity:
+            self.written += 1  # Full: the oldest unwritten event gives way
+            self.dropped += 1
+        elif position - self.written == self.capacity // 2:
+            self.flush_event.set()
+        self.events[position % self.capacity] = (time.perf_counter(), name, data)
+        self.recorded = position + 1
+
+    def packet_sent(self, packet_type, packet_number, size, frames):
+        self.record(PACKET_SENT, (packet_type, packet_number, size, tuple(map(frame_descriptor, frames))))
+
+    def packet_received(self, packet_type, packet_number, size, frames):
+        self.record(PACKET_RECEIVED, (packet_type, packet_number, size, tuple(map(frame_descriptor, frames))))
+
+    def packet_lost(self, packet_number, size):
+        self.record(PACKET_LOST, (packet_number, size))
+
+    def metrics_updated(self, congestion_window, bytes_in_flight, smoothed_rtt, latest_rtt):
+        self.record(METRICS_UPDATED, (congestion_window, bytes_in_flight, smoothed_rtt, latest_rtt))
+
+    def stream_state_updated(self, stream_id, state):
+        self.record(STREAM_STATE_UPDATED, (stream_id, state))
+
+    def connection_state_updated(self, state):
+        self.record(CONNECTION_STATE_UPDATED, state)
+
+    def log(self, message, level=LOG_INFO):
+        self.record(level, message)
+
+    def start(self):
+        """Start the background flush task; call it with the event loop running."""
+        if self.flush_task is None and not self.closed:
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush_continuously())
+
+    async def flush_continuously(self):
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+            lines = self.take_lines()
+            if lines:
+                await loop.run_in_executor(None, self.write, lines)
+
+    def write(self, lines):
+        self.file.write(lines)
+        self.file.flush()  # Readable while the connection is still running
+
+    def take_lines(self):
+        """The qlog lines of every event not yet written, which frees their slots."""
+        lines = []
+        for position in range(self.written, self.recorded):
+            event_time, name, data = self.events[position % self.capacity]
+            event = {"time": (event_time - self.start_time) * 1000, "name": name,
+                     "data": EVENT_FORMATTERS[name](data)}
+            lines.append(json.dumps(event) + "\n")
+        self.written = self.recorded
+        return "".join(lines)
+
+    async def close(self):
+        """Write the remaining events and close the file."""
+        if self.closed:
+            return
+        self.closed = True
+        self.flush_event.set()
+        if self.flush_task is not None:
+            await self.flush_task  # An unfinished write must land before the last one
+        self.file.write(self.take_lines())
+        self.file.close()
+
+
+def read_trace(path):
+    """The header and the events of a trace file written by Tracer."""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return records[0], records[1:]
@@ -0,0 +1,95 @@
+# UdpRelay.py
+
+import asyncio
+import random
+
+UDP_IP_HEADER_SIZE = 28  # IPv4 and UDP headers in front of every datagram
+
+
+class RelayProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_datagram):
+        self.on_datagram = on_datagram
+
+    def datagram_received(self, data, addr):
+        self.on_datagram(data, addr)
+
+
+class UdpRelay:
+    """Local UDP relay between one client and a server that emulates a lossy bottleneck link.
+
+    Clients connect to the relay's address instead of the server's; every
+    datagram in either direction is dropped with probability loss_rate.
+    With a bandwidth (bytes/sec), each direction becomes a drop-tail queue
+    of queue_limit bytes drained at that rate, and the time datagrams spend
+    waiting in it is recorded in queue_delays. With an mtu, datagrams that
+    would not fit an IPv4 packet of that size are dropped, as on a link that
+    does not fragment.
+    """
+
+    def __init__(self, server_addr, loss_rate=0.0, seed=None, bandwidth=None, queue_limit=64 * 1024, mtu=None):
+        self.server_addr = server_addr
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+        self.bandwidth = bandwidth
+        self.queue_limit = queue_limit
+        self.mtu = mtu
+        self.link_free_at = {}  # Transport -> time its bottleneck finishes sending what is queued
+        self.queue_delays = []
+        self.client_addr = None
+        self.client_transport = None  # Faces the client
+        self.server_transport = None  # Faces the server
+        self.forwarded = 0
+        self.bytes_forwarded = 0
+        self.dropped = 0
+        self.too_large = 0  # Datagrams dropped for exceeding the MTU
+
+    async def start(self, addr=('127.0.0.1', 0)):
+        """Start relaying and return the address clients should connect to."""
+        loop = asyncio.get_running_loop()
+        self.client_transport, _ = await loop.create_datagram_endpoint(
+            lambda: RelayProtocol(self.from_client), local_addr=addr)
+        self.server_transport, _ = await loop.create_datagram_endpoint(
+            lambda: RelayProtocol(self.from_server), remote_addr=self.server_addr)
+        return self.client_transport.get_extra_info('sockname')
+
+    def from_client(self, data, addr):
+        self.client_addr = addr
+        self.forward(self.server_transport, data, None)
+
+    def from_server(self, data, addr):
+        if self.client_addr is not None:
+            self.forward(self.client_transport, data, self.client_addr)
+
+    def forward(self, transport, data, addr):
+        if self.mtu is not None and len(data) + UDP_IP_HEADER_SIZE > self.mtu:
+            self.too_large += 1
+            return
+        if self.random.random() < self.loss_rate:
+            self.dropped += 1
+            return
+        if self.bandwidth is None:
+            self.forwarded += 1
+            self.bytes_forwarded += len(data)
+            transport.sendto(data, addr)
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self.link_free_at.get(transport, now))
+        if (start - now) * self.bandwidth + len(data) > self.queue_limit:
+            self.dropped += 1  # Queue full: drop tail
+            return
+        self.link_free_at[transport] = start + len(data) / self.bandwidth
+        self.queue_delays.append(start - now)
+        self.forwarded += 1
+        self.bytes_forwarded += len(data)
+        loop.call_at(self.link_free_at[transport], self.deliver, transport, data, addr)
+
+    def deliver(self, transport, data, addr):
+        if not transport.is_closing():
+            transport.sendto(data, addr)
+
+    def close(self):
+        for transport in (self.client_transport, self.server_transport):
+            if transport is not None:
+                transport.close()
@@ -0,0 +1,58 @@
+# Varint.py
+
+import struct
+
+# QUIC variable-length integers (RFC 9000, section 16): the top two bits of
+# the first byte give the length, 1, 2, 4 or 8 bytes, big-endian
+VARINT_MAX = 2**62 - 1
+
+VARINT_2 = struct.Struct("!H")
+VARINT_4 = struct.Struct("!I")
+VARINT_8 = struct.Struct("!Q")
+
+
+def varint_size(value):
+    if value < 0x40:
+        return 1
+    if value < 0x4000:
+        return 2
+    if value < 0x40000000:
+        return 4
+    if value <= VARINT_MAX:
+        return 8
+    raise ValueError(f"Value too large for a varint: {value}")
+
+
+def pack_varint_into(buffer, offset, value):
+    """Write value at offset and return the offset just past it."""
+    if value < 0x40:
+        buffer[offset] = value
+        return offset + 1
+    if value < 0x4000:
+        VARINT_2.pack_into(buffer, offset, value | 0x4000)
+        return offset + 2
+    if value < 0x40000000:
+        VARINT_4.pack_into(buffer, offset, value | 0x80000000)
+        return offset + 4
+    if value <= VARINT_MAX:
+        VARINT_8.pack_into(buffer, offset, value | 0xC000000000000000)
+        return offset + 8
+    raise ValueError(f"Value too large for a varint: {value}")
+
+
+def unpack_varint_from(buffer, offset=0):
+    """Read the varint at offset and return it with the offset just past it."""
+    prefix = buffer[offset] >> 6
+    if prefix == 0:
+        return buffer[offset], offset + 1
+    if prefix == 1:
+        return VARINT_2.unpack_from(buffer, offset)[0] & 0x3FFF, offset + 2
+    if prefix == 2:
+        return VARINT_4.unpack_from(buffer, offset)[0] & 0x3FFFFFFF, offset + 4
+    return VARINT_8.unpack_from(buffer, offset)[0] & VARINT_MAX, offset + 8
+
+
+def encode_varint(value):
+    buffer = bytearray(varint_size(value))
+    pack_varint_into(buffer, 0, value)
+    return bytes(buffer)
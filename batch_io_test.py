@@ -0,0 +1,134 @@
+# test_batch_io.py
+
+import unittest
+import asyncio
+import socket
+import time
+from BatchIO import BatchSocket, BATCH_SIZE, MMSG_AVAILABLE
+from Frame import Frame
+from Packet import Packet
+
+MAX_DATAGRAM_SIZE = 2048
+
+
+def make_packet(packet_number, payload_size):
+    return Packet(header_form=0, flags=0, dest_con_id=7, packet_number=packet_number,
+                  frames=[Frame(stream_id=1, data=b'x' * payload_size, offset=packet_number * payload_size)])
+
+
+class BatchSocketTestCase(unittest.TestCase):
+    """Two connected non-blocking UDP sockets on the loopback interface."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.sender.bind(('127.0.0.1', 0))
+        self.sender.connect(self.receiver.getsockname())
+        self.receiver.connect(self.sender.getsockname())
+        for sock in (self.sender, self.receiver):
+            sock.setblocking(False)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+        self.loop.close()
+
+    def send_packets(self, batch_socket, packets):
+        async def run():
+            for packet in packets:
+                batch_socket.add(packet)
+            batch_socket.flush()
+        self.loop.run_until_complete(run())
+
+    def receive_all(self, batch_socket, expected):
+        datagrams = []
+        deadline = time.monotonic() + 2
+        while len(datagrams) < expected and time.monotonic() < deadline:
+            datagrams.extend(batch_socket.recv_batch())
+        return datagrams
+
+
+class TestBatchSocket(BatchSocketTestCase):
+
+    def check_round_trip(self, use_mmsg, use_gso, payload_sizes):
+        sender = BatchSocket(self.sender, MAX_DATAGRAM_SIZE, use_mmsg=use_mmsg, use_gso=use_gso)
+        receiver = BatchSocket(self.receiver, MAX_DATAGRAM_SIZE, use_mmsg=use_mmsg, use_gso=use_gso)
+        packets = [make_packet(i, size) for i, size in enumerate(payload_sizes)]
+        self.send_packets(sender, packets)
+
+        datagrams = self.receive_all(receiver, len(packets))
+        self.assertEqual([data for data, _ in datagrams], [packet.to_bytes() for packet in packets],
+                         "Datagrams should arrive whole and in order")
+        self.assertEqual(datagrams[0][1], self.sender.getsockname(), "Sender address mismatch")
+        return sender, receiver
+
+    def test_fallback_round_trip(self):
+        """Test that the per-datagram fallback sends and receives every packet."""
+        sender, receiver = self.check_round_trip(False, False, [1000, 500, 1500])
+        self.assertEqual(sender.syscalls, 3, "Fallback should use one send per datagram")
+
+    @unittest.skipUnless(MMSG_AVAILABLE, "recvmmsg/sendmmsg not available")
+    def test_mmsg_round_trip(self):
+        """Test that packets of mixed sizes go out in one sendmmsg and come back in one recvmmsg."""
+        sender, receiver = self.check_round_trip(True, False, [1000, 500, 1500, 20])
+        self.assertEqual(sender.syscalls, 1, "One sendmmsg should carry the whole batch")
+        self.assertEqual(receiver.syscalls, 1, "One recvmmsg should drain the whole batch")
+
+    @unittest.skipUnless(MMSG_AVAILABLE, "recvmmsg/sendmmsg not available")
+    def test_gso_splits_equal_sized_packets(self):
+        """Test that equal-sized packets with a shorter last one are segmented back into separate datagrams."""
+        sender, _ = self.check_round_trip(True, True, [1000] * 5 + [300])
+        if sender.use_gso:
+            self.assertEqual(sender.syscalls, 1, "One GSO send should carry the whole batch")
+
+    def test_full_batch_is_sent_immediately(self):
+        """Test that filling a batch sends it without waiting for the end of the tick."""
+        sender = BatchSocket(self.sender, MAX_DATAGRAM_SIZE)
+
+        async def run():
+            for i in range(BATCH_SIZE):
+                sender.add(make_packet(i, 100))
+            return sender.pending
+        self.assertEqual(self.loop.run_until_complete(run()), 0, "A full batch should be flushed at once")
+        self.assertEqual(len(self.receive_all(BatchSocket(self.receiver, MAX_DATAGRAM_SIZE), BATCH_SIZE)), BATCH_SIZE)
+
+
+class TestBatchSocketBenchmark(BatchSocketTestCase):
+    """Benchmark: loopback packets/sec with batched system calls against one call per datagram."""
+
+    ROUNDS = 200
+
+    def run_benchmark(self, use_mmsg, use_gso):
+        sender = BatchSocket(self.sender, MAX_DATAGRAM_SIZE, use_mmsg=use_mmsg, use_gso=use_gso)
+        receiver = BatchSocket(self.receiver, MAX_DATAGRAM_SIZE, use_mmsg=use_mmsg, use_gso=use_gso)
+        packets = [make_packet(i, 1200) for i in range(BATCH_SIZE)]
+        received = 0
+
+        async def run():
+            nonlocal received
+            for _ in range(self.ROUNDS):
+                for packet in packets:
+                    sender.add(packet)
+                sender.flush()
+                received += len(self.receive_all(receiver, len(packets)))
+
+        start = time.perf_counter()
+        self.loop.run_until_complete(run())
+        elapsed = time.perf_counter() - start
+        return received / elapsed, sender.syscalls + receiver.syscalls
+
+    def test_packets_per_second(self):
+        """Report packets/sec for each backend."""
+        backends = [("per-datagram", False, False)]
+        if MMSG_AVAILABLE:
+            backends += [("sendmmsg/recvmmsg", True, False), ("GSO + recvmmsg", True, True)]
+        print()
+        for name, use_mmsg, use_gso in backends:
+            rate, syscalls = self.run_benchmark(use_mmsg, use_gso)
+            print(f"{name}: {rate:,.0f} packets/sec, {syscalls / (self.ROUNDS * BATCH_SIZE):.2f} syscalls/packet")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+# bench.py
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from itertools import product
+from QuicConnection import QuicConnection, KB, MB
+from QuicServer import serve_connection
+from UdpRelay import UdpRelay
+from file_generator import generate_files
+
+RUN_TIMEOUT = 120  # Seconds before a transfer is recorded as failed
+SWEEP_KEYS = ("streams", "file_size", "packet_size", "loss_rate")
+CSV_FIELDS = SWEEP_KEYS + ("run", "ok", "error", "elapsed", "payload_bytes", "throughput", "completion_p50",
+                           "completion_p95", "completion_p99", "cpu_time", "cpu_ns_per_byte", "packets_sent",
+                           "packets_lost", "datagrams_dropped", "final_packet_size", "fill_ratio")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_size(text):
+    """Parse a byte count such as 4096, 64KB or 2MB."""
+    text = text.strip().upper()
+    for suffix, unit in (("MB", MB), ("KB", KB), ("B", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * unit)
+    return int(text)
+
+
+async def run_transfer(files_dir, sizes, streams, packet_size, loss_rate, seed=None, **connection_options):
+    """Transfer the first streams files from an in-process server to a client through a UdpRelay.
+
+    Both sides run on this event loop, so the CPU time covers the server,
+    the client and the relay together. connection_options go to both
+    connections.
+    """
+    server = QuicConnection(('127.0.0.1', 0), None, max_packet_size=packet_size, **connection_options)
+    server_task = asyncio.create_task(serve_listener(server, files_dir))
+    relay = UdpRelay(server.sock.getsockname(), loss_rate, seed=seed)
+    client = QuicConnection(r_addr=await relay.start(), max_packet_size=packet_size, **connection_options)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    await client.connect()
+    await client.start_streams_request(streams)
+    await client.wait_closed()
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    await server.close()
+    await server_task
+    relay.close()
+
+    payload_bytes = sum(sizes[stream_id] for stream_id in range(1, streams + 1))
+    # bytes_received counts retransmitted duplicates too; consumed is the in-order data handed over
+    received = {stream_id: stream.consumed for stream_id, stream in client.streams.items() if stream.closed}
+    completion = [stream.etime - client.stime for stream in client.streams.values() if stream.etime]
+    return {
+        "ok": all(received.get(stream_id) == sizes[stream_id] for stream_id in range(1, streams + 1)),
+        "error": "",
+        "elapsed": elapsed,
+        "payload_bytes": payload_bytes,
+        "throughput": payload_bytes / elapsed,
+        "completion_p50": percentile(completion, 0.50),
+        "completion_p95": percentile(completion, 0.95),
+        "completion_p99": percentile(completion, 0.99),
+        "cpu_time": cpu_time,
+        "cpu_ns_per_byte": 1e9 * cpu_time / payload_bytes,
+        "packets_sent": server.packet_number,
+        "packets_lost": server.recovery.packets_lost,
+        "datagrams_dropped": relay.dropped,
+        "final_packet_size": server.packet_size,
+        "fill_ratio": server.fill_ratio,
+    }
+
+
+async def serve_listener(server, files_dir):
+    await server.listen()
+    await serve_connection(server, files_dir)
+
+
+def run_benchmark(stream_counts=(1, 4), file_sizes=(MB,), packet_sizes=(8 * KB,), loss_rates=(0.0,), repeats=3,
+                  files_dir=None, timeout=RUN_TIMEOUT, verbose=False, progress=None):
+    """Run every combination of the sweep parameters repeats times and return one result dict per run.
+
+    Payloads are generated into a temporary directory for each file size,
+    unless files_dir names a directory of file_<i>.txt files (such as the
+    output of file_generator.py) to send instead; file_sizes is then
+    ignored. Connection logging is discarded unless verbose.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if files_dir is not None:
+            sizes = {i: os.path.getsize(os.path.join(files_dir, f"file_{i}.txt"))
+                     for i in range(1, max(stream_counts) + 1)}
+            payloads = [(None, files_dir, sizes)]
+        else:
+            payloads = []
+            for file_size in file_sizes:
+                directory = os.path.join(tmp_dir, str(file_size))
+                sizes = generate_files(directory, max(stream_counts), file_size, file_size)
+                payloads.append((file_size, directory, sizes))
+
+        for (file_size, directory, sizes), streams, packet_size, loss_rate in product(
+                payloads, stream_counts, packet_sizes, loss_rates):
+            for run in range(repeats):
+                result = {"streams": streams, "file_size": file_size, "packet_size": packet_size,
+                          "loss_rate": loss_rate, "run": run}
+                log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                try:
+                    with log:
+                        result.update(asyncio.run(asyncio.wait_for(
+                            run_transfer(directory, sizes, streams, packet_size, loss_rate, seed=run), timeout)))
+                except asyncio.TimeoutError:
+                    result.update(ok=False, error="timeout")
+                except Exception as e:
+                    result.update(ok=False, error=f"{type(e).__name__}: {e}")
+                results.append(result)
+                if progress:
+                    progress(result)
+    return results
+
+
+def summarize(results):
+    """Median of each measurement over the repeated runs of every sweep point, failed runs left out."""
+    groups = {}
+    for result in results:
+        groups.setdefault(tuple(result[key] for key in SWEEP_KEYS), []).append(result)
+
+    summary = []
+    for key, runs in groups.items():
+        good = [run for run in runs if run["ok"]]
+        row = dict(zip(SWEEP_KEYS, key), runs=len(runs), failures=len(runs) - len(good))
+        for field in ("throughput", "completion_p50", "completion_p95", "completion_p99", "cpu_ns_per_byte"):
+            row[field] = percentile([run[field] for run in good], 0.5)
+        summary.append(row)
+    return summary
+
+
+def find_regressions(summary, baseline, tolerance=0.1):
+    """Compare a summary against a baseline summary and describe every sweep point that got worse.
+
+    A point regresses when its median throughput fell, or its CPU time per
+    byte or p95 completion time rose, by more than tolerance, or when it
+    has failed runs the baseline did not.
+    """
+    previous = {tuple(row[key] for key in SWEEP_KEYS): row for row in baseline}
+    regressions = []
+    for row in summary:
+        key = tuple(row[key] for key in SWEEP_KEYS)
+        old = previous.get(key)
+        if old is None:
+            continue
+        point = ", ".join(f"{name}={value}" for name, value in zip(SWEEP_KEYS, key))
+        if row["failures"] > old["failures"]:
+            regressions.append(f"{point}: {row['failures']} failed runs (baseline {old['failures']})")
+        for field, higher_is_better in (("throughput", True), ("cpu_ns_per_byte", False), ("completion_p95", False)):
+            if row[field] is None or not old[field]:
+                continue
+            change = row[field] / old[field] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{point}: {field} {old[field]:.4g} -> {row[field]:.4g} ({change:+.1%})")
+    return regressions
+
+
+def environment():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def write_json(path, results, summary):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "runs": results, "summary": summary}, f, indent=2)
+
+
+def write_csv(path, results):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_result(result):
+    point = (f"{result['streams']:3} streams {result['file_size'] or 0:>9} B  packet {result['packet_size']:>6} B  "
+             f"loss {result['loss_rate']:4.0%}  run {result['run']}")
+    if not result["ok"]:
+        print(f"{point}: FAILED {result['error'] or 'incomplete data'}")
+        return
+    print(f"{point}: {result['throughput'] / MB:7.2f} MB/sec, completion p50 {result['completion_p50']:.3f} s "
+          f"p95 {result['completion_p95']:.3f} s, {result['cpu_ns_per_byte']:6.1f} CPU ns/byte")
+
+
+def parse_list(convert):
+    return lambda text: [convert(item) for item in text.split(",")]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Sweep end-to-end loopback transfers and record their performance.")
+    parser.add_argument("--streams", type=parse_list(int), default=[1, 4], help="stream counts, e.g. 1,4,10")
+    parser.add_argument("--file-sizes", type=parse_list(parse_size), default=[MB], help="file sizes, e.g. 256KB,4MB")
+    parser.add_argument("--packet-sizes", type=parse_list(parse_size), default=[8 * KB],
+                        help="max_packet_size values, e.g. 1472,8KB")
+    parser.add_argument("--loss", type=parse_list(float), default=[0.0], help="datagram loss rates, e.g. 0,0.01")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per sweep point")
+    parser.add_argument("--files-dir", help="send file_<i>.txt from this directory instead of generated payloads")
+    parser.add_argument("--timeout", type=float, default=RUN_TIMEOUT, help="seconds before a run fails")
+    parser.add_argument("--json", help="write runs and summary to this JSON file")
+    parser.add_argument("--csv", help="write one row per run to this CSV file")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative change against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show connection logging")
+    options = parser.parse_args(args)
+
+    results = run_benchmark(options.streams, options.file_sizes, options.packet_sizes, options.loss, options.repeat,
+                            options.files_dir, options.timeout, options.verbose, progress=print_result)
+    summary = summarize(results)
+    if options.json:
+        write_json(options.json, results, summary)
+    if options.csv:
+        write_csv(options.csv, results)
+
+    status = 0 if all(result["ok"] for result in results) else 1
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = find_regressions(summary, json.load(f)["summary"], options.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# test_bench.py
+
+import unittest
+import csv
+import json
+import os
+import tempfile
+from bench import run_benchmark, summarize, find_regressions, parse_size, percentile, write_csv, main, SWEEP_KEYS
+from file_generator import generate_files, MB
+from QuicConnection import KB
+
+
+class TestBenchHelpers(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("4096"), 4096)
+        self.assertEqual(parse_size("64KB"), 64 * KB)
+        self.assertEqual(parse_size("1.5mb"), 3 * MB // 2)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 51)
+        self.assertEqual(percentile(values, 0.99), 100)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_generate_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sizes = generate_files(directory, 3, 64 * KB, 64 * KB, random_content=True)
+            self.assertEqual(sizes, {1: 64 * KB, 2: 64 * KB, 3: 64 * KB})
+            self.assertEqual(os.path.getsize(os.path.join(directory, "file_3.txt")), 64 * KB)
+
+    def test_find_regressions(self):
+        """Test that only changes beyond the tolerance, in the bad direction, are reported."""
+        point = dict(streams=1, file_size=MB, packet_size=8 * KB, loss_rate=0.0, runs=3, failures=0,
+                     completion_p95=0.1)
+        baseline = [dict(point, throughput=100.0, cpu_ns_per_byte=20.0)]
+        self.assertEqual(find_regressions([dict(point, throughput=95.0, cpu_ns_per_byte=15.0)], baseline), [])
+        regressions = find_regressions([dict(point, throughput=80.0, cpu_ns_per_byte=30.0)], baseline)
+        self.assertEqual(len(regressions), 2, "Both the throughput drop and the CPU rise should be reported")
+        self.assertEqual(len(find_regressions([dict(point, failures=1, throughput=100.0, cpu_ns_per_byte=20.0)],
+                                              baseline)), 1, "New failures are a regression")
+
+
+class TestBenchSweep(unittest.TestCase):
+    """Run a tiny sweep end to end and check every run completes and is recorded."""
+
+    def test_sweep(self):
+        results = run_benchmark(stream_counts=(1, 2), file_sizes=(64 * KB,), packet_sizes=(1472, 8 * KB),
+                                loss_rates=(0.0, 0.05), repeats=1, timeout=60)
+        self.assertEqual(len(results), 8, "One run per sweep point")
+        for result in results:
+            self.assertTrue(result["ok"], f"Run failed: {result}")
+            self.assertGreater(result["throughput"], 0)
+            self.assertGreater(result["cpu_ns_per_byte"], 0)
+            self.assertLessEqual(result["completion_p50"], result["completion_p99"])
+            self.assertLessEqual(result["final_packet_size"], result["packet_size"])
+        summary = summarize(results)
+        self.assertEqual(len(summary), 8)
+        self.assertEqual(find_regressions(summary, summary), [], "A run never regresses against itself")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "runs.csv")
+            write_csv(path, results)
+            with open(path, newline="") as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 8)
+            self.assertEqual(rows[0]["ok"], "True")
+
+    def test_main_writes_json_and_uses_file_generator_output(self):
+        """Test the command line with files from file_generator.py and a baseline check."""
+        with tempfile.TemporaryDirectory() as directory:
+            generate_files(directory, 2, 32 * KB, 32 * KB)
+            path = os.path.join(directory, "bench.json")
+            status = main(["--streams", "2", "--repeat", "2", "--files-dir", directory, "--json", path])
+            self.assertEqual(status, 0)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual(len(report["runs"]), 2)
+            self.assertEqual(report["runs"][0]["payload_bytes"], 2 * 32 * KB)
+            self.assertEqual(set(SWEEP_KEYS) - set(report["summary"][0]), set())
+            self.assertIn("python", report["environment"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# test_congestion_control.py
+
+import unittest
+from CongestionControl import CongestionController, NewReno, Cubic, Pacer, INITIAL_WINDOW_PACKETS, MINIMUM_WINDOW_PACKETS
+from LossRecovery import RttEstimator, SentPacket
+
+DATAGRAM_SIZE = 1000
+
+def sent(packet_number, time_sent=0.0):
+    return SentPacket(packet_number, [], DATAGRAM_SIZE, time_sent)
+
+class TestNewReno(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = NewReno(DATAGRAM_SIZE)
+        self.rtt = RttEstimator()
+
+    def test_slow_start_doubles_per_window(self):
+        """Test that every acknowledged byte grows the window during slow start."""
+        initial = self.controller.congestion_window
+        self.controller.on_packets_acked([sent(i) for i in range(INITIAL_WINDOW_PACKETS)], self.rtt, now=0.1)
+        self.assertEqual(self.controller.congestion_window, 2 * initial, "Window should double after one window of ACKs")
+
+    def test_loss_halves_window_once_per_round_trip(self):
+        """Test that losses within one recovery period reduce the window only once."""
+        initial = self.controller.congestion_window
+        self.controller.on_packets_lost([sent(1, time_sent=0.0)], now=1.0)
+        self.assertEqual(self.controller.congestion_window, initial / 2, "Loss should halve the window")
+
+        self.controller.on_packets_lost([sent(2, time_sent=0.5)], now=1.1)
+        self.assertEqual(self.controller.congestion_window, initial / 2, "Packets sent before recovery must not reduce again")
+
+        self.controller.on_packets_acked([sent(3, time_sent=0.9)], self.rtt, now=1.2)
+        self.assertEqual(self.controller.congestion_window, initial / 2, "ACKs for packets sent before recovery must not grow the window")
+
+    def test_window_never_below_minimum(self):
+        """Test that repeated losses stop at the minimum window."""
+        for i in range(20):
+            self.controller.on_packets_lost([sent(i, time_sent=i)], now=i + 0.5)
+        self.assertEqual(self.controller.congestion_window, MINIMUM_WINDOW_PACKETS * DATAGRAM_SIZE)
+        self.assertFalse(self.controller.can_send(MINIMUM_WINDOW_PACKETS * DATAGRAM_SIZE), "Full window should block sending")
+
+class TestCubic(unittest.TestCase):
+
+    def test_reduction_and_regrowth(self):
+        """Test that CUBIC reduces by beta and then grows back toward the previous maximum."""
+        controller = Cubic(DATAGRAM_SIZE)
+        rtt = RttEstimator()
+        rtt.update(0.05, 0)
+        before = controller.congestion_window
+        controller.on_packets_lost([sent(0)], now=1.0)
+        reduced = controller.congestion_window
+        self.assertAlmostEqual(reduced, before * Cubic.BETA, msg="Loss should reduce the window by beta")
+
+        time_sent = 1.0
+        for i in range(200):
+            time_sent += 0.01
+            controller.on_packets_acked([sent(i, time_sent)], rtt, now=time_sent + 0.05)
+        self.assertGreater(controller.congestion_window, reduced, "Window should grow again after the loss")
+
+class TestCongestionController(unittest.TestCase):
+
+    def test_incomplete_controller_fails_on_creation(self):
+        """Test that a controller missing a window hook cannot be created, rather than failing on its first ACK."""
+        class GrowOnly(CongestionController):
+            def on_congestion_avoidance(self, sent_packet, rtt, now):
+                pass
+        with self.assertRaises(TypeError):
+            GrowOnly(DATAGRAM_SIZE)
+        with self.assertRaises(TypeError):
+            CongestionController(DATAGRAM_SIZE)
+
+class TestPacer(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        """Test that the pacer allows a small burst and then spaces packets at the given rate."""
+        pacer = Pacer(DATAGRAM_SIZE)
+        delays = [pacer.delay(DATAGRAM_SIZE, rate=10000, now=0.0) for _ in range(6)]
+        self.assertEqual(delays[:4], [0, 0, 0, 0], "Burst allowance should not delay")
+        self.assertAlmostEqual(delays[4], 0.1, msg="Fifth packet should wait one packet time")
+        self.assertAlmostEqual(delays[5], 0.2, msg="Delays should accumulate while sending faster than the rate")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,29 @@
 import unittest
 import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
 from unittest.mock import patch, MagicMock
-from QuicConnection import QuicConnection
+from QuicConnection import (QuicConnection, RECV_PROTOCOL, RECV_EXECUTOR, RECV_BATCH, encode_transport_parameters,
+                            decode_transport_parameters, split_request, encode_control_message, REQUEST_PREFIX)
+from QuicServer import serve_connection
+from UdpRelay import UdpRelay, UDP_IP_HEADER_SIZE
+from Packet import Packet
+from Frame import Frame, ACK, DATA, CLOSE
+from PathMtu import SEARCH_PRECISION
+from FileSource import shared_mappings
 
 class TestQuicConnection(unittest.TestCase):
+    server_backend = RECV_PROTOCOL
+
     def setUp(self):
         """Set up test variables."""
         self.client_address = ('127.0.0.1', 8888)
         self.server_address = ('127.0.0.1', 9999)
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
-        self.server = QuicConnection(self.server_address, None)
+        self.server = QuicConnection(self.server_address, None, recv_backend=self.server_backend)
         self.client = QuicConnection(r_addr=self.server_address)
 
     def test_listen(self):
@@ -32,13 +45,13 @@ class TestQuicConnection(unittest.TestCase):
 
     def tearDown(self):
         self.loop.run_until_complete(self.tearDownAsync())
+        self.loop.close()
 
     async def tearDownAsync(self):
         """Clean up test variables."""
         await self.server.close()
         await self.client.close()
         await self.cleanup_pending_tasks()
-        self.loop.close()
 
     async def cleanup_pending_tasks(self):
         """Cancel all pending tasks."""
@@ -47,5 +60,591 @@ class TestQuicConnection(unittest.TestCase):
             task.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
 
+class TestSendScheduler(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.connection = QuicConnection(congestion_control=None, path_mtu_discovery=False)  # Fixed 8 KB packets
+        self.connection.r_con_id = 1234
+        self.sent_packets = []
+
+        async def fake_send_packet_data(packet):
+            self.sent_packets.append(packet)
+            self.connection.bytes_sent += len(packet.to_bytes())
+        self.connection.send_packet_data = fake_send_packet_data
+
+    def tearDown(self):
+        self.connection.sock.close()
+        self.loop.close()
+
+    def test_send_frames_drains_queue_and_idles(self):
+        """Test that a wake-up drains every queued frame back-to-back, then the sender goes idle."""
+        async def run():
+            sender = asyncio.create_task(self.connection.send_frames())
+            for i in range(20):
+                await self.connection.send(b'x' * 1000)
+            await asyncio.sleep(0.05)
+            self.assertFalse(self.connection.send_event.is_set(), "Sender should be idle when nothing is queued")
+            self.connection.closed = True
+            self.connection.wake_sender()
+            await sender
+
+        self.loop.run_until_complete(run())
+        sent_frames = sum(len(packet.frames) for packet in self.sent_packets)
+        self.assertEqual(sent_frames, 20, "All queued frames should be sent")
+        self.assertEqual(len(self.sent_packets), 3, "Frames should be packed into as few packets as fit")
+        self.assertEqual([packet.packet_number for packet in self.sent_packets], [0, 1, 2])
+
+    def test_unserializable_packet_is_not_tracked(self):
+        """Test that a packet that fails to serialize is dropped, not sent empty and counted as in flight."""
+        del self.connection.send_packet_data  # The real one
+        self.connection.sock.connect(('127.0.0.1', 9))
+
+        async def run():
+            await self.connection.queue_frame(Frame(0, b'control', 0))
+            with patch.object(Packet, 'pack_into', return_value=0), patch('builtins.print'):
+                return await self.connection.send_packet()
+        self.assertEqual(self.loop.run_until_complete(run()), 0)
+        self.assertEqual(self.connection.bytes_sent, 0)
+        self.assertEqual(self.connection.recovery.sent_packets, {}, "Nothing left, so nothing can be lost")
+
+    def test_mtu_probe_is_padded_to_size(self):
+        """Test that a probe with an ACK riding along comes out at exactly the probed size in either header format."""
+        async def serialize(packet):
+            self.sent_packets.append(packet)
+            self.connection.bytes_sent += packet.pack_into(self.connection.send_buffer)
+        self.connection.send_packet_data = serialize
+
+        async def probe():
+            self.connection.on_packet_received(Packet(0, 0, 1, 300, frames=[Frame(0, b'x', 0)]))
+            return await self.connection.send_mtu_probe(1400, [self.connection.build_ack_frame()])
+
+        for varint in (False, True):
+            with self.subTest(varint=varint):
+                self.connection.varint = varint
+                self.connection.packet_number = 70000 if varint else 0  # A varint packet number of several bytes
+                size = self.loop.run_until_complete(probe())
+                self.assertEqual(size, 1400)
+                self.assertEqual(self.connection.path_mtu.probe_size, 1400)
+                self.assertEqual(len(self.sent_packets[-1].to_bytes()), 1400)
+
+    def test_stream_frames_fill_packets_exactly(self):
+        """Test that stream data is cut to fill every packet and CLOSE rides with the last data."""
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(20000))
+            f.flush()
+
+            async def run():
+                sender = asyncio.create_task(self.connection.send_frames())
+                self.connection.add_stream(1, f.name)
+                await asyncio.sleep(0.05)
+                self.connection.closed = True
+                self.connection.wake_sender()
+                await sender
+            self.loop.run_until_complete(run())
+
+        sizes = [len(packet.to_bytes()) for packet in self.sent_packets]
+        self.assertEqual(sizes[:-1], [self.connection.packet_size] * (len(sizes) - 1), "Packets should be full")
+        self.assertEqual(len(sizes), 3, "20000 bytes should take three 8 KB packets")
+        self.assertEqual([frame.frame_type for frame in self.sent_packets[-1].frames], [DATA, CLOSE],
+                         "CLOSE should not need a packet of its own")
+        self.assertGreater(self.connection.fill_ratio, 0.8)
+
+    def test_pending_ack_rides_along(self):
+        """Test that an ACK waiting on the delay timer is sent with the next packet instead of alone."""
+        async def run():
+            self.connection.on_packet_received(Packet(0, 0, 1, 7, frames=[Frame(0, b'x', 0)]))
+            self.assertIsNotNone(self.connection.ack_timer, "One packet should only arm the ACK timer")
+            await self.connection.queue_frame(Frame(0, b'control', 0))
+            await self.connection.send_packet()
+            self.assertIsNone(self.connection.ack_timer, "The timer is no longer needed")
+        self.loop.run_until_complete(run())
+        self.assertEqual([frame.frame_type for frame in self.sent_packets[0].frames], [ACK, DATA])
+
+    def test_lost_stream_data_is_read_back_from_the_source(self):
+        """Test that packets in flight keep only descriptors for file data and a loss resends the same bytes."""
+        payload = os.urandom(20000)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(payload)
+            f.flush()
+
+            async def run():
+                self.connection.add_stream(1, f.name)
+                while await self.connection.send_packet():
+                    pass
+                in_flight = list(self.connection.recovery.sent_packets.values())
+                self.assertTrue(all(sent_packet.frames == () for sent_packet in in_flight),
+                                "No Frame objects should be kept for file data")
+                self.connection.recovery.remove_lost(in_flight)
+                self.connection.requeue_lost(in_flight)
+                self.sent_packets.clear()
+                while await self.connection.send_packet():
+                    pass
+            self.loop.run_until_complete(run())
+            self.connection.streams[1].release()
+
+        resent = sorted((frame.offset, bytes(frame.data)) for packet in self.sent_packets for frame in packet.frames)
+        self.assertEqual(b''.join(data for _, data in resent), payload, "Retransmissions should carry the file's bytes")
+        self.assertEqual(resent[-1], (len(payload), b''), "CLOSE should be resent too")
+
+    def test_pacing_delay(self):
+        """Test that pacing spreads packets at the configured rate."""
+        self.connection.pacing_rate = 1000
+        delays = self.loop.run_until_complete(self.collect_delays())
+        self.assertAlmostEqual(delays[0], 0.5, places=2)
+        self.assertAlmostEqual(delays[1], 1.0, places=2)
+
+    async def collect_delays(self):
+        return [self.connection.pacing_delay(500), self.connection.pacing_delay(500)]
+
+class TransferTestCase(unittest.TestCase):
+    """Base for tests that transfer files from a server to a client through a local UdpRelay."""
+
+    STREAM_COUNT = 2
+    FILE_SIZE = 100 * 1024
+    CONNECTION_OPTIONS = {}  # Passed to both the server and the client
+    CLIENT_OPTIONS = {}  # Passed to the client only, on top of CONNECTION_OPTIONS
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.payloads = {}
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            self.payloads[stream_id] = os.urandom(self.FILE_SIZE)
+            with open(self.file_path(stream_id), 'wb') as f:
+                f.write(self.payloads[stream_id])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def file_path(self, stream_id):
+        return os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt")
+
+    async def serve(self, server):
+        await server.listen()
+        while not server.closed:
+            frame = await server.recv()
+            if frame and frame.data.startswith(b'REQUEST_STREAMS:'):
+                for stream_id in range(1, int(frame.data.split(b':')[1]) + 1):
+                    if stream_id not in server.streams:
+                        server.add_stream(stream_id, self.file_path(stream_id))
+
+    async def transfer(self, loss_rate=0.0, congestion_control="newreno", recv_backend=RECV_PROTOCOL, **relay_options):
+        server = QuicConnection(('127.0.0.1', 0), None, congestion_control=congestion_control,
+                                recv_backend=recv_backend, **self.CONNECTION_OPTIONS)
+        self.server = server
+        server_task = asyncio.create_task(self.serve(server))
+        relay = UdpRelay(server.sock.getsockname(), loss_rate, seed=5, **relay_options)
+        client = QuicConnection(r_addr=await relay.start(), congestion_control=congestion_control,
+                                recv_backend=recv_backend, **{**self.CONNECTION_OPTIONS, **self.CLIENT_OPTIONS})
+
+        await client.connect()
+        await client.start_streams_request(self.STREAM_COUNT)
+        await client.wait_closed()
+
+        await server.close()
+        await server_task
+        relay.close()
+        return client, relay
+
+class TestReliableDelivery(TransferTestCase):
+    """Transfer files through a lossy local UDP relay and check byte-exact delivery."""
+
+    def test_lossy_transfer_is_byte_exact(self):
+        """Test that every stream arrives intact at 1%, 5% and 10% datagram loss."""
+        for loss_rate in (0.01, 0.05, 0.10):
+            with self.subTest(loss_rate=loss_rate):
+                client, relay = asyncio.run(asyncio.wait_for(self.transfer(loss_rate), 60))
+                self.assertGreater(relay.dropped, 0, "The relay should have dropped some datagrams")
+                for stream_id, payload in self.payloads.items():
+                    self.assertEqual(bytes(client.streams[stream_id].received_data), payload,
+                                     f"Stream {stream_id} data mismatch at {loss_rate:.0%} loss")
+
+class TestSourceRelease(TransferTestCase):
+    """File sources are closed per stream once the peer has everything, not when the connection closes."""
+
+    async def transfer_and_wait(self, loss_rate):
+        server = QuicConnection(('127.0.0.1', 0), None)
+        server_task = asyncio.create_task(self.serve(server))
+        relay = UdpRelay(server.sock.getsockname(), loss_rate, seed=5)
+        client = QuicConnection(r_addr=await relay.start())
+        client.close_when_received = False  # Keep the connection open after the transfer
+        await client.connect()
+        await client.start_streams_request(self.STREAM_COUNT)
+        while len(client.streams) < self.STREAM_COUNT or not all(stream.closed for stream in client.streams.values()):
+            await asyncio.sleep(0.01)
+        for _ in range(500):
+            if all(stream.payload_source is None for stream in server.streams.values()):
+                break
+            await asyncio.sleep(0.01)
+        open_sources = [stream.stream_id for stream in server.streams.values() if stream.payload_source is not None]
+        mapped = [path for path in map(self.file_path, self.payloads) if os.path.realpath(path) in shared_mappings]
+        connected = not server.closed
+        await client.close()
+        await server.close()
+        await server_task
+        relay.close()
+        return open_sources, mapped, connected
+
+    def test_source_released_once_acknowledged(self):
+        """Test that the source and mapping of a stream are released when its data is acknowledged, even after loss."""
+        for loss_rate in (0.0, 0.05):
+            with self.subTest(loss_rate=loss_rate), patch('builtins.print'):
+                open_sources, mapped, connected = asyncio.run(asyncio.wait_for(self.transfer_and_wait(loss_rate), 60))
+                self.assertTrue(connected, "The connection should still be open")
+                self.assertEqual(open_sources, [], "Acknowledged streams should have closed their source")
+                self.assertEqual(mapped, [], "The shared mappings should be released")
+
+class TestBatchedTransfer(TransferTestCase):
+    """Transfer files with both ends on the recvmmsg/sendmmsg backend."""
+
+    def test_batched_transfer_is_byte_exact(self):
+        """Test that batched I/O delivers every stream intact, with and without loss."""
+        for loss_rate in (0.0, 0.05):
+            with self.subTest(loss_rate=loss_rate):
+                client, _ = asyncio.run(asyncio.wait_for(self.transfer(loss_rate, recv_backend=RECV_BATCH), 60))
+                self.assertIsNotNone(client.batch_socket, "Client should use the batch backend")
+                batch_socket = client.batch_socket
+                self.assertLess(batch_socket.syscalls, batch_socket.datagrams_sent + batch_socket.datagrams_received,
+                                "Batching should save system calls")
+                for stream_id, payload in self.payloads.items():
+                    self.assertEqual(bytes(client.streams[stream_id].received_data), payload,
+                                     f"Stream {stream_id} data mismatch at {loss_rate:.0%} loss")
+
+class TestFlowControl(TransferTestCase):
+    """Transfer files through receive windows much smaller than the files."""
+
+    FILE_SIZE = 200 * 1024
+    STREAM_WINDOW = 16 * 1024
+    CONNECTION_OPTIONS = {"max_data": 24 * 1024, "max_stream_data": STREAM_WINDOW}
+
+    def test_small_windows_are_byte_exact(self):
+        """Test that data still arrives intact and the receiver never buffers more than its window."""
+        for loss_rate in (0.0, 0.05):
+            with self.subTest(loss_rate=loss_rate):
+                client, _ = asyncio.run(asyncio.wait_for(self.transfer(loss_rate), 60))
+                for stream_id, payload in self.payloads.items():
+                    stream = client.streams[stream_id]
+                    self.assertEqual(bytes(stream.received_data), payload, f"Stream {stream_id} data mismatch")
+                    self.assertLessEqual(stream.receive_buffer.peak_buffered_bytes, self.STREAM_WINDOW,
+                                         "Out-of-order data should never exceed the stream window")
+                self.assertGreater(self.server.blocked_frames_sent, 0, "The server should have been blocked")
+                self.assertGreater(client.blocked_frames_received, 0, "BLOCKED frames should reach the client")
+                self.assertLessEqual(self.server.data_sent, self.server.peer_max_data,
+                                     "The server must not send beyond the connection limit")
+
+    def test_transport_parameters(self):
+        """Test that the handshake carries each side's limits to the other."""
+        parameters = {"max_data": 1000, "max_stream_data": 500}
+        self.assertEqual(decode_transport_parameters(encode_transport_parameters(parameters)), parameters)
+        self.assertEqual(decode_transport_parameters(b''), {}, "A peer without limits sends no parameters")
+        with self.assertRaises(ValueError):
+            decode_transport_parameters(b'max_data=lots')
+
+class TestVarintEncoding(TransferTestCase):
+    """Transfer files with varint encoding negotiated in the handshake."""
+
+    def check_transfer(self, loss_rate):
+        client, _ = asyncio.run(asyncio.wait_for(self.transfer(loss_rate), 60))
+        for stream_id, payload in self.payloads.items():
+            self.assertEqual(bytes(client.streams[stream_id].received_data), payload, f"Stream {stream_id} data mismatch")
+        return client
+
+    def test_negotiated_when_both_offer(self):
+        """Test that both peers switch to varints and still deliver byte-exact data under loss."""
+        for loss_rate in (0.0, 0.05):
+            with self.subTest(loss_rate=loss_rate):
+                client = self.check_transfer(loss_rate)
+                self.assertTrue(client.varint, "The client should use varints")
+                self.assertTrue(self.server.varint, "The server should use varints")
+
+
+class TestVarintFallback(TransferTestCase):
+    """A client that does not offer varints keeps both sides on the fixed format."""
+
+    CLIENT_OPTIONS = {"varint_encoding": False}
+    check_transfer = TestVarintEncoding.check_transfer
+
+    def test_fixed_format_when_one_side_declines(self):
+        client = self.check_transfer(0.05)
+        self.assertFalse(client.varint, "The client did not offer varints")
+        self.assertFalse(self.server.varint, "The server must not use varints its peer did not offer")
+
+class TestCongestionControlBenchmark(TransferTestCase):
+    """Benchmark: goodput and bottleneck queueing delay for each congestion controller."""
+
+    FILE_SIZE = 1024 * 1024
+    BANDWIDTH = 4 * 1024 * 1024  # bytes/sec at the relay's bottleneck
+
+    def test_bottleneck_goodput(self):
+        """Transfer through a rate-limited drop-tail relay and report goodput and queueing delay."""
+        for congestion_control in ("newreno", "cubic"):
+            with self.subTest(congestion_control=congestion_control):
+                loop_start = time.perf_counter()
+                client, relay = asyncio.run(asyncio.wait_for(
+                    self.transfer(congestion_control=congestion_control, bandwidth=self.BANDWIDTH), 60))
+                elapsed = time.perf_counter() - loop_start
+
+                delays = sorted(relay.queue_delays)
+                goodput = self.STREAM_COUNT * self.FILE_SIZE / elapsed
+                print(f"\n{congestion_control}: goodput {goodput / 2**20:.2f} MB/sec "
+                      f"(bottleneck {self.BANDWIDTH / 2**20:.0f} MB/sec), "
+                      f"queueing delay mean {1000 * sum(delays) / len(delays):.1f} ms, "
+                      f"p95 {1000 * delays[int(len(delays) * 0.95)]:.1f} ms, drops {relay.dropped}")
+                for stream_id, payload in self.payloads.items():
+                    self.assertEqual(bytes(client.streams[stream_id].received_data), payload)
+
+    def test_unknown_congestion_control(self):
+        with self.assertRaises(ValueError):
+            QuicConnection(congestion_control="bogus")
+
+class TestPathMtuDiscovery(TransferTestCase):
+    """Benchmark: discovered packet size and goodput through relays that emulate 1500 and 9000-byte MTUs."""
+
+    FILE_SIZE = 1024 * 1024
+    CONNECTION_OPTIONS = {"max_packet_size": 16 * 1024}
+
+    def test_packet_size_follows_path_mtu(self):
+        """Test that both sides find the largest datagram the relay passes and transfer intact."""
+        for mtu in (1500, 9000):
+            with self.subTest(mtu=mtu):
+                start = time.perf_counter()
+                client, relay = asyncio.run(asyncio.wait_for(self.transfer(mtu=mtu), 60))
+                elapsed = time.perf_counter() - start
+                largest = mtu - UDP_IP_HEADER_SIZE
+                for side in (client, self.server):
+                    self.assertLessEqual(side.packet_size, largest, "Packets must fit the path")
+                # The client mostly sends ACKs and may still be searching when the transfer ends
+                self.assertGreater(self.server.packet_size, largest - SEARCH_PRECISION, "The search should converge")
+                self.assertGreater(relay.too_large, 0, "Oversized probes should have been dropped")
+                self.assertEqual(relay.dropped, 0, "No regular packet should be lost")
+                for stream_id, payload in self.payloads.items():
+                    self.assertEqual(bytes(client.streams[stream_id].received_data), payload)
+                print(f"\nMTU {mtu}: packet size {self.server.packet_size} bytes after "
+                      f"{self.server.path_mtu.probes_sent} probes, "
+                      f"goodput {self.STREAM_COUNT * self.FILE_SIZE / elapsed / 2**20:.2f} MB/sec")
+
+    def test_peer_receive_limit(self):
+        """Test that probing stops at the smaller of the two sides' max_packet_size."""
+        self.CONNECTION_OPTIONS = {"max_packet_size": 4000}
+        self.CLIENT_OPTIONS = {"max_packet_size": 2000}
+        client, _ = asyncio.run(asyncio.wait_for(self.transfer(), 60))
+        self.assertLessEqual(self.server.packet_size, 2000, "The server must not exceed the client's receive buffer")
+        self.assertGreater(self.server.packet_size, 2000 - SEARCH_PRECISION)
+
+class TestPacketFillBenchmark(TransferTestCase):
+    """Benchmark: how full data packets are and the bytes they take on the wire."""
+
+    FILE_SIZE = 1024 * 1024
+
+    def test_fill_ratio(self):
+        """Report the fill ratio, packet count and wire bytes per payload byte on 1500-byte and loopback paths."""
+        for mtu in (1500, None):
+            with self.subTest(mtu=mtu):
+                client, relay = asyncio.run(asyncio.wait_for(self.transfer(mtu=mtu), 60))
+                for stream_id, payload in self.payloads.items():
+                    self.assertEqual(bytes(client.streams[stream_id].received_data), payload)
+                server = self.server
+                payload_bytes = self.STREAM_COUNT * self.FILE_SIZE
+                print(f"\nMTU {mtu or 'loopback'}: fill ratio {server.fill_ratio:.1%} over "
+                      f"{server.data_packets_sent} data packets of up to {server.packet_size} bytes, "
+                      f"{relay.bytes_forwarded / payload_bytes:.4f} wire bytes per payload byte "
+                      f"({relay.forwarded} datagrams)")
+                self.assertGreater(server.fill_ratio, 0.95, "Data packets should be nearly full")
+
+class TestSentPacketMemoryBenchmark(unittest.TestCase):
+    """Benchmark: memory and allocations loss recovery holds for a 10-stream transfer in flight.
+
+    Every packet of ten 1 MB files is built by the real send_packet and
+    left unacknowledged, then traced memory is compared between packets
+    recorded as frame descriptors and packets keeping their Frame objects,
+    as they did before descriptors.
+    """
+
+    STREAM_COUNT = 10
+    FILE_SIZE = 1024 * 1024
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            with open(os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"), 'wb') as f:
+                f.write(os.urandom(self.FILE_SIZE))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def send_all(self, packet_size, keep_frames):
+        """Send every file without ACKs and return (packets, bytes traced, blocks traced) still held afterwards."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        connection = QuicConnection(congestion_control=None, path_mtu_discovery=False, max_packet_size=packet_size)
+        connection.r_con_id = 1
+
+        async def serialize(packet):
+            connection.bytes_sent += packet.pack_into(connection.send_buffer)
+        connection.send_packet_data = serialize
+        if keep_frames:
+            connection.describe_sent_frames = lambda frames, packet_number: (frames, None)
+
+        async def run():
+            for stream_id in range(1, self.STREAM_COUNT + 1):
+                connection.add_stream(stream_id, os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"))
+            while await connection.send_packet():
+                pass
+
+        tracemalloc.start()
+        try:
+            loop.run_until_complete(run())
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        packets = len(connection.recovery.sent_packets)
+        held = sum(stat.size for stat in snapshot.statistics("filename"))
+        blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+        for stream in connection.streams.values():
+            stream.release()
+        connection.sock.close()
+        loop.close()
+        return packets, held, blocks
+
+    def test_in_flight_footprint(self):
+        """Report bytes and allocations held per packet in flight with Frame objects and with descriptors."""
+        print()
+        for packet_size in (1472, 8 * 1024):
+            packets, frame_bytes, frame_blocks = self.send_all(packet_size, keep_frames=True)
+            _, descriptor_bytes, descriptor_blocks = self.send_all(packet_size, keep_frames=False)
+            print(f"{self.STREAM_COUNT} streams, {packets} packets of {packet_size} bytes in flight: "
+                  f"Frame objects {frame_bytes / packets:.0f} B and {frame_blocks / packets:.1f} blocks/packet, "
+                  f"descriptors {descriptor_bytes / packets:.0f} B and {descriptor_blocks / packets:.1f} blocks/packet")
+            self.assertLess(descriptor_bytes, frame_bytes, "Descriptors should hold less memory")
+            self.assertLess(descriptor_blocks, frame_blocks, "Descriptors should need fewer allocations")
+
+class TestControlChannel(unittest.TestCase):
+    """Control messages and requests on stream 0 complete as soon as they arrive, with no polling."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp_dir.name, "file_1.txt"), 'wb') as f:
+            f.write(os.urandom(1024))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_split_request(self):
+        self.assertEqual(split_request(encode_control_message(REQUEST_PREFIX, 12, b'PING:1')), (12, b'PING:1'))
+        self.assertEqual(split_request(b'REQUEST_STREAMS:3'), (None, b'REQUEST_STREAMS:3'))
+        self.assertEqual(split_request(b'REQ:x:y'), (None, b'REQ:x:y'), "A malformed ID is a plain message")
+
+    async def connect(self):
+        server = QuicConnection(('127.0.0.1', 0), None)
+
+        async def serve():
+            await server.listen()
+            await serve_connection(server, self.tmp_dir.name)
+        server_task = asyncio.create_task(serve())
+        client = QuicConnection(r_addr=server.sock.getsockname())
+        await client.connect()
+        return server, server_task, client
+
+    async def requests(self):
+        server, server_task, client = await self.connect()
+        unknown = await client.request(b'PING', timeout=5)
+        client.new_stream(1)
+        answered = await client.request(b'REQUEST_STREAMS:1', timeout=5)
+        await client.wait_closed()
+        closed_recv = await client.recv()
+        await server_task  # serve_connection returns once recv() reports the closed connection
+        return unknown, answered, closed_recv, client
+
+    def test_request_response(self):
+        """Test requests answered by serve_connection, and that recv() ends with the connection."""
+        with patch('builtins.print'):
+            unknown, answered, closed_recv, client = asyncio.run(asyncio.wait_for(self.requests(), 30))
+        self.assertEqual(unknown, b'ERROR:unknown request')
+        self.assertEqual(answered, b'OK:1')
+        self.assertIsNone(closed_recv)
+        self.assertEqual(client.streams[1].consumed, 1024, "The request started the stream like a plain message")
+        self.assertEqual(client.pending_requests, {})
+
+    async def wake_receiver(self):
+        connection = QuicConnection()
+        receiver = asyncio.create_task(connection.recv())
+        await asyncio.sleep(0)
+        waiting = not receiver.done()
+        frame = Frame(0, b'PING', 0)
+        connection.received_frame_queue.put_nowait(frame)
+        await asyncio.sleep(0)  # One loop iteration, no timed sleep
+        woken = receiver.done() and receiver.result() is frame
+        receiver.cancel()
+        connection.sock.close()
+        return waiting, woken
+
+    def test_recv_wakes_without_polling(self):
+        """Test that a waiting recv() returns a queued frame on the next loop iteration, not after a poll interval."""
+        waiting, woken = asyncio.run(self.wake_receiver())
+        self.assertTrue(waiting, "recv() should wait while nothing is queued")
+        self.assertTrue(woken, "recv() should return as soon as the frame is queued")
+
+    async def unanswered_request(self):
+        server = QuicConnection(('127.0.0.1', 0), None)
+        listening = asyncio.create_task(server.listen())
+        client = QuicConnection(r_addr=server.sock.getsockname())
+        await client.connect()
+        await listening
+        with self.assertRaises(asyncio.TimeoutError):
+            await client.request(b'PING', timeout=0.05)  # Nobody serves the server's control messages
+        pending = asyncio.create_task(client.request(b'PING'))
+        await asyncio.sleep(0.01)
+        await client.close()
+        with self.assertRaises(ConnectionResetError):
+            await pending
+        await server.close()
+
+    def test_unanswered_request(self):
+        with patch('builtins.print'):
+            asyncio.run(asyncio.wait_for(self.unanswered_request(), 30))
+
+    async def measure_latency(self, rounds):
+        first_byte, round_trip = [], []
+        for _ in range(rounds):
+            server, server_task, client = await self.connect()
+            start = time.perf_counter()
+            await client.request(b'PING')
+            round_trip.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await client.start_streams_request(1)
+            reader = client.stream_reader(1)
+            await reader.read(1)
+            first_byte.append(time.perf_counter() - start)
+            await client.close()
+            await server.close()
+            await server_task
+        return sorted(first_byte), sorted(round_trip)
+
+    def test_request_latency_benchmark(self):
+        """Report request round trip and request-to-first-byte latency on loopback.
+
+        recv() used to poll its queue every 10 ms, and serve_connection slept
+        another 10 ms per message, so every request paid 10 ms or more.
+        """
+        rounds = 20
+        with patch('builtins.print'):
+            first_byte, round_trip = asyncio.run(asyncio.wait_for(self.measure_latency(rounds), 60))
+        print(f"\nControl request round trip p50 {1000 * round_trip[rounds // 2]:.2f} ms, request to first byte "
+              f"p50 {1000 * first_byte[rounds // 2]:.2f} ms, max {1000 * first_byte[-1]:.2f} ms")
+
+
+class TestQuicConnectionBatchBackend(TestQuicConnection):
+    """Run the same handshake with the server on the batched receive path."""
+    server_backend = RECV_BATCH
+
+class TestQuicConnectionExecutorBackend(TestQuicConnection):
+    """Run the same handshake with the server on the legacy executor-backed receive path."""
+    server_backend = RECV_EXECUTOR
+
+    def test_unknown_backend(self):
+        """Test that an unknown receive backend is rejected."""
+        with self.assertRaises(ValueError):
+            QuicConnection(recv_backend="bogus")
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,28 @@
+import os
 import random
 
 MB = 1024 * 1024
+
+
+def generate_files(directory="files_to_send", count=10, min_size=2 * MB, max_size=5 * MB, random_content=False,
+                   rng=random):
+    """Write file_1.txt .. file_<count>.txt into directory and return their sizes by stream ID.
+
+    Each file gets a random whole number of MB between min_size and
+    max_size (a fixed size when they are equal). The files hold zeros, or
+    random bytes with random_content.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sizes = {}
+    for i in range(1, count + 1):
+        size = min_size if min_size == max_size else rng.randint(min_size // MB, max_size // MB) * MB
+        with open(os.path.join(directory, f"file_{i}.txt"), 'wb') as f:
+            f.write(os.urandom(size) if random_content else b'0' * size)
+        sizes[i] = size
+    return sizes
+
+
 if __name__ == "__main__":
-    # Generate a random number between 1 and 100
-    # create a file with size of random number * MB (1 MB = 1024 * 1024 bytes)
-    
-    for i in range(1, 11):
-        random_number = random.randint(2,5)
-        with open(f"files_to_send/file_{i}.txt", 'wb') as f:
-            f.write(b'0' * (random_number * MB))
-            print(f"Generated file_{i}.txt with size {random_number} MB.")
\ No newline at end of file
+    # Ten files of 2 to 5 MB each for QuicServer.py to send
+    for i, size in generate_files().items():
+        print(f"Generated file_{i}.txt with size {size // MB} MB.")
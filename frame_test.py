@@ -2,7 +2,8 @@
 
 import unittest
 import struct
-from Frame import Frame, HANDSHAKE, ACK, DATA, CLOSE
+import time
+from Frame import Frame, FrameDescriptors, HANDSHAKE, ACK, DATA, CLOSE, MAX_DATA, FRAME_H_SIZE
 
 class TestFrame(unittest.TestCase):
     
@@ -81,5 +82,105 @@ class TestFrame(unittest.TestCase):
         self.assertEqual(deserialized_frame.offset, min_int_frame.offset, "Offset mismatch for min int value")
         self.assertEqual(deserialized_frame.data, min_int_frame.data, "Data mismatch for min int value")
 
+    def test_pack_into(self):
+        """Test that pack_into writes the same bytes as to_bytes at the given offset."""
+        buffer = bytearray(4 + len(self.frame.to_bytes()))
+        end = self.frame.pack_into(buffer, 4)
+
+        self.assertEqual(end, len(buffer), "pack_into should return the offset past the frame")
+        self.assertEqual(bytes(buffer[4:]), self.frame.to_bytes(), "pack_into output differs from to_bytes")
+
+    def test_unpack_from_memoryview(self):
+        """Test that unpack_from walks a buffer by offset and returns payload views."""
+        other_frame = Frame(stream_id=2, data=b'second', offset=12, frame_type=DATA)
+        buffer = memoryview(self.frame.to_bytes() + other_frame.to_bytes())
+
+        first, offset = Frame.unpack_from(buffer)
+        second, end = Frame.unpack_from(buffer, offset)
+
+        self.assertEqual(offset, FRAME_H_SIZE + len(self.frame_data), "Offset should point past the first frame")
+        self.assertEqual(end, len(buffer), "Offset should point past the last frame")
+        self.assertIsInstance(first.data, memoryview, "Payload should be a view into the buffer")
+        self.assertEqual(bytes(first.data), self.frame_data, "First payload mismatch")
+        self.assertEqual(bytes(second.data), b'second', "Second payload mismatch")
+        self.assertEqual(second.offset, 12, "Offset mismatch for second frame")
+
+    def test_unpack_from_truncated(self):
+        """Test that unpack_from rejects a truncated payload."""
+        buffer = memoryview(self.frame.to_bytes()[:-1])
+        with self.assertRaises(ValueError):
+            Frame.unpack_from(buffer)
+
+    def test_varint_round_trip(self):
+        """Test varint frame headers, including an offset past 4 GB that the fixed header cannot hold."""
+        for frame in (self.frame, Frame(stream_id=2**40, data=b'big', offset=5 * 2**30, frame_type=DATA),
+                      Frame(stream_id=0, data=b'', offset=0, frame_type=CLOSE)):
+            serialized = frame.to_bytes(varint=True)
+            self.assertEqual(len(serialized), frame.header_size(varint=True) + frame.length, "Header size mismatch")
+            deserialized, remaining = Frame.from_bytes(serialized, varint=True)
+            self.assertEqual((deserialized.frame_type, deserialized.stream_id, deserialized.offset, deserialized.data),
+                             (frame.frame_type, frame.stream_id, frame.offset, frame.data), "Varint frame mismatch")
+            self.assertEqual(remaining, b'')
+        self.assertEqual(self.frame.to_bytes(), self.frame.to_bytes(varint=False), "Fixed format should be unchanged")
+        self.assertEqual(Frame(1, b'', 5 * 2**30).to_bytes(), b'', "The fixed header cannot hold a 5 GB offset")
+
+    def test_varint_truncated(self):
+        """Test that a varint frame cut inside its header or payload is rejected."""
+        serialized = Frame(stream_id=300, data=b'payload', offset=70000).to_bytes(varint=True)
+        for cut in (2, 5, len(serialized) - 1):
+            with self.assertRaises(ValueError):
+                Frame.unpack_from(memoryview(serialized[:cut]), 0, varint=True)
+
+    def test_no_instance_dict(self):
+        """Test that frames are slot-based and take no per-instance __dict__."""
+        self.assertFalse(hasattr(self.frame, "__dict__"), "Frame should define __slots__")
+        with self.assertRaises(AttributeError):
+            self.frame.retransmitted = True
+
+    def test_descriptors(self):
+        """Test that descriptors keep every header field and their order, without payloads."""
+        frames = [Frame(3, b'x' * 1400, 2**40), Frame(0, b'', 65536, frame_type=MAX_DATA), Frame(3, b'', 7, CLOSE)]
+        descriptors = FrameDescriptors()
+        for frame in frames:
+            descriptors.add(frame)
+        self.assertEqual(list(descriptors.frames()),
+                         [(frame.frame_type, frame.stream_id, frame.offset, frame.length) for frame in frames])
+        self.assertEqual(descriptors.last_frame_type, CLOSE)
+        self.assertIsNone(FrameDescriptors().last_frame_type)
+
+class TestFrameParsingBenchmark(unittest.TestCase):
+    """Micro-benchmark: frames/sec parsed from one datagram-sized buffer."""
+
+    FRAMES_PER_BUFFER = 64
+    ROUNDS = 200
+
+    def setUp(self):
+        frames = [Frame(stream_id=1, data=b'x' * 1200, offset=i * 1200) for i in range(self.FRAMES_PER_BUFFER)]
+        self.buffer = b''.join(frame.to_bytes() for frame in frames)
+
+    def parse_with_remainder(self):
+        data = self.buffer
+        while data:
+            _, data = Frame.from_bytes(data)
+
+    def parse_with_offsets(self):
+        view = memoryview(self.buffer)
+        offset = 0
+        while offset < len(view):
+            _, offset = Frame.unpack_from(view, offset)
+
+    def frames_per_second(self, parse):
+        start = time.perf_counter()
+        for _ in range(self.ROUNDS):
+            parse()
+        return self.ROUNDS * self.FRAMES_PER_BUFFER / (time.perf_counter() - start)
+
+    def test_parse_rate(self):
+        """Compare remainder slicing (one tail copy per frame) with a single memoryview walk."""
+        before = self.frames_per_second(self.parse_with_remainder)
+        after = self.frames_per_second(self.parse_with_offsets)
+        print(f"\nFrame parsing: remainder slicing {before:,.0f} frames/sec, memoryview {after:,.0f} frames/sec")
+        self.assertGreater(after, 0)
+
 if __name__ == "__main__":
     unittest.main()
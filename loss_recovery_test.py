@@ -0,0 +1,160 @@
+# test_loss_recovery.py
+
+import unittest
+import random
+import sys
+import time
+from LossRecovery import (LossRecovery, ReceivedPacketRanges, SentPacket, encode_ack_ranges, decode_ack_ranges,
+                          K_PACKET_THRESHOLD, INITIAL_RTT)
+
+def footprint(*containers):
+    """Bytes held by the containers and the integers in them."""
+    return sum(sys.getsizeof(container) + sum(map(sys.getsizeof, container)) for container in containers)
+
+
+class TestReceivedPacketRanges(unittest.TestCase):
+
+    def test_in_order_packets_form_one_range(self):
+        """Test that consecutive packet numbers merge into a single range."""
+        ranges = ReceivedPacketRanges()
+        for packet_number in range(10):
+            ranges.add(packet_number)
+        self.assertEqual(ranges.ack_ranges(), [(0, 9)], "Consecutive packets should form one range")
+
+    def test_gaps_and_fills(self):
+        """Test that gaps create ranges and filling a gap merges its neighbours."""
+        ranges = ReceivedPacketRanges()
+        for packet_number in (0, 1, 5, 6, 3):
+            ranges.add(packet_number)
+        self.assertEqual(ranges.ack_ranges(), [(5, 6), (3, 3), (0, 1)], "Ranges should be listed largest first")
+
+        ranges.add(2)
+        ranges.add(4)
+        self.assertEqual(ranges.ack_ranges(), [(0, 6)], "Filling the gaps should merge all ranges")
+        self.assertEqual(ranges.largest, 6, "Largest packet number mismatch")
+
+    def test_oldest_ranges_are_dropped(self):
+        """Test that only the newest max_ranges ranges are kept."""
+        ranges = ReceivedPacketRanges(max_ranges=3)
+        for packet_number in range(0, 20, 2):
+            ranges.add(packet_number)
+        self.assertEqual(ranges.ack_ranges(), [(18, 18), (16, 16), (14, 14)], "Only the newest ranges should remain")
+
+    def test_duplicate_detection(self):
+        """Test that membership matches the packets added, in and out of order."""
+        ranges = ReceivedPacketRanges()
+        for packet_number in (0, 1, 2, 7, 5, 9):
+            ranges.add(packet_number)
+        for packet_number in range(12):
+            self.assertEqual(packet_number in ranges, packet_number in (0, 1, 2, 5, 7, 9),
+                             f"Wrong answer for packet {packet_number}")
+
+    def test_forgotten_packets_count_as_received(self):
+        """Test that packet numbers below the oldest range kept are treated as duplicates."""
+        ranges = ReceivedPacketRanges(max_ranges=3)
+        for packet_number in range(0, 20, 2):
+            ranges.add(packet_number)
+        self.assertEqual(ranges.floor, 14, "The floor should be the start of the oldest range kept")
+        self.assertIn(11, ranges, "A packet older than every range kept is too old to accept")
+        self.assertNotIn(15, ranges, "Gaps between kept ranges are still open")
+        ranges.add(11)
+        self.assertEqual(ranges.ack_ranges(), [(18, 18), (16, 16), (14, 14)], "Nothing below the floor is added")
+
+    def test_ack_frame_encoding(self):
+        """Test that ACK ranges survive encoding and decoding."""
+        ranges = [(10, 12), (4, 7), (0, 1)]
+        self.assertEqual(decode_ack_ranges(encode_ack_ranges(ranges)), ranges, "ACK ranges mismatch after decoding")
+        with self.assertRaises(ValueError):
+            decode_ack_ranges(b'\x00' * 5)
+
+    def test_varint_ack_frame_encoding(self):
+        """Test that varint ACK ranges survive encoding and are smaller than fixed-size ones."""
+        ranges = [(2**40, 2**40 + 5), (10, 12), (4, 7), (0, 1)]
+        encoded = encode_ack_ranges(ranges, varint=True)
+        self.assertEqual(decode_ack_ranges(encoded, varint=True), ranges, "ACK ranges mismatch after decoding")
+        self.assertEqual(len(encode_ack_ranges(ranges[1:], varint=True)), 6, "Small gaps should take one byte each")
+        self.assertEqual(decode_ack_ranges(b'', varint=True), [])
+        with self.assertRaises(ValueError):
+            decode_ack_ranges(encoded[:-1], varint=True)
+
+class TestReceivedPacketRangesMemory(unittest.TestCase):
+    """Benchmark: memory of duplicate detection over millions of packets arriving out of order."""
+
+    PACKET_COUNT = 2_000_000
+    REORDER_WINDOW = 16  # Packets are shuffled within blocks of this size
+    LOSS_RATE = 0.01
+
+    def arrivals(self, count):
+        rng = random.Random(1)
+        for block in range(0, count, self.REORDER_WINDOW):
+            packet_numbers = [pn for pn in range(block, block + self.REORDER_WINDOW) if rng.random() >= self.LOSS_RATE]
+            rng.shuffle(packet_numbers)
+            yield from packet_numbers
+
+    def test_memory_stays_flat(self):
+        """Receive PACKET_COUNT packets and compare memory after the first tenth and at the end."""
+        ranges = ReceivedPacketRanges()
+        checkpoint = self.PACKET_COUNT // 10
+        start = time.perf_counter()
+        for packet_number in self.arrivals(self.PACKET_COUNT):
+            if packet_number in ranges:
+                self.fail(f"Packet {packet_number} reported as a duplicate")
+            ranges.add(packet_number)
+            if packet_number == checkpoint:
+                early = footprint(ranges.starts, ranges.ends)
+        elapsed = time.perf_counter() - start
+        late = footprint(ranges.starts, ranges.ends)
+
+        for packet_number in range(self.PACKET_COUNT - 100, self.PACKET_COUNT):
+            ranges.add(packet_number)
+            self.assertIn(packet_number, ranges, "A repeated recent packet must be caught")
+        self.assertLessEqual(len(ranges.starts), ranges.max_ranges)
+        self.assertLessEqual(late, early + 1024, "Memory should not grow with the number of packets")
+
+        seen = set(self.arrivals(checkpoint))
+        print(f"\nDuplicate detection: ranges {early / 1024:.1f} KB after {checkpoint:,} packets, "
+              f"{late / 1024:.1f} KB after {self.PACKET_COUNT:,} ({1e9 * elapsed / self.PACKET_COUNT:.0f} ns/packet); "
+              f"a set of {len(seen):,} packet numbers takes {footprint(seen) / 2**20:.1f} MB")
+
+class TestLossRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.recovery = LossRecovery()
+        for packet_number in range(6):
+            self.recovery.on_packet_sent(SentPacket(packet_number, [], 100, time_sent=packet_number * 0.01))
+
+    def test_ack_removes_packets_and_samples_rtt(self):
+        """Test that acknowledged packets leave flight and update the RTT estimate."""
+        acked, lost = self.recovery.on_ack_received([(0, 1)], 0, now=0.05)
+        self.assertEqual([packet.packet_number for packet in acked], [0, 1], "Acknowledged packets mismatch")
+        self.assertEqual(lost, [], "No packet should be lost yet")
+        self.assertEqual(self.recovery.bytes_in_flight, 400, "Bytes in flight mismatch")
+        self.assertAlmostEqual(self.recovery.rtt.latest_rtt, 0.04, msg="RTT sample should come from the largest acked packet")
+
+    def test_ack_with_several_ranges(self):
+        """Test that ranges in wire order, largest first and overlapping, acknowledge exactly their packets."""
+        for packet_number in range(6, 40):
+            self.recovery.on_packet_sent(SentPacket(packet_number, [], 100, time_sent=0.06))
+        ranges = [(30, 39), (20, 25), (22, 23), (10, 12), (0, 0)]
+        acked, _ = self.recovery.on_ack_received(ranges, 0, now=0.07)
+        expected = [pn for pn in range(40) if any(first <= pn <= last for first, last in ranges)]
+        self.assertEqual([packet.packet_number for packet in acked], expected)
+        self.assertFalse(set(expected) & set(self.recovery.sent_packets), "Acknowledged packets must leave flight")
+
+    def test_packet_threshold_loss(self):
+        """Test that a packet is lost once enough later packets are acknowledged."""
+        _, lost = self.recovery.on_ack_received([(1, K_PACKET_THRESHOLD)], 0, now=0.04)
+        self.assertEqual([packet.packet_number for packet in lost], [0], "Packet 0 should be declared lost")
+        self.assertNotIn(0, self.recovery.sent_packets, "Lost packet should no longer be in flight")
+
+    def test_probe_timeout_resends_oldest(self):
+        """Test that a probe timeout hands back the oldest packet and backs off."""
+        deadline = self.recovery.loss_detection_deadline()
+        self.assertGreater(deadline, 0.05 + INITIAL_RTT, "Probe timeout should be at least one RTT after the last send")
+
+        lost = self.recovery.on_timeout(deadline)
+        self.assertEqual([packet.packet_number for packet in lost], [0], "Oldest packet should be retransmitted")
+        self.assertEqual(self.recovery.pto_count, 1, "Probe timeout count should increase")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+# test_metrics.py
+
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+import time
+from Metrics import MetricsRegistry, Histogram, MetricsServer, prometheus_text
+from QuicConnection import QuicConnection
+from QuicClient import write_stats, transfer_totals
+from QuicServer import serve_connection
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram("latency", "Latency", (0.01, 0.1, 1.0))
+        for value in (0.005, 0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1], "The last bucket catches values above every bound")
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 5.605)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+
+    def test_sample_rates(self):
+        """Test that samples record values and turn counters into per-second rates, labeled ones too."""
+        state = {"bytes": 0, "queue": 3, "streams": {1: 0}}
+        registry = MetricsRegistry({"connection": 7})
+        registry.counter("bytes", "Bytes", lambda: state["bytes"])
+        registry.gauge("queue", "Queue", lambda: state["queue"])
+        registry.counter("stream_bytes", "Per stream", lambda: dict(state["streams"]), label="stream")
+        first = registry.sample(now=100.0)
+        self.assertEqual(first["rates"], {}, "The first sample has nothing to compare with")
+        state.update(bytes=5000, streams={1: 1000, 2: 500})
+        second = registry.sample(now=102.0)
+        self.assertEqual(second["values"]["queue"], 3)
+        self.assertEqual(second["rates"]["bytes"], 2500)
+        self.assertEqual(second["rates"]["stream_bytes"], {1: 500, 2: 250}, "A new stream starts from zero")
+        self.assertNotIn("queue", second["rates"], "Gauges have no rate")
+
+    def test_time_series_is_bounded(self):
+        registry = MetricsRegistry(max_samples=3)
+        registry.gauge("value", "Value", lambda: 1)
+        for second in range(10):
+            registry.sample(now=second)
+        self.assertEqual([sample["time"] for sample in registry.samples], [7, 8, 9])
+
+    def test_duplicate_name(self):
+        registry = MetricsRegistry()
+        registry.gauge("value", "Value", lambda: 1)
+        with self.assertRaises(ValueError):
+            registry.counter("value", "Value", lambda: 1)
+
+    def test_prometheus_text(self):
+        """Test the exposition format, with each family described once across connections."""
+        registries = []
+        for con_id in (1, 2):
+            registry = MetricsRegistry({"connection": con_id})
+            registry.counter("quic_bytes_sent", "Bytes sent", lambda: 1500)
+            registry.gauge("quic_stream_pending_bytes", "Pending", lambda: {3: 10}, label="stream")
+            registry.histogram("quic_rtt_seconds", "RTT", (0.01, 0.1)).observe(0.05)
+            registries.append(registry)
+        text = prometheus_text(registries)
+        self.assertEqual(text.count("# TYPE quic_bytes_sent counter"), 1)
+        self.assertIn('quic_bytes_sent{connection="2"} 1500', text)
+        self.assertIn('quic_stream_pending_bytes{connection="1",stream="3"} 10', text)
+        self.assertIn('quic_rtt_seconds_bucket{connection="1",le="0.01"} 0', text)
+        self.assertIn('quic_rtt_seconds_bucket{connection="1",le="+Inf"} 1', text)
+        self.assertIn('quic_rtt_seconds_count{connection="2"} 1', text)
+
+
+class TestConnectionMetrics(unittest.TestCase):
+    """Transfer files between two local connections and read their metrics while and after it runs."""
+
+    STREAM_COUNT = 3
+    FILE_SIZE = 256 * 1024
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            with open(os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"), 'wb') as f:
+                f.write(os.urandom(self.FILE_SIZE))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def transfer(self):
+        server = QuicConnection(('127.0.0.1', 0), None, metrics_interval=0.02)
+
+        async def serve():
+            await server.listen()
+            await serve_connection(server, self.tmp_dir.name)
+        server_task = asyncio.create_task(serve())
+        client = QuicConnection(r_addr=server.sock.getsockname(), metrics_interval=0.02)
+
+        metrics_server = MetricsServer(lambda: [server.metrics, client.metrics])
+        host, port = await metrics_server.start()
+        await client.connect()
+        await client.start_streams_request(self.STREAM_COUNT)
+        await client.wait_closed()
+        exported = await self.fetch(host, port, "/metrics"), await self.fetch(host, port, "/metrics.json")
+        missing = await self.fetch(host, port, "/other")
+        metrics_server.close()
+        await server.close()
+        await server_task
+        return server, client, exported, missing
+
+    async def fetch(self, host, port, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    def test_transfer_metrics(self):
+        server, client, (text, json_response), missing = asyncio.run(asyncio.wait_for(self.transfer(), 60))
+        values = client.metrics.values()
+        self.assertEqual(values["quic_stream_bytes_delivered_total"], self.STREAM_COUNT * self.FILE_SIZE)
+        self.assertEqual(len(values["quic_stream_duration_seconds"]), self.STREAM_COUNT)
+        self.assertGreater(values["quic_transfer_seconds"], 0)
+        self.assertEqual(client.completion_histogram.count, self.STREAM_COUNT, "Every completed stream is observed")
+        self.assertGreater(server.rtt_histogram.count, 0, "ACKs should produce RTT samples")
+        self.assertGreater(server.metrics.values()["quic_packets_sent"], self.STREAM_COUNT * self.FILE_SIZE // 8192)
+
+        self.assertGreater(len(server.metrics.samples), 1, "The transfer should span several samples")
+        throughput = [sample["rates"].get("quic_stream_bytes_sent_total", 0) for sample in server.metrics.samples]
+        self.assertGreater(max(throughput), 0, "Samples should show the send rate while data flows")
+
+        self.assertTrue(text.startswith("HTTP/1.0 200 OK"))
+        self.assertIn(f'quic_bytes_sent{{connection="{server.con_id}"}}', text)
+        body = json.loads(json_response.split("\r\n\r\n", 1)[1])
+        self.assertEqual([registry["labels"]["connection"] for registry in body], [server.con_id, client.con_id])
+        self.assertTrue(missing.startswith("HTTP/1.0 404"))
+
+        # The stats file is regenerated from metrics, live or saved
+        with tempfile.TemporaryDirectory() as directory:
+            write_stats(client.metrics.to_dict(), self.STREAM_COUNT, directory)
+            with open(os.path.join(directory, f"client_{self.STREAM_COUNT}_streams_metrics.json")) as f:
+                saved = json.load(f)
+            self.assertEqual(transfer_totals(saved), transfer_totals(client.metrics.to_dict()))
+            with open(os.path.join(directory, f"client_{self.STREAM_COUNT}_streams_stats.txt")) as f:
+                stats = f.read()
+            self.assertIn(f"Total bytes received: {transfer_totals(saved)[0]}", stats)
+            self.assertEqual(stats.count("Avg. Bytes Throughput"), self.STREAM_COUNT + 1)
+
+
+class TestMetricsOverhead(unittest.TestCase):
+    """Benchmark: what recording and sampling metrics cost on a connection with many streams."""
+
+    STREAM_COUNT = 100
+
+    def test_recording_cost(self):
+        """Report the cost of one histogram observation and of one sample and export with 100 streams."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        connection = QuicConnection(metrics_interval=None)
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            connection.new_stream(stream_id)
+
+        observations = 100000
+        start = time.perf_counter()
+        for i in range(observations):
+            connection.rtt_histogram.observe(0.001 * (i % 100))
+        observe = (time.perf_counter() - start) / observations
+
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            connection.metrics.sample()
+        sample = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            connection.metrics.to_prometheus()
+        export = (time.perf_counter() - start) / rounds
+        connection.sock.close()
+        loop.close()
+
+        print(f"\nMetrics with {self.STREAM_COUNT} streams: observe {1e9 * observe:.0f} ns, "
+              f"sample {1e6 * sample:.0f} us, Prometheus export {1e6 * export:.0f} us")
+        self.assertEqual(connection.rtt_histogram.count, observations)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,9 @@
 
 import unittest
 import struct
-from Packet import Packet
-from Frame import Frame, HANDSHAKE, ACK, DATA, CLOSE
+import time
+from Packet import Packet, PACKET_H_MAX_SIZE, VARINT_FLAG
+from Frame import Frame, HANDSHAKE, ACK, DATA, CLOSE, FRAME_H_SIZE
 
 class TestPacket(unittest.TestCase):
 
@@ -82,6 +83,31 @@ class TestPacket(unittest.TestCase):
             Packet.from_bytes(corrupted_serialized)
         self.assertEqual(str(cm.exception), "Incorrect packet format")
 
+    def test_from_bytes_zero_copy(self):
+        """Test that zero-copy parsing returns payload views with the same contents."""
+        serialized = self.packet_long_header.to_bytes()
+        copied = Packet.from_bytes(serialized)
+        viewed = Packet.from_bytes(serialized, zero_copy=True)
+
+        self.assertIsInstance(copied.frames[0].data, bytes, "Default parsing should copy payloads")
+        self.assertIsInstance(viewed.frames[0].data, memoryview, "Zero-copy parsing should return views")
+        for copied_frame, viewed_frame in zip(copied.frames, viewed.frames):
+            self.assertEqual(bytes(viewed_frame.data), copied_frame.data, "Payload mismatch between parsing modes")
+            self.assertEqual(viewed_frame.offset, copied_frame.offset, "Offset mismatch between parsing modes")
+
+    def test_pack_into(self):
+        """Test that pack_into produces the same datagram as to_bytes for both header forms."""
+        for packet in (self.packet_long_header, self.packet_short_header):
+            buffer = bytearray(8 * 1024)
+            size = packet.pack_into(buffer)
+            self.assertEqual(bytes(buffer[:size]), packet.to_bytes(), "pack_into output differs from to_bytes")
+
+    def test_pack_into_too_small(self):
+        """Test that pack_into reports 0 bytes instead of growing a buffer that is too small."""
+        buffer = bytearray(20)
+        self.assertEqual(self.packet_long_header.pack_into(buffer), 0)
+        self.assertEqual(len(buffer), 20, "Buffer must not be resized")
+
     def test_add_frame(self):
         """Test adding a frame to a packet."""
         packet = Packet(header_form=0, flags=0, dest_con_id=5678, packet_number=1)
@@ -90,5 +116,74 @@ class TestPacket(unittest.TestCase):
         self.assertEqual(len(packet.frames), initial_frame_count + 1, "Frame count did not increase after adding a frame")
         self.assertEqual(packet.frames[-1], self.frame1, "Last frame in packet does not match the added frame")
 
+    def test_varint_short_header(self):
+        """Test that the varint flag switches the packet number and frame headers to varints."""
+        frames = [self.frame1, Frame(stream_id=3, data=b'tail', offset=2**33)]
+        packet = Packet(header_form=0, flags=VARINT_FLAG, dest_con_id=5678, packet_number=2**35, frames=frames)
+        serialized = packet.to_bytes()
+        buffer = bytearray(1024)
+        self.assertEqual(bytes(buffer[:packet.pack_into(buffer)]), serialized, "pack_into output differs from to_bytes")
+
+        deserialized = Packet.from_bytes(serialized, zero_copy=True)
+        self.assertTrue(deserialized.varint, "The flag should survive the round trip")
+        self.assertEqual(deserialized.packet_number, 2**35, "Packet number mismatch")
+        self.assertEqual([(frame.stream_id, frame.offset, bytes(frame.data)) for frame in deserialized.frames],
+                         [(frame.stream_id, frame.offset, frame.data) for frame in frames], "Frame mismatch")
+        self.assertFalse(self.packet_long_header.varint, "Long headers are always fixed-format")
+
+    def test_varint_header_is_smaller(self):
+        """Test that a small packet number and stream fields take fewer bytes as varints."""
+        varint_packet = Packet(header_form=0, flags=VARINT_FLAG, dest_con_id=5678, packet_number=1,
+                               frames=[self.frame1])
+        saved = len(self.packet_short_header.to_bytes()) - len(varint_packet.to_bytes())
+        self.assertEqual(saved, 3 + FRAME_H_SIZE - self.frame1.header_size(varint=True))
+
+class TestPacketParsingBenchmark(unittest.TestCase):
+    """Micro-benchmark: frames/sec parsed from full packets, copying vs zero-copy."""
+
+    ROUNDS = 500
+
+    def setUp(self):
+        frames = [Frame(stream_id=i % 4, data=b'x' * 100, offset=i * 100) for i in range(64)]
+        self.datagram = Packet(header_form=0, flags=0, dest_con_id=5678, packet_number=1, frames=frames).to_bytes()
+
+    def frames_per_second(self, zero_copy):
+        start = time.perf_counter()
+        for _ in range(self.ROUNDS):
+            frame_count = len(Packet.from_bytes(self.datagram, zero_copy=zero_copy).frames)
+        return self.ROUNDS * frame_count / (time.perf_counter() - start)
+
+    def test_parse_rate(self):
+        before = self.frames_per_second(zero_copy=False)
+        after = self.frames_per_second(zero_copy=True)
+        print(f"\nPacket parsing: copying {before:,.0f} frames/sec, zero-copy {after:,.0f} frames/sec")
+        self.assertGreater(after, 0)
+
+class TestPacketSerializationBenchmark(unittest.TestCase):
+    """Benchmark: bytes/sec serialized for full 8 KB packets."""
+
+    PACKET_SIZE = 8 * 1024
+    ROUNDS = 2000
+
+    def setUp(self):
+        payload_size = 1500
+        frame_count = (self.PACKET_SIZE - PACKET_H_MAX_SIZE) // (payload_size + FRAME_H_SIZE)
+        frames = [Frame(stream_id=1, data=b'x' * payload_size, offset=i * payload_size) for i in range(frame_count)]
+        self.packet = Packet(header_form=0, flags=0, dest_con_id=5678, packet_number=1, frames=frames)
+        self.buffer = bytearray(self.PACKET_SIZE)
+
+    def bytes_per_second(self, serialize):
+        start = time.perf_counter()
+        total = 0
+        for _ in range(self.ROUNDS):
+            total += serialize()
+        return total / (time.perf_counter() - start)
+
+    def test_serialize_rate(self):
+        before = self.bytes_per_second(lambda: len(self.packet.to_bytes()))
+        after = self.bytes_per_second(lambda: self.packet.pack_into(self.buffer))
+        print(f"\nPacket serialization: to_bytes {before / 2**20:,.0f} MB/sec, pack_into {after / 2**20:,.0f} MB/sec")
+        self.assertGreater(after, 0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,76 @@
+# test_path_mtu.py
+
+import unittest
+from PathMtu import PathMtuDiscovery, BASE_PACKET_SIZE, MAX_PROBES, SEARCH_PRECISION, BLACK_HOLE_THRESHOLD
+
+
+def search(discovery, path_mtu):
+    """Answer probes as a path carrying path_mtu bytes would until the search ends; returns probes sent."""
+    probes = 0
+    while True:
+        size = discovery.next_probe_size()
+        if size is None:
+            return probes
+        discovery.on_probe_sent(size)
+        probes += 1
+        if size <= path_mtu:
+            discovery.on_probe_acked(size)
+        else:
+            discovery.on_probe_lost(size)
+
+
+class TestPathMtuDiscovery(unittest.TestCase):
+
+    def test_starts_at_base_size(self):
+        discovery = PathMtuDiscovery(8192)
+        self.assertEqual(discovery.packet_size, BASE_PACKET_SIZE, "Only the QUIC minimum is safe before probing")
+        self.assertEqual(PathMtuDiscovery(8192, enabled=False).packet_size, 8192, "Disabled means a fixed size")
+        self.assertIsNone(PathMtuDiscovery(8192, enabled=False).next_probe_size())
+
+    def test_binary_search_converges(self):
+        """Test that the search ends just below the path MTU for several paths."""
+        for path_mtu in (1200, 1472, 4000, 8972, 20000):
+            with self.subTest(path_mtu=path_mtu):
+                discovery = PathMtuDiscovery(16384)
+                search(discovery, path_mtu)
+                expected = min(path_mtu, 16384)
+                self.assertLessEqual(discovery.packet_size, expected, "Packet size must fit the path")
+                self.assertGreater(discovery.packet_size, expected - SEARCH_PRECISION, "Search stopped too early")
+
+    def test_size_is_given_up_after_max_probes(self):
+        """Test that one lost probe is retried and MAX_PROBES losses lower the search ceiling."""
+        discovery = PathMtuDiscovery(8192)
+        size = discovery.next_probe_size()
+        for attempt in range(MAX_PROBES):
+            self.assertEqual(discovery.next_probe_size(), size, "The same size should be retried")
+            discovery.on_probe_sent(size)
+            self.assertIsNone(discovery.next_probe_size(), "Only one probe may be in flight")
+            discovery.on_probe_lost(size)
+        self.assertEqual(discovery.search_high, size - 1)
+        self.assertLess(discovery.next_probe_size(), size, "The next probe should be smaller")
+
+    def test_peer_limit_caps_search(self):
+        discovery = PathMtuDiscovery(8192)
+        discovery.set_max_size(1500)
+        search(discovery, 9000)
+        self.assertLessEqual(discovery.packet_size, 1500, "Packets must fit the peer's receive buffer")
+
+    def test_black_hole_falls_back(self):
+        """Test that full-size packets lost with none getting through drop back to the base size."""
+        discovery = PathMtuDiscovery(8192)
+        search(discovery, 8192)
+        full_size = discovery.packet_size
+
+        self.assertFalse(discovery.on_packets_acked_and_lost([full_size], [full_size] * 10),
+                         "Losses alongside delivered full-size packets are congestion")
+        for _ in range(BLACK_HOLE_THRESHOLD - 1):
+            self.assertFalse(discovery.on_packets_acked_and_lost([], [full_size]))
+        self.assertTrue(discovery.on_packets_acked_and_lost([], [full_size]), "Should fall back")
+        self.assertEqual(discovery.packet_size, BASE_PACKET_SIZE)
+        self.assertEqual(discovery.black_holes, 1)
+
+        search(discovery, 1472)
+        self.assertGreater(discovery.packet_size, 1472 - SEARCH_PRECISION, "The search should start again")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+# test_server.py
+
+import unittest
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from unittest.mock import patch
+from Frame import Frame, ACK
+from Packet import Packet
+from QuicConnection import QuicConnection
+from QuicEndpoint import QuicEndpoint, WORKER_ID_SHIFT
+from QuicServer import serve_connection, start_workers
+
+class TestQuicEndpoint(unittest.TestCase):
+    """Load test: many concurrent clients served by one endpoint on one socket."""
+
+    CLIENT_COUNT = 20
+    STREAM_COUNT = 2
+    FILE_SIZE = 64 * 1024
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.payloads = {}
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            self.payloads[stream_id] = os.urandom(self.FILE_SIZE)
+            with open(os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"), 'wb') as f:
+                f.write(self.payloads[stream_id])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def accept_connections(self, endpoint):
+        while True:
+            connection = await endpoint.accept()
+            asyncio.create_task(serve_connection(connection, self.tmp_dir.name))
+
+    async def run_client(self, addr):
+        start = time.perf_counter()
+        client = QuicConnection(r_addr=addr)
+        await client.connect()
+        await client.start_streams_request(self.STREAM_COUNT)
+        await client.wait_closed()
+        return client, time.perf_counter() - start
+
+    async def load_test(self):
+        endpoint = QuicEndpoint(('127.0.0.1', 0))
+        addr = await endpoint.start()
+        accept_task = asyncio.create_task(self.accept_connections(endpoint))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self.run_client(addr) for _ in range(self.CLIENT_COUNT)))
+        elapsed = time.perf_counter() - start
+
+        # Closed connections should be reaped once their CLOSE packets arrive
+        for _ in range(100):
+            if not endpoint.connections:
+                break
+            await asyncio.sleep(0.01)
+        open_connections = len(endpoint.connections)
+
+        accept_task.cancel()
+        await endpoint.close()
+        return endpoint, results, elapsed, open_connections
+
+    def test_concurrent_clients(self):
+        """Test that concurrent clients all receive their files and their connections are reaped."""
+        endpoint, results, elapsed, open_connections = asyncio.run(asyncio.wait_for(self.load_test(), 60))
+
+        self.assertEqual(endpoint.connections_accepted, self.CLIENT_COUNT, "Every client should get its own connection")
+        self.assertEqual(open_connections, 0, "Closed connections should be removed from the endpoint")
+        self.assertEqual(len({client.r_con_id for client, _ in results}), self.CLIENT_COUNT, "Server connection IDs must be unique")
+        for client, _ in results:
+            for stream_id, payload in self.payloads.items():
+                self.assertEqual(bytes(client.streams[stream_id].received_data), payload, "Client received wrong data")
+
+        latencies = sorted(latency for _, latency in results)
+        total_bytes = self.CLIENT_COUNT * self.STREAM_COUNT * self.FILE_SIZE
+        print(f"\n{self.CLIENT_COUNT} clients: aggregate {total_bytes / elapsed / 2**20:.2f} MB/sec, "
+              f"connection latency p50 {1000 * latencies[len(latencies) // 2]:.0f} ms, "
+              f"max {1000 * latencies[-1]:.0f} ms")
+
+    async def forward_misrouted_datagram(self):
+        channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(2)]
+        endpoints = [QuicEndpoint(('127.0.0.1', 0), worker_id=worker_id, channels=channels) for worker_id in range(2)]
+        for endpoint in endpoints:
+            await endpoint.start()
+        connection = endpoints[1].new_connection((1234, ('127.0.0.1', 9)))
+
+        packet = Packet(header_form=0, flags=0, dest_con_id=connection.con_id, packet_number=1,
+                        frames=[Frame(stream_id=0, data=b'PING', offset=0)])
+        endpoints[0].datagram_received(packet.to_bytes(), ('127.0.0.1', 9))
+        try:
+            frame = await asyncio.wait_for(connection.recv(), 1)
+        except asyncio.TimeoutError:
+            frame = None
+
+        for endpoint in endpoints:
+            await endpoint.close()
+        for pair in channels:
+            for channel in pair:
+                channel.close()
+        return connection, endpoints, frame
+
+    def test_misrouted_datagram_is_forwarded(self):
+        """Test that a worker passes datagrams for another worker's connection on to it."""
+        connection, endpoints, frame = asyncio.run(self.forward_misrouted_datagram())
+        self.assertEqual(connection.con_id >> WORKER_ID_SHIFT, 1, "Connection ID should name its worker")
+        self.assertEqual(endpoints[0].datagrams_forwarded, 1, "Misrouted datagram should be forwarded")
+        self.assertIsNotNone(frame, "Forwarded datagram should reach the owning connection")
+        self.assertEqual(frame.data, b'PING', "Forwarded frame data mismatch")
+
+    async def open_and_idle(self):
+        endpoint = QuicEndpoint(('127.0.0.1', 0), idle_timeout=0.2)
+        addr = await endpoint.start()
+        stray = Packet(header_form=1, flags=0, src_con_id=77, dest_con_id=0, packet_number=1,
+                       frames=[Frame(stream_id=0, data=b'\x00' * 8, offset=0, frame_type=ACK)])
+        endpoint.datagram_received(stray.to_bytes(), ('127.0.0.1', 9))
+        stray_connections = len(endpoint.connections)
+
+        client = QuicConnection(r_addr=addr)
+        await client.connect()
+        connection = await asyncio.wait_for(endpoint.accept(), 1)
+        for _ in range(100):
+            if connection.closed:
+                break
+            await asyncio.sleep(0.01)
+        await client.close()
+        await endpoint.close()
+        return endpoint, stray_connections, connection
+
+    def test_only_handshakes_open_connections_and_idle_ones_close(self):
+        """Test that a long-header datagram without a handshake is dropped and a silent connection times out."""
+        with patch('builtins.print'):
+            endpoint, stray_connections, connection = asyncio.run(asyncio.wait_for(self.open_and_idle(), 30))
+        self.assertEqual(stray_connections, 0, "A datagram without a handshake must not create a connection")
+        self.assertEqual(endpoint.connections_accepted, 1)
+        self.assertTrue(connection.closed, "A connection that receives nothing should be closed")
+        self.assertEqual(endpoint.connections_timed_out, 1)
+        self.assertNotIn(connection.con_id, endpoint.connections)
+        self.assertEqual(endpoint.last_received, {})
+
+
+def run_client_process(addr, client_count, stream_count, results):
+    """Run client_count clients in this process and report the bytes they received."""
+    async def run_client():
+        client = QuicConnection(r_addr=addr)
+        await client.connect()
+        await client.start_streams_request(stream_count)
+        await client.wait_closed()
+        return sum(len(stream.received_data) for stream in client.streams.values())
+
+    async def run_clients():
+        return await asyncio.gather(*(run_client() for _ in range(client_count)))
+
+    results.put(sum(asyncio.run(run_clients())))
+
+
+class TestMultiWorkerServer(unittest.TestCase):
+    """Benchmark: aggregate throughput of SO_REUSEPORT worker processes sharing one port."""
+
+    WORKER_COUNTS = (1, 2, 4)
+    CLIENT_PROCESSES = 4
+    CLIENTS_PER_PROCESS = 5
+    STREAM_COUNT = 2
+    FILE_SIZE = 256 * 1024
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            with open(os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"), 'wb') as f:
+                f.write(os.urandom(self.FILE_SIZE))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def free_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def run_benchmark(self, worker_count):
+        addr = ('127.0.0.1', self.free_port())
+        workers = start_workers(addr[1], worker_count, self.tmp_dir.name)
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        clients = [context.Process(target=run_client_process,
+                                   args=(addr, self.CLIENTS_PER_PROCESS, self.STREAM_COUNT, results))
+                   for _ in range(self.CLIENT_PROCESSES)]
+        try:
+            start = time.perf_counter()
+            for client in clients:
+                client.start()
+            total_bytes = sum(results.get(timeout=120) for _ in clients)
+            elapsed = time.perf_counter() - start
+        finally:
+            for process in clients + workers:
+                process.terminate()
+                process.join()
+        return total_bytes, elapsed
+
+    def test_workers_listen_before_start_returns(self):
+        """Test that start_workers returns with every worker bound, and fails if a worker cannot bind."""
+        port = self.free_port()
+        workers = start_workers(port, 2, self.tmp_dir.name)
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                with self.assertRaises(OSError, msg="The workers should already hold the port"):
+                    sock.bind(('127.0.0.1', port))
+        finally:
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))  # Without SO_REUSEPORT, so the workers cannot share it
+            with self.assertRaises(RuntimeError):
+                start_workers(sock.getsockname()[1], 2, self.tmp_dir.name)
+
+    def test_throughput_scales_with_workers(self):
+        """Test that every worker count serves all clients, and report aggregate throughput."""
+        expected_bytes = self.CLIENT_PROCESSES * self.CLIENTS_PER_PROCESS * self.STREAM_COUNT * self.FILE_SIZE
+        print(f"\nSO_REUSEPORT workers ({os.cpu_count()} CPUs):")
+        for worker_count in self.WORKER_COUNTS:
+            total_bytes, elapsed = self.run_benchmark(worker_count)
+            self.assertEqual(total_bytes, expected_bytes, f"Clients of {worker_count} workers missed data")
+            print(f"  {worker_count} workers: {total_bytes / elapsed / 2**20:.2f} MB/sec")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+# test_stream_io.py
+
+import unittest
+import asyncio
+import contextlib
+import hashlib
+import io
+import os
+import time
+from unittest.mock import MagicMock
+from QuicConnection import QuicConnection, KB, MB
+from Stream import Stream
+from Frame import Frame, CLOSE
+from StreamIO import StreamReader, StreamWriter
+from UdpRelay import UdpRelay
+
+
+async def connect_pair(loss_rate=0.0, **options):
+    """A listening server connection and a client connected to it, through a lossy relay if loss_rate is set."""
+    server = QuicConnection(('127.0.0.1', 0), None, **options)
+    listening = asyncio.create_task(server.listen())
+    relay = None
+    address = server.sock.getsockname()
+    if loss_rate:
+        relay = UdpRelay(address, loss_rate, seed=1)
+        address = await relay.start()
+    client = QuicConnection(r_addr=address, **options)
+    await client.connect()
+    await listening
+    return server, client, relay
+
+
+def generated_chunks(total, size=64 * KB):
+    """Deterministic pseudo-random data, as a producer would generate it."""
+    for offset in range(0, total, size):
+        yield hashlib.sha256(str(offset).encode()).digest() * (min(size, total - offset) // 32)
+
+
+class TestStreamBuffers(unittest.TestCase):
+    """The stream side of the API, without a network."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.connection = MagicMock()
+        self.connection.closed = False
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_small_writes_are_coalesced(self):
+        stream = Stream(2, self.connection)
+        writer = StreamWriter(stream)
+        for _ in range(100):
+            writer.write(b'x' * 10)
+        writer.write(b'y' * 8000)
+        writer.close()
+        self.assertEqual([frame.length for frame in stream.frames], [1000, 8000, 0])
+        self.assertEqual([frame.offset for frame in stream.frames], [0, 1000, 9000])
+        self.assertEqual(stream.pending_bytes, 9000)
+        with self.assertRaises(RuntimeError):
+            writer.write(b'late')
+
+    def test_written_buffer_is_copied(self):
+        stream = Stream(2, self.connection)
+        buffer = bytearray(b'abc')
+        stream.write(buffer)
+        buffer[:] = b'xyz'
+        self.assertEqual(bytes(stream.get_next_frame().data), b'abc')
+
+    def test_drain_waits_for_the_sender(self):
+        """Test that drain blocks above high_water and returns once sending brings the queue to low_water."""
+        stream = Stream(2, self.connection)
+        stream.writer = writer = StreamWriter(stream, high_water=16 * KB, low_water=4 * KB)
+        writer.write(bytes(32 * KB))
+        drain = self.loop.create_task(writer.drain())
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertFalse(drain.done())
+        stream.get_next_frame(max_length=20 * KB)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertFalse(drain.done(), "12 KB left is still above low_water")
+        stream.get_next_frame(max_length=8 * KB)
+        self.loop.run_until_complete(asyncio.wait_for(drain, 1))
+
+    def test_reader_takes_chunks_in_order(self):
+        stream = Stream(1, self.connection)
+        stream.reader = reader = StreamReader(stream)
+
+        async def run():
+            await stream.receive_frame(Frame(1, b'world', 5))
+            self.assertEqual(reader.buffered, 0, "Out-of-order data waits for the gap")
+            await stream.receive_frame(Frame(1, b'hello', 0))
+            first = await reader.read(3)
+            rest = await reader.readexactly(7)
+            await stream.receive_frame(Frame(1, None, 10, frame_type=CLOSE))
+            return first, rest, await reader.read()
+        self.assertEqual(self.loop.run_until_complete(run()), (b'hel', b'loworld', b''))
+        self.assertTrue(reader.at_eof())
+        self.assertEqual(stream.consumed, 0, "The reader, not the stream, reports what was consumed")
+        self.assertEqual(sum(call.args[1] for call in self.connection.stream_data_read.call_args_list), 10)
+
+
+class TestStreamPipe(unittest.TestCase):
+    """Pipe generated data between two connections through the stream API."""
+
+    def test_pipe_with_backpressure(self):
+        """Test that a fast producer and a slow consumer move all the data in bounded memory."""
+        total = 4 * MB
+        window = 256 * KB
+
+        async def run():
+            server, client, _ = await connect_pair(max_stream_data=window, max_data=2 * window)
+            writer = client.open_stream(high_water=128 * KB, low_water=32 * KB)
+            peak_pending = 0
+
+            async def produce():
+                nonlocal peak_pending
+                for chunk in generated_chunks(total):
+                    writer.write(chunk)
+                    peak_pending = max(peak_pending, writer.stream.pending_bytes)
+                    await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+
+            async def consume():
+                reader = await server.accept_stream()
+                digest = hashlib.sha256()
+                peak_buffered = 0
+                while True:
+                    peak_buffered = max(peak_buffered, reader.buffered)
+                    data = await reader.read(128 * KB)
+                    if not data:
+                        break
+                    digest.update(data)
+                    await asyncio.sleep(0.002)  # A consumer slower than the link
+                return reader.stream_id, digest.hexdigest(), peak_buffered
+
+            start = time.perf_counter()
+            _, (stream_id, received, peak_buffered) = await asyncio.gather(produce(), consume())
+            elapsed = time.perf_counter() - start
+            await client.close()
+            await server.close()
+            return stream_id, received, peak_pending, peak_buffered, elapsed
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            stream_id, received, peak_pending, peak_buffered, elapsed = asyncio.run(asyncio.wait_for(run(), 60))
+        expected = hashlib.sha256(b''.join(generated_chunks(total))).hexdigest()
+        self.assertEqual(received, expected)
+        self.assertEqual(stream_id % 2, 0, "Client-opened streams have even IDs")
+        self.assertLessEqual(peak_pending, 128 * KB + 64 * KB, "drain() keeps the send queue near high_water")
+        self.assertLessEqual(peak_buffered, window, "Flow control keeps unread data within the receive window")
+        print(f"\nStream pipe: {total / MB:.0f} MB in {elapsed:.2f} s ({total / MB / elapsed:.1f} MB/sec) with a slow "
+              f"consumer, peak send queue {peak_pending // KB} KB, peak unread {peak_buffered // KB} KB")
+
+    def test_streams_both_ways_over_loss(self):
+        """Test server-opened and client-opened streams side by side over a lossy path, read with async for."""
+        payloads = {"client": os.urandom(300 * KB), "server": os.urandom(200 * KB)}
+
+        async def send(connection, data):
+            writer = connection.open_stream()
+            writer.write(data)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            return writer.stream_id
+
+        async def receive(connection):
+            reader = await connection.accept_stream()
+            chunks = [chunk async for chunk in reader]
+            return reader.stream_id, b''.join(chunks)
+
+        async def run():
+            server, client, relay = await connect_pair(loss_rate=0.05)
+            results = await asyncio.gather(send(client, payloads["client"]), send(server, payloads["server"]),
+                                           receive(server), receive(client))
+            await client.close()
+            await server.close()  # The lossy relay may drop the client's CLOSE packet
+            relay.close()
+            return results
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            client_id, server_id, at_server, at_client = asyncio.run(asyncio.wait_for(run(), 60))
+        self.assertEqual(at_server, (client_id, payloads["client"]))
+        self.assertEqual(at_client, (server_id, payloads["server"]))
+        self.assertEqual(server_id % 2, 1, "Server-opened streams have odd IDs")
+
+    def test_accept_after_the_stream_completed(self):
+        """Test that a peer's stream that ends before it is accepted leaves the connection open for the reader."""
+        async def run():
+            server, client, _ = await connect_pair()
+            writer = client.open_stream()
+            writer.write(b'hello world')
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.sleep(0.3)  # The application accepts late
+            closed = server.closed, client.closed
+            reader = await server.accept_stream()
+            data = await reader.read()
+            await client.close()
+            await server.close()
+            return closed, data
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            closed, data = asyncio.run(asyncio.wait_for(run(), 30))
+        self.assertEqual(closed, (False, False), "A completed incoming stream must not close the connection")
+        self.assertEqual(data, b'hello world')
+
+    def test_reader_of_requested_stream(self):
+        """Test reading a stream requested by ID, and that an unfinished stream fails when the connection closes."""
+        async def run():
+            server, client, _ = await connect_pair()
+            reader = client.stream_reader(5)
+            writer = server.open_stream(5)
+            writer.write(b'partial')
+            first = await reader.read(100)
+            await server.close()
+            try:
+                await asyncio.wait_for(reader.read(100), 5)
+            except ConnectionResetError:
+                return first, True
+            return first, False
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            first, reset = asyncio.run(asyncio.wait_for(run(), 30))
+        self.assertEqual(first, b'partial')
+        self.assertTrue(reset, "Reading past what arrived fails once the connection is gone")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+# test_stream_scheduler.py
+
+import unittest
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from Frame import Frame, CLOSE
+from QuicConnection import QuicConnection
+from StreamScheduler import HeapScheduler, RoundRobin, WeightedFair, StrictPriority, ShortestRemainingFirst, STREAM_SCHEDULERS
+
+
+def fake_stream(stream_id, priority=0, weight=1, pending_bytes=10**9):
+    return SimpleNamespace(stream_id=stream_id, priority=priority, weight=weight, pending_bytes=pending_bytes,
+                           scheduled=False, finish_tag=0)
+
+
+def serve(scheduler, count, length=1000):
+    """Take count frames of length bytes and return the IDs of the streams they came from."""
+    order = []
+    for _ in range(count):
+        stream = scheduler.peek()
+        while stream.pending_bytes <= 0:  # Finished streams leave the ready list, as in send_packet
+            scheduler.pop()
+            stream = scheduler.peek()
+        order.append(stream.stream_id)
+        stream.pending_bytes -= length
+        scheduler.served(stream, length)
+    return order
+
+
+class TestStreamSchedulers(unittest.TestCase):
+
+    def test_round_robin_takes_turns(self):
+        """Test that round-robin serves one frame from each stream in turn."""
+        scheduler = RoundRobin()
+        for stream_id in (1, 2, 3):
+            scheduler.push(fake_stream(stream_id))
+        self.assertEqual(serve(scheduler, 6), [1, 2, 3, 1, 2, 3], "Streams should alternate")
+
+    def test_push_is_idempotent(self):
+        """Test that pushing a stream that is already ready does not duplicate it."""
+        for scheduler_class in STREAM_SCHEDULERS.values():
+            scheduler = scheduler_class()
+            stream = fake_stream(1)
+            scheduler.push(stream)
+            scheduler.push(stream)
+            self.assertEqual(len(scheduler), 1, f"{scheduler_class.__name__} listed a stream twice")
+            self.assertIs(scheduler.pop(), stream)
+            self.assertFalse(stream.scheduled, "A popped stream should no longer be marked ready")
+
+    def test_weighted_fair_shares_bytes_by_weight(self):
+        """Test that a stream with twice the weight gets twice the bytes."""
+        scheduler = WeightedFair()
+        scheduler.push(fake_stream(1, weight=2))
+        scheduler.push(fake_stream(2, weight=1))
+        order = serve(scheduler, 300)
+        self.assertAlmostEqual(order.count(1) / order.count(2), 2, delta=0.05, msg="Bandwidth should follow the weights")
+
+    def test_weighted_fair_newcomer_gets_no_burst(self):
+        """Test that a stream joining late starts at the current virtual time instead of catching up."""
+        scheduler = WeightedFair()
+        scheduler.push(fake_stream(1))
+        serve(scheduler, 50)
+        scheduler.push(fake_stream(2))
+        self.assertEqual(serve(scheduler, 4).count(2), 2, "The newcomer should share, not monopolize")
+
+    def test_strict_priority(self):
+        """Test that lower priority values go first and equal priorities take turns."""
+        scheduler = StrictPriority()
+        for stream_id, priority in ((1, 1), (2, 0), (3, 0)):
+            scheduler.push(fake_stream(stream_id, priority=priority))
+        self.assertEqual(serve(scheduler, 4), [2, 3, 2, 3], "Priority 0 streams should share the link")
+        scheduler.pop()
+        scheduler.pop()
+        self.assertEqual(scheduler.peek().stream_id, 1, "The lower priority stream goes once the others are done")
+
+    def test_shortest_remaining_first(self):
+        """Test that the stream with the fewest bytes left is served first."""
+        scheduler = ShortestRemainingFirst()
+        for stream_id, pending_bytes in ((1, 5000), (2, 2000), (3, 3500)):
+            scheduler.push(fake_stream(stream_id, pending_bytes=pending_bytes))
+        self.assertEqual(serve(scheduler, 6), [2, 2, 3, 3, 3, 3], "Shorter streams should finish first")
+
+    def test_unknown_scheduler(self):
+        with self.assertRaises(ValueError):
+            QuicConnection(scheduler="bogus")
+
+    def test_scheduler_without_key_fails_on_creation(self):
+        """Test that a heap scheduler missing key() cannot be created, rather than failing on its first push."""
+        class Unordered(HeapScheduler):
+            pass
+        with self.assertRaises(TypeError):
+            Unordered()
+        for name, scheduler_class in STREAM_SCHEDULERS.items():
+            with self.subTest(scheduler=name):
+                self.assertEqual(len(scheduler_class()), 0)
+
+
+class TestStreamSchedulerBenchmark(unittest.TestCase):
+    """Benchmark: stream completion times when many streams share one connection.
+
+    Every stream carries a random size (1-32 KB), priority and weight. Packets
+    are built by the real send_packet and completion is measured in bytes
+    sent on the connection when the stream's CLOSE frame leaves.
+    """
+
+    STREAM_COUNTS = (10, 100, 1000)
+    FRAME_SIZE = 1500
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def simulate(self, scheduler, stream_count):
+        rng = random.Random(stream_count)
+        connection = QuicConnection(congestion_control=None, scheduler=scheduler, path_mtu_discovery=False)
+        connection.r_con_id = 1
+        payload = bytes(self.FRAME_SIZE)
+        for stream_id in range(1, stream_count + 1):
+            stream = connection.new_stream(stream_id)
+            stream.priority = rng.randint(0, 7)
+            stream.weight = rng.randint(1, 4)
+            size = rng.randint(1, 32) * 1024
+            for offset in range(0, size, self.FRAME_SIZE):
+                stream.queue_frame(Frame(stream_id, payload[:min(self.FRAME_SIZE, size - offset)], offset))
+            stream.queue_frame(Frame(stream_id, b'', size, frame_type=CLOSE))
+            connection.stream_ready(stream)
+
+        completion = {}
+
+        async def record_packet(packet):
+            connection.bytes_sent += len(packet.to_bytes())
+            for frame in packet.frames:
+                if frame.frame_type == CLOSE:
+                    completion[frame.stream_id] = connection.bytes_sent
+
+        connection.send_packet_data = record_packet
+
+        async def run():
+            packets = 0
+            while await connection.send_packet():
+                packets += 1
+            return packets
+
+        start = time.perf_counter()
+        packets = self.loop.run_until_complete(run())
+        elapsed = time.perf_counter() - start
+        connection.sock.close()
+        return completion, packets, elapsed
+
+    def test_completion_time_distribution(self):
+        """Report completion times (in MB sent) and scheduling cost for each policy."""
+        print()
+        for stream_count in self.STREAM_COUNTS:
+            for scheduler in STREAM_SCHEDULERS:
+                completion, packets, elapsed = self.simulate(scheduler, stream_count)
+                self.assertEqual(len(completion), stream_count, f"{scheduler}: every stream should finish")
+
+                times = sorted(completion.values())
+                mean = sum(times) / len(times) / 2**20
+                p50 = times[len(times) // 2] / 2**20
+                p99 = times[int(len(times) * 0.99)] / 2**20
+                print(f"{stream_count:5} streams {scheduler:>14}: completion mean {mean:6.2f} MB, p50 {p50:6.2f} MB, "
+                      f"p99 {p99:6.2f} MB, {1e6 * elapsed / packets:5.1f} us/packet")
+
+if __name__ == "__main__":
+    unittest.main()
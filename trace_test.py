@@ -0,0 +1,178 @@
+# test_trace.py
+
+import unittest
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+from Trace import (Tracer, read_trace, PACKET_SENT, PACKET_RECEIVED, PACKET_LOST, METRICS_UPDATED,
+                   STREAM_STATE_UPDATED, CONNECTION_STATE_UPDATED, LOG_INFO)
+from Frame import Frame, ACK, CLOSE, MAX_STREAM_DATA
+from QuicConnection import QuicConnection
+from QuicServer import serve_connection
+from UdpRelay import UdpRelay
+from bench import run_transfer
+from file_generator import generate_files
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "trace.qlog")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ring_buffer_keeps_the_newest_events(self):
+        """Test that a full buffer overwrites its oldest unwritten events and counts them as dropped."""
+        tracer = Tracer(self.path, capacity=4)
+        for i in range(10):
+            tracer.log(f"message {i}")
+        asyncio.run(tracer.close())
+        header, events = read_trace(self.path)
+        self.assertEqual(header["qlog_format"], "NDJSON")
+        self.assertEqual(header["trace"]["vantage_point"]["type"], "client")
+        self.assertEqual([event["data"]["message"] for event in events], [f"message {i}" for i in range(6, 10)])
+        self.assertEqual(tracer.dropped, 6)
+
+    def test_packet_events(self):
+        """Test that packets are written as qlog packet events with their frames and no payloads."""
+        tracer = Tracer(self.path, vantage_point="server")
+        frames = [Frame(0, b'\x00' * 6, 250, frame_type=ACK), Frame(3, b'x' * 100, 4096),
+                  Frame(3, None, 4196, frame_type=CLOSE), Frame(3, None, 65536, frame_type=MAX_STREAM_DATA)]
+        tracer.packet_sent("1RTT", 7, 180, frames)
+        tracer.stream_state_updated(3, "data_sent")
+        asyncio.run(tracer.close())
+        _, (packet, stream) = read_trace(self.path)
+        self.assertEqual(packet["name"], PACKET_SENT)
+        self.assertEqual(packet["data"]["header"], {"packet_type": "1RTT", "packet_number": 7})
+        self.assertEqual(packet["data"]["raw"], {"length": 180})
+        self.assertEqual(packet["data"]["frames"], [
+            {"frame_type": "ack", "ack_delay": 0.25, "length": 6},
+            {"frame_type": "stream", "stream_id": 3, "offset": 4096, "length": 100, "fin": False},
+            {"frame_type": "stream", "stream_id": 3, "offset": 4196, "length": 0, "fin": True},
+            {"frame_type": "max_stream_data", "stream_id": 3, "maximum": 65536},
+        ])
+        self.assertEqual(stream["data"], {"stream_id": 3, "new": "data_sent"})
+        self.assertLessEqual(packet["time"], stream["time"])
+
+    def test_background_flush(self):
+        """Test that events reach the file while the connection runs, not only when it closes."""
+        async def run():
+            tracer = Tracer(self.path, flush_interval=0.01)
+            tracer.start()
+            tracer.log("first")
+            await asyncio.sleep(0.1)
+            with open(self.path) as f:
+                flushed = f.read()
+            await tracer.close()
+            return flushed
+        self.assertIn('"first"', asyncio.run(run()))
+
+
+class TestConnectionTrace(unittest.TestCase):
+    """Transfer files over a lossy relay with tracing on and read both traces back."""
+
+    STREAM_COUNT = 2
+    FILE_SIZE = 128 * 1024
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            with open(os.path.join(self.tmp_dir.name, f"file_{stream_id}.txt"), 'wb') as f:
+                f.write(os.urandom(self.FILE_SIZE))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def transfer(self):
+        trace_path = os.path.join(self.tmp_dir.name, "{con_id}.qlog")
+        server = QuicConnection(('127.0.0.1', 0), None, trace_path=trace_path)
+
+        async def serve():
+            await server.listen()
+            await serve_connection(server, self.tmp_dir.name)
+        server_task = asyncio.create_task(serve())
+        relay = UdpRelay(server.sock.getsockname(), 0.05, seed=3)
+        client = QuicConnection(r_addr=await relay.start(), trace_path=trace_path)
+        await client.connect()
+        await client.start_streams_request(self.STREAM_COUNT)
+        await client.wait_closed()
+        await server.close()
+        await server_task
+        relay.close()
+        return server, client
+
+    def test_transfer_trace(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            server, client = asyncio.run(asyncio.wait_for(self.transfer(), 60))
+        self.assertNotIn("reception completed", output.getvalue(), "Connection logging goes to the trace")
+
+        header, server_events = read_trace(os.path.join(self.tmp_dir.name, f"{server.con_id}.qlog"))
+        self.assertEqual(header["trace"]["vantage_point"]["type"], "server")
+        _, client_events = read_trace(os.path.join(self.tmp_dir.name, f"{client.con_id}.qlog"))
+        times = [event["time"] for event in client_events]
+        self.assertEqual(times, sorted(times))
+
+        def named(events, name):
+            return [event["data"] for event in events if event["name"] == name]
+
+        sent = named(server_events, PACKET_SENT)
+        self.assertEqual(len(sent), server.packet_number, "Every packet sent is traced")
+        self.assertEqual(len(named(client_events, PACKET_RECEIVED)), client.packets_received)
+        self.assertEqual(sent[0]["header"]["packet_type"], "initial", "The handshake answer comes first")
+        stream_bytes = sum(frame["length"] for packet in sent for frame in packet["frames"]
+                           if frame["frame_type"] == "stream" and frame.get("stream_id"))
+        self.assertGreaterEqual(stream_bytes, self.STREAM_COUNT * self.FILE_SIZE)
+
+        self.assertEqual(len(named(server_events, PACKET_LOST)), server.recovery.packets_lost)
+        self.assertGreater(server.recovery.packets_lost, 0, "The relay should have dropped some packets")
+        self.assertTrue(named(server_events, METRICS_UPDATED))
+
+        client_streams = named(client_events, STREAM_STATE_UPDATED)
+        for stream_id in range(1, self.STREAM_COUNT + 1):
+            self.assertIn({"stream_id": stream_id, "new": "open"}, client_streams)
+            self.assertIn({"stream_id": stream_id, "new": "data_received"}, client_streams)
+            self.assertIn({"stream_id": stream_id, "new": "data_sent"}, named(server_events, STREAM_STATE_UPDATED))
+        self.assertEqual(named(client_events, CONNECTION_STATE_UPDATED),
+                         [{"new": "handshake_complete"}, {"new": "closed"}])
+        self.assertIn({"message": "Stream 1 reception completed."}, named(client_events, LOG_INFO))
+
+
+class TestTraceOverhead(unittest.TestCase):
+    """Benchmark: what tracing costs per event and on a whole transfer, against tracing off."""
+
+    def test_overhead(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracer = Tracer(os.path.join(directory, "bench.qlog"))
+            frames = [Frame(0, b'\x00' * 8, 0, frame_type=ACK), Frame(1, b'x' * 1400, 0)]
+            rounds = 100000
+            start = time.perf_counter()
+            for i in range(rounds):
+                tracer.packet_sent("1RTT", i, 1450, frames)
+            record = (time.perf_counter() - start) / rounds
+            start = time.perf_counter()
+            tracer.take_lines()
+            write = (time.perf_counter() - start) / rounds
+            asyncio.run(tracer.close())
+
+            generate_files(os.path.join(directory, "files"), 4, 512 * 1024, 512 * 1024)
+            sizes = {i: 512 * 1024 for i in range(1, 5)}
+            cpu = {}
+            for traced in (False, True):
+                options = {"trace_path": os.path.join(directory, "{con_id}.qlog")} if traced else {}
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = asyncio.run(asyncio.wait_for(run_transfer(
+                        os.path.join(directory, "files"), sizes, 4, 8 * 1024, 0.0, **options), 60))
+                self.assertTrue(result["ok"])
+                cpu[traced] = result["cpu_ns_per_byte"]
+
+        print(f"\nTracing: record {1e9 * record:.0f} ns/packet, format and write {1e9 * write:.0f} ns/packet; "
+              f"transfer {cpu[False]:.1f} CPU ns/byte untraced, {cpu[True]:.1f} traced")
+
+if __name__ == "__main__":
+    unittest.main()
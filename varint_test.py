@@ -0,0 +1,81 @@
+# test_varint.py
+
+import unittest
+import time
+from Varint import VARINT_MAX, varint_size, pack_varint_into, unpack_varint_from, encode_varint
+from Frame import Frame, FRAME_H_SIZE
+
+
+class TestVarint(unittest.TestCase):
+
+    def test_boundaries(self):
+        """Test every length boundary of the encoding round-trips at the expected size."""
+        for value, size in ((0, 1), (0x3F, 1), (0x40, 2), (0x3FFF, 2), (0x4000, 4), (2**30 - 1, 4),
+                            (2**30, 8), (2**32, 8), (VARINT_MAX, 8)):
+            encoded = encode_varint(value)
+            self.assertEqual(len(encoded), size, f"Wrong size for {value}")
+            self.assertEqual(varint_size(value), size, f"varint_size disagrees for {value}")
+            self.assertEqual(unpack_varint_from(encoded), (value, size), f"Round trip failed for {value}")
+
+    def test_rfc_examples(self):
+        """Test the sample encodings from RFC 9000, appendix A.1."""
+        self.assertEqual(encode_varint(151288809941952652), bytes.fromhex("c2197c5eff14e88c"))
+        self.assertEqual(encode_varint(494878333), bytes.fromhex("9d7f3e7d"))
+        self.assertEqual(encode_varint(15293), bytes.fromhex("7bbd"))
+        self.assertEqual(encode_varint(37), bytes.fromhex("25"))
+        self.assertEqual(unpack_varint_from(bytes.fromhex("4025")), (37, 2), "Non-minimal encodings are accepted")
+
+    def test_overflow(self):
+        """Test that values beyond 62 bits are refused."""
+        with self.assertRaises(ValueError):
+            encode_varint(VARINT_MAX + 1)
+        with self.assertRaises(ValueError):
+            pack_varint_into(bytearray(8), 0, 2**64)
+
+    def test_pack_at_offset(self):
+        buffer = bytearray(16)
+        end = pack_varint_into(buffer, 3, 1000)
+        self.assertEqual(end, 5, "pack_varint_into should return the offset past the value")
+        self.assertEqual(unpack_varint_from(memoryview(buffer), 3), (1000, 5))
+
+
+class TestVarintBenchmark(unittest.TestCase):
+    """Micro-benchmark: frame header bytes and encode/decode rate, fixed against varint headers."""
+
+    FRAME_COUNT = 5000
+
+    def setUp(self):
+        # Typical traffic: few streams, offsets growing through a multi-megabyte transfer, 1 KB payloads
+        self.frames = [Frame(stream_id=1 + i % 4, data=b'x' * 1000, offset=(i // 4) * 1000)
+                       for i in range(self.FRAME_COUNT)]
+        self.buffer = bytearray(self.FRAME_COUNT * (FRAME_H_SIZE + 1000))
+
+    def encode(self, varint):
+        offset = 0
+        for frame in self.frames:
+            offset = frame.pack_into(self.buffer, offset, varint)
+        return offset
+
+    def decode(self, view, end, varint):
+        offset = 0
+        while offset < end:
+            _, offset = Frame.unpack_from(view, offset, varint)
+
+    def test_encode_decode_rate(self):
+        """Report header bytes per frame and frames/sec for both header formats."""
+        print()
+        view = memoryview(self.buffer)
+        for name, varint in (("fixed", False), ("varint", True)):
+            start = time.perf_counter()
+            end = self.encode(varint)
+            encode_rate = self.FRAME_COUNT / (time.perf_counter() - start)
+            start = time.perf_counter()
+            self.decode(view, end, varint)
+            decode_rate = self.FRAME_COUNT / (time.perf_counter() - start)
+            header_bytes = (end - self.FRAME_COUNT * 1000) / self.FRAME_COUNT
+            print(f"{name:>6} headers: {header_bytes:4.1f} bytes/frame, encode {encode_rate:,.0f} frames/sec, "
+                  f"decode {decode_rate:,.0f} frames/sec")
+        self.assertLess(header_bytes, FRAME_H_SIZE, "Varint headers should be smaller for typical frames")
+
+if __name__ == "__main__":
+    unittest.main()